@@ -0,0 +1,146 @@
+"""
+Benchmark character generation, editing and JSON extraction offline.
+
+Runs a corpus of prompts through generate_character, edit_character_keys and
+extract_json with the LLM behind the record/replay transport, and reports the
+JSON-validity rate, tokens and end-to-end timing per operation.
+
+Record the cassettes once with a live key, then replay them as often as needed:
+
+    TOGETHER_API_KEY=... python benchmarks/bench_generation.py --mode record
+    python benchmarks/bench_generation.py --latency lognormal:8:0.5
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+root_dir = Path(__file__).parent.parent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["record", "replay"], default="replay")
+    parser.add_argument("--corpus", default=str(root_dir / "benchmarks" / "corpus.json"))
+    parser.add_argument("--cassettes", default=str(root_dir / "benchmarks" / "cassettes"))
+    parser.add_argument("--latency", default="recorded",
+                        help='replayed latency: "none", "recorded" or "lognormal:<median seconds>:<sigma>"')
+    parser.add_argument("--generation-mode", choices=["monolithic", "sectioned"], default="monolithic")
+    parser.add_argument("--concurrency", type=int, default=1, help="corpus items run at the same time")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    return parser.parse_args()
+
+
+args = parse_args()
+# The transport is picked when src.llm_service is imported
+os.environ["LLM_TRANSPORT"] = args.mode
+os.environ["LLM_CASSETTE_DIR"] = args.cassettes
+os.environ["LLM_REPLAY_LATENCY"] = args.latency
+# Keep every run identical: no hedged duplicates and no cache hits between operations
+os.environ["LLM_HEDGING"] = "false"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+os.environ["GENERATION_CACHE_MONGO"] = "false"
+sys.path.insert(0, str(root_dir))
+
+from fastapi import HTTPException  # noqa: E402
+from src.types import CharacterRequest  # noqa: E402
+from src.instrumentation import current_request  # noqa: E402
+from src.llm_service import llm_transport  # noqa: E402
+from src.utils.stats import percentile  # noqa: E402
+from src.character import call_metrics, generate_character, edit_character_keys, extract_json  # noqa: E402
+
+OPERATIONS = ["generate", "edit", "extract"]
+
+
+def messy_response(character: dict) -> str:
+    """A generation wrapped in prose with its closing brace cut off, as models sometimes return it"""
+    return f"Here is the character file you asked for:\n```json\n{json.dumps(character, indent=2)[:-1]}\n```"
+
+
+async def timed(results: dict, operation: str, index: int, call):
+    """Run one operation, recording its outcome and end-to-end time"""
+    context = current_request.set({"request_id": f"{operation}-{index}", "endpoint": f"bench:{operation}"})
+    started = time.monotonic()
+    try:
+        result = await call()
+        outcome = "valid"
+    except HTTPException as e:
+        result, outcome = None, "invalid_json" if e.status_code == 422 else f"error {e.status_code}"
+    except ValueError:
+        result, outcome = None, "invalid_json"
+    except Exception as e:
+        result, outcome = None, f"error {type(e).__name__}"
+    finally:
+        current_request.reset(context)
+    results[operation].append({"index": index, "outcome": outcome, "seconds": time.monotonic() - started})
+    return result
+
+
+async def run_item(results: dict, index: int, item: dict, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        request = CharacterRequest(prompt=item["prompt"], mode=args.generation_mode)
+        generated = await timed(results, "generate", index, lambda: generate_character(request))
+        if generated is None:
+            return
+        character = generated.character_json
+        if item.get("edit"):
+            await timed(results, "edit", index, lambda: edit_character_keys(character, item["edit"]))
+        await timed(results, "extract", index, lambda: extract_json(messy_response(character)))
+
+
+def summarize(results: dict) -> dict:
+    metrics = call_metrics.stats()
+    report = {}
+    for operation in OPERATIONS:
+        runs = results[operation]
+        seconds = [run["seconds"] for run in runs]
+        endpoint = metrics.get(f"bench:{operation}", {})
+        histograms = endpoint.get("histograms", {})
+        report[operation] = {
+            "runs": len(runs),
+            "valid_rate": sum(run["outcome"] == "valid" for run in runs) / len(runs) if runs else None,
+            "outcomes": {outcome: sum(run["outcome"] == outcome for run in runs) for outcome in {run["outcome"] for run in runs}},
+            "seconds_p50": percentile(seconds, 0.5),
+            "seconds_p95": percentile(seconds, 0.95),
+            "seconds_mean": sum(seconds) / len(seconds) if seconds else None,
+            "llm_calls": endpoint.get("calls", 0),
+            "llm_call_outcomes": endpoint.get("outcomes", {}),
+            "prompt_tokens": histograms.get("prompt_tokens", {}).get("sum", 0),
+            "completion_tokens": histograms.get("completion_tokens", {}).get("sum", 0),
+            "cost": endpoint.get("cost", 0.0),
+        }
+    return report
+
+
+async def main():
+    corpus = json.loads(Path(args.corpus).read_text())
+    results = {operation: [] for operation in OPERATIONS}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    started = time.monotonic()
+    await asyncio.gather(*(run_item(results, i, item, semaphore) for i, item in enumerate(corpus)))
+    report = {
+        "mode": args.mode,
+        "latency": args.latency,
+        "corpus_items": len(corpus),
+        "wall_seconds": time.monotonic() - started,
+        "transport": llm_transport.counters,
+        "operations": summarize(results),
+    }
+
+    print(f"{'operation':<10}{'runs':>6}{'valid':>8}{'p50 s':>9}{'p95 s':>9}{'calls':>7}{'prompt tok':>12}{'compl tok':>11}")
+    for operation, row in report["operations"].items():
+        valid = f"{row['valid_rate']:.0%}" if row["valid_rate"] is not None else "-"
+        p50 = f"{row['seconds_p50']:.2f}" if row["seconds_p50"] is not None else "-"
+        p95 = f"{row['seconds_p95']:.2f}" if row["seconds_p95"] is not None else "-"
+        print(f"{operation:<10}{row['runs']:>6}{valid:>8}{p50:>9}{p95:>9}{row['llm_calls']:>7}"
+              f"{row['prompt_tokens']:>12.0f}{row['completion_tokens']:>11.0f}")
+    print(f"wall time {report['wall_seconds']:.2f}s, transport {report['transport']}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+Benchmark the S3 storage layer against a local S3 stand-in.
+
+Puts, reads back and deletes a batch of objects through src.storage.Storage
+and reports throughput with the per-operation latency percentiles. Without
+--endpoint, S3 is mocked in-process with moto, which measures the layer's
+own overhead; point --endpoint at minio (or any S3 API) for numbers closer
+to production:
+
+    python benchmarks/bench_storage.py --objects 200 --size 65536 --concurrency 16
+    python benchmarks/bench_storage.py --endpoint http://localhost:9000 --bucket bench
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+root_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(root_dir))
+
+from boto3.s3.transfer import TransferConfig  # noqa: E402
+from src.storage import Storage  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", help="S3 endpoint URL, S3 mocked in-process with moto when omitted")
+    parser.add_argument("--bucket", default="bench")
+    parser.add_argument("--objects", type=int, default=100)
+    parser.add_argument("--size", type=int, default=64 * 1024, help="bytes per object")
+    parser.add_argument("--concurrency", type=int, default=16, help="puts in flight at once")
+    parser.add_argument("--connections", type=int, default=32, help="S3 connection pool size")
+    parser.add_argument("--multipart-chunksize", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    return parser.parse_args()
+
+
+async def main(args):
+    storage = Storage(
+        args.bucket,
+        region="us-east-1",
+        endpoint_url=args.endpoint,
+        max_connections=args.connections,
+        transfer_config=TransferConfig(multipart_threshold=args.multipart_chunksize,
+                                       multipart_chunksize=args.multipart_chunksize)
+    )
+    try:
+        storage.client.create_bucket(Bucket=args.bucket)
+    except storage.client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    payload = os.urandom(args.size)
+    items = [{"key": f"bench/{i}.bin", "body": io.BytesIO(payload)} for i in range(args.objects)]
+    started = time.monotonic()
+    await storage.put_many(items, concurrency=args.concurrency)
+    put_seconds = time.monotonic() - started
+
+    started = time.monotonic()
+    await asyncio.gather(*(storage.get(item["key"]) for item in items[:args.concurrency]))
+    get_seconds = time.monotonic() - started
+
+    started = time.monotonic()
+    deleted = await storage.delete_prefix("bench/")
+    delete_seconds = time.monotonic() - started
+    storage.close()
+
+    report = {
+        "endpoint": args.endpoint or "moto",
+        "objects": args.objects,
+        "size": args.size,
+        "concurrency": args.concurrency,
+        "put_seconds": put_seconds,
+        "put_mb_per_second": args.objects * args.size / put_seconds / 1024 / 1024,
+        "get_seconds": get_seconds,
+        "delete_seconds": delete_seconds,
+        "deleted": deleted,
+        "storage": storage.stats(),
+    }
+    print(f"put {args.objects} x {args.size} bytes in {put_seconds:.2f}s ({report['put_mb_per_second']:.1f} MB/s), "
+          f"deleted {deleted} in {delete_seconds:.2f}s")
+    for operation, row in report["storage"]["operations"].items():
+        print(f"{operation:<16}{row['calls']:>6} calls  p50 {row['p50'] * 1000:8.1f} ms  p95 {row['p95'] * 1000:8.1f} ms")
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.endpoint:
+        asyncio.run(main(args))
+    else:
+        from moto import mock_aws
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+        with mock_aws():
+            asyncio.run(main(args))
@@ -1,24 +1,54 @@
 
 import os
 import re
+import time
+import asyncio
 import sys
 import json
+import hashlib
 import datetime
+import openai
 from pathlib import Path
 from loguru import logger
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from src.deploy import deploy_router
+from src.deploy import deploy_router, verified_address
 from src.deployment_service import DeploymentService
-from typing import Optional, List, Dict
-from fastapi import Form, UploadFile, File
-from langchain_together import ChatTogether
+from typing import Any, Awaitable, Optional, List, Dict, Tuple
+from fastapi import Form, UploadFile, File, Query
 from langchain.prompts import PromptTemplate
+from src.deploy import db
+from src.llm_service import DEFAULT_MODEL, TruncatedResponse, key_pool, invoke_llm, sample_llm, stream_llm
+from src.model_router import ModelRouter
+from src.hedging import Hedger
+from src.job_queue import JobQueue, FINISHED
+from src.draft_service import DraftService
+from src.retrieval import DocumentIndex
+from src.instrumentation import CallMetrics, current_request
+from src.generation_cache import GenerationCache
+from src.semantic_cache import SemanticCache
+from src.prompt_budget import PromptBudget
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi import APIRouter, HTTPException, Depends, FastAPI
-from src.utils.create_utility_template import create_utility_template
+from src.utils.create_utility_template import create_utility_template, UTILITY_TEMPLATE_VERSION, REQUIRED_CHARACTER_KEYS
 from src.utils.create_character_template import create_character_template
 from src.utils.edit_template import edit_character_template
-from src.types import CharacterRequest, CharacterResponse, CharacterEditResponse
+from src.utils.create_section_template import (
+    create_skeleton_template, create_section_template,
+    SKELETON_KEYS, SECTION_INSTRUCTIONS, SECTION_TEMPLATE_VERSION, SectionMerge
+)
+from src.utils.edit_context import select_edit_context, render_context
+from src.utils.edit_updates import parse_edit_updates, select_updates
+from src.utils.token_budget import count_tokens
+from src.utils.json_repair import parse_json_locally
+from src.utils.stream_parser import CharacterFieldParser
+from src.utils.sse import sse_event
+from src.utils.single_flight import SingleFlight
+from src.utils.diversity import diversity_score
+from src.types import (
+    Character, CharacterRequest, BatchCharacterRequest, CharacterResponse, CharacterCandidate, CharacterEditResponse,
+    DraftResponse, DraftEditResponse
+)
 
 # Get the parent directory of the current file (src/)
 current_dir = Path(__file__).parent
@@ -28,131 +58,964 @@ root_dir = current_dir.parent
 # Load .env from the root directory
 load_dotenv(root_dir / '.env')
 
-# Configure logging
-TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
-
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "512"))
+GENERATION_CACHE_TTL = int(os.getenv("GENERATION_CACHE_TTL", "86400"))
+GENERATION_CACHE_MONGO = os.getenv("GENERATION_CACHE_MONGO", "false").lower() == "true"
+# Input token budget for generation prompts, the example section is dropped above it
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+# Bounds for the per-call max_tokens estimate
+MIN_OUTPUT_TOKENS = int(os.getenv("MIN_OUTPUT_TOKENS", "256"))
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "16000"))
+# Token budget for the character context sent with an edit
+EDIT_CONTEXT_TOKEN_BUDGET = int(os.getenv("EDIT_CONTEXT_TOKEN_BUDGET", "3000"))
+# Calls with more input tokens than this move up to the next model tier
+SMALL_TIER_MAX_INPUT_TOKENS = int(os.getenv("SMALL_TIER_MAX_INPUT_TOKENS", "2000"))
+MEDIUM_TIER_MAX_INPUT_TOKENS = int(os.getenv("MEDIUM_TIER_MAX_INPUT_TOKENS", "8000"))
+# Tier escalations one generation or edit may use, across all of its LLM calls
+MAX_ESCALATIONS = int(os.getenv("MAX_ESCALATIONS", "2"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+# Most characters one generation request can ask for
+GENERATION_MAX_CANDIDATES = int(os.getenv("GENERATION_MAX_CANDIDATES", "5"))
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_AUDIT_RATE = float(os.getenv("SEMANTIC_CACHE_AUDIT_RATE", "0.05"))
+# Hedge generate/edit completions whose first token is slower than this TTFT percentile
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MAX_FRACTION = float(os.getenv("LLM_HEDGE_MAX_FRACTION", "0.1"))
+LLM_HEDGE_DEFAULT_THRESHOLD = float(os.getenv("LLM_HEDGE_DEFAULT_THRESHOLD", "5"))
+HEDGED_CALL_TYPES = ("generate", "edit")
+# Ground generations in the eliza_docs collection built by embedding.py
+RAG_ENABLED = os.getenv("RAG_ENABLED", "false").lower() == "true"
+RAG_PERSIST_DIRECTORY = os.getenv("RAG_PERSIST_DIRECTORY", "./data/chroma_db")
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "1500"))
+RAG_QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "256"))
+# Model name to [input, output] dollars per million tokens, for the per-call cost estimate
+LLM_PRICES = json.loads(os.getenv("LLM_PRICES", '{"meta-llama/Llama-3.3-70B-Instruct-Turbo": [0.88, 0.88]}'))
+# Worker coroutines draining the async job queue in each process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Seconds a claimed job stays leased without a heartbeat before another worker retries it
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "86400"))
+# Longest a GET /jobs/{job_id} long-poll may wait
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "50"))
+# Seconds a draft is kept after its last change
+DRAFT_TTL = int(os.getenv("DRAFT_TTL", str(7 * 86400)))
+# Job priority classes
+PRIORITY_REGISTERED = 10
+PRIORITY_ANONYMOUS = 0
 
 character_router = APIRouter()
 
-# Initialize Together AI client
+generation_cache = GenerationCache(
+    max_entries=GENERATION_CACHE_SIZE,
+    ttl=GENERATION_CACHE_TTL,
+    collection=db.generation_cache if GENERATION_CACHE_MONGO else None
+)
 
-llm = ChatTogether(
-    model="meta-llama/Llama-3.3-70B-Instruct-Turbo",
-    together_api_key=TOGETHER_API_KEY,
-    temperature=0.7,
-    max_tokens=16000
+prompt_budget = PromptBudget(
+    prompt_token_budget=PROMPT_TOKEN_BUDGET,
+    min_output_tokens=MIN_OUTPUT_TOKENS,
+    max_output_tokens=MAX_OUTPUT_TOKENS,
+    # Whether the example fits is decided before retrieval, assume the documents fill their budget
+    context_token_budget=RAG_CONTEXT_TOKEN_BUDGET if RAG_ENABLED else 0
 )
 
-def extract_json(response):
-    """Extract the JSON from the response"""
+model_router = ModelRouter(
+    models={
+        "small": os.getenv("TOGETHER_MODEL_SMALL") or DEFAULT_MODEL,
+        "medium": os.getenv("TOGETHER_MODEL_MEDIUM") or DEFAULT_MODEL,
+        "large": os.getenv("TOGETHER_MODEL_LARGE") or DEFAULT_MODEL,
+    },
+    small_max_input_tokens=SMALL_TIER_MAX_INPUT_TOKENS,
+    medium_max_input_tokens=MEDIUM_TIER_MAX_INPUT_TOKENS,
+    max_escalations=MAX_ESCALATIONS
+)
+
+hedger = Hedger(
+    percentile=LLM_HEDGE_PERCENTILE,
+    max_hedge_fraction=LLM_HEDGE_MAX_FRACTION,
+    default_threshold=LLM_HEDGE_DEFAULT_THRESHOLD
+) if LLM_HEDGING else None
+
+call_metrics = CallMetrics(prices=LLM_PRICES)
+
+# Identical in-flight generate/edit requests share one upstream call, the requests that
+# joined another's call get a record pointing at its request id
+single_flight = SingleFlight(owner=lambda: current_request.get()["request_id"], on_shared=call_metrics.coalesce)
+
+# Loaded at startup, see src/server.py
+document_index = DocumentIndex(
+    persist_directory=RAG_PERSIST_DIRECTORY,
+    top_k=RAG_TOP_K,
+    token_budget=RAG_CONTEXT_TOKEN_BUDGET,
+    cache_size=RAG_QUERY_CACHE_SIZE
+) if RAG_ENABLED else None
+
+# Models whose provider rejected or ignored `n`, their candidates come from parallel calls
+single_sample_models = set()
+
+semantic_cache = SemanticCache(
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_SIZE,
+    audit_rate=SEMANTIC_CACHE_AUDIT_RATE,
+    ttl=GENERATION_CACHE_TTL
+) if SEMANTIC_CACHE_ENABLED else None
+
+
+def build_messages(prompt: str) -> List:
+    """Wrap a prompt in the chat messages sent to the LLM"""
+    return [
+        (
+            "system",
+            "You are a helpful assistant.",
+        ),
+        (prompt)
+    ]
+
+
+class IncompleteCharacter(ValueError):
+    """Generated JSON parses but lacks required keys, the response was cut off"""
+
+
+def validate_character(data) -> Dict:
+    """Validate parsed JSON against the Character model and return it as a dict"""
+    if not isinstance(data, dict):
+        raise ValueError("Generated JSON is not an object")
+    # Fix keys with spacing, e.g. " bio" or "topics "
+    data = {str(key).strip(): value for key, value in data.items()}
+    missing = [key for key in REQUIRED_CHARACTER_KEYS if key not in data]
+    if missing:
+        raise IncompleteCharacter(f"Generated JSON is missing keys: {', '.join(missing)}")
+    return Character.model_validate(data).model_dump(exclude_unset=True)
+
+
+async def routed_completion(call_type: str, prompt: str, max_tokens: int, parse):
+    """
+    Run a completion on the model tier the router picks for this call type.
+
+    `parse` turns the response into the result and raises ValueError when it
+    is invalid, in which case the call is retried on the next larger tier.
+    The error of the last tier propagates. Nested calls (the JSON repair in
+    `parse`) share the escalation budget of the call. A response cut off at
+    max_tokens is retried with twice the max_tokens, up to MAX_OUTPUT_TOKENS.
+    Generate and edit calls are hedged when LLM_HEDGING is enabled.
+    """
+    prompt_tokens = count_tokens(prompt)
+    tier = model_router.route(call_type, prompt_tokens)
+    messages = build_messages(prompt)
+    with model_router.budget():
+        escalations = 0
+        while True:
+            started = time.monotonic()
+            model = model_router.model(tier)
+            record = call_metrics.start(call_type, model)
+            record.update(tier=tier, escalations=escalations)
+            try:
+                if hedger is not None and call_type in HEDGED_CALL_TYPES:
+                    # Each attempt streams into its own record, the one whose outcome is returned or
+                    # raised becomes the call's record and the discarded one is finished here
+                    records = []
+
+                    def start(on_send):
+                        attempt = record
+                        if records:
+                            attempt = call_metrics.start(call_type, model)
+                            attempt.update(tier=tier, escalations=escalations, hedge=True)
+                        records.append(attempt)
+                        return stream_llm(messages, max_tokens=max_tokens, model=model, request_class=call_type,
+                                          record=attempt, on_send=on_send)
+
+                    def discard(index, error):
+                        nonlocal record
+                        call_metrics.finish(records[index], "error" if error is not None else "hedge_cancelled")
+                        if index == 0:
+                            record = records[1]
+
+                    response = await hedger.run(start, prompt_tokens=prompt_tokens, on_discard=discard)
+                else:
+                    response = await invoke_llm(messages, max_tokens=max_tokens, model=model, request_class=call_type, record=record)
+            except HTTPException:
+                call_metrics.finish(record, "error")
+                raise
+            except TruncatedResponse:
+                call_metrics.finish(record, "truncated")
+                if max_tokens >= MAX_OUTPUT_TOKENS:
+                    raise
+                max_tokens = min(max_tokens * 2, MAX_OUTPUT_TOKENS)
+                logger.warning(f"{call_type} response was cut off, retrying with max_tokens={max_tokens}")
+                continue
+            except Exception:
+                call_metrics.finish(record, "error")
+                model_router.record(tier, time.monotonic() - started, False)
+                raise
+            latency = time.monotonic() - started
+            logger.info(response)
+
+            try:
+                result = await parse(response)
+            except ValueError:
+                call_metrics.finish(record, "invalid_json")
+                model_router.record(tier, latency, False)
+                larger = model_router.escalate(tier)
+                if larger is None:
+                    raise
+                tier = larger
+                escalations += 1
+                continue
+            except Exception:
+                # e.g. the nested JSON repair call failing, the record still has to be closed
+                call_metrics.finish(record, "error")
+                model_router.record(tier, latency, False)
+                raise
+            call_metrics.finish(record, "valid")
+            model_router.record(tier, latency, True)
+            return result
+
+
+async def extract_json(response, validate=validate_character) -> Tuple[Dict, str]:
+    """
+    Extract the character JSON from the response.
+
+    The JSON is recovered and repaired locally first, the LLM is only asked to
+    clean up the response when that fails. `validate` checks and shapes the
+    parsed JSON, its errors are raised for the caller to escalate since
+    cleaning up valid JSON won't fix them. Returns the result and the path
+    taken ("local" or "llm").
+    """
+    try:
+        data = parse_json_locally(response)
+    except ValueError as e:
+        logger.warning(f"Local JSON extraction failed, falling back to LLM: {str(e)}")
+    else:
+        return validate(data), "local"
+
     prompt = f"""RETURN only json from the below reponse, only one JSON.
     Fix keys with spacing if there are any.
     LLM Response:
     {response}
     """
-    messages = [
-            (
-                "system",
-                "You are a helpful assistant.",
-            ),
-            (prompt)
-            ]
-    ai_msg = llm.invoke(messages)               
-    response = ai_msg.content
-        
-    match = re.search(r'```json(.*?)```', response, re.DOTALL)
-    if match:
-        json_str = match.group(1).strip()
-        return json.loads(json_str)
+
+    async def parse(repaired: str):
+        return validate(parse_json_locally(repaired))
+
+    return await routed_completion("extract", prompt, prompt_budget.repair_tokens(response), parse), "llm"
+
+
+def generation_variant(request: CharacterRequest) -> Tuple[str, str]:
+    """Model and template version (mode, RAG, candidates) a generation request is served with"""
+    if request.mode == "sectioned":
+        template_version = f"sectioned-{SECTION_TEMPLATE_VERSION}"
     else:
-        return json.loads(response)
+        template_version = UTILITY_TEMPLATE_VERSION
+        if not prompt_budget.includes_example(request):
+            template_version += "-noexample"
+    if document_index is not None:
+        template_version += "-rag"
+    if request.candidates > 1:
+        template_version += f"-n{request.candidates}"
+    return model_router.model("large"), template_version
 
 
+def generation_cache_key(request: CharacterRequest) -> str:
+    """Exact-match cache key for a generation request"""
+    return GenerationCache.make_key(request.prompt, *generation_variant(request))
 
-@character_router.post("/generate_character", response_model=CharacterResponse)
-async def generate_utility(request: CharacterRequest):
-    """Generate a character.json based on the request"""
-    # """Generate a character.json based on the request and RAG context."""
+
+def semantic_partition(request: CharacterRequest) -> str:
+    """Semantic cache partition, only prompts generated the same way match each other"""
+    return "\x1f".join(generation_variant(request))
+
+
+async def retrieve_context(request: CharacterRequest) -> Optional[List[str]]:
+    """ElizaOS documentation relevant to the request, None when retrieval is disabled"""
+    if document_index is None:
+        return None
+    return await document_index.retrieve(request.prompt)
+
+
+async def lookup_cached_character(request: CharacterRequest, cache_key: str) -> Tuple[Optional[CharacterResponse], Any]:
+    """
+    Look the request up in the exact-match cache, then in the semantic cache.
+    Also returns the prompt's embedding, if one was made, for remember_character.
+    """
+    cached, tier = await generation_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Serving character from {tier} cache")
+        return CharacterResponse(**cached, cache=tier), None
+
+    if semantic_cache is not None:
+        match, prompt_vector = await semantic_cache.lookup(request.prompt, semantic_partition(request))
+        if match is not None:
+            cached, score = match
+            logger.info(f"Serving character from semantic cache (similarity {score:.3f})")
+            return CharacterResponse(**cached, cache="semantic"), prompt_vector
+        return None, prompt_vector
+    return None, None
+
+
+async def remember_character(request: CharacterRequest, cache_key: str, value: Dict, prompt_vector: Any = None) -> None:
+    """Store a fresh generation in every cache"""
+    await generation_cache.set(cache_key, value)
+    if semantic_cache is not None:
+        await semantic_cache.add(request.prompt, value, semantic_partition(request), prompt_vector)
+
+
+async def generate_section_json(call_type: str, prompt: str, keys: List[str]) -> Tuple[Dict, str]:
+    """Run one sub-completion of a sectioned generation and pick its keys out"""
+    return await routed_completion(
+        call_type, prompt, prompt_budget.output_tokens(keys),
+        lambda response: extract_updates(response, keys)
+    )
+
+
+async def iter_character_sections(request: CharacterRequest):
+    """
+    Generate a character section by section.
+
+    Yields the identity skeleton first, then every other section as soon as
+    its completion is parsed. The sections run concurrently, so wall-clock
+    time is the skeleton plus the slowest section.
+    """
+    skeleton_prompt = create_skeleton_template(request, await retrieve_context(request))
+    # The sections copy the budget when their tasks are created, it isn't held across the yields
+    with model_router.budget():
+        skeleton = await generate_section_json("skeleton", skeleton_prompt, SKELETON_KEYS)
+        fields, _ = skeleton
+        tasks = [
+            asyncio.create_task(generate_section_json("section", create_section_template(request, fields, section), [section]))
+            for section in SECTION_INSTRUCTIONS
+        ]
     try:
-        # Retrieve relevant context from vector store
-        # query = f"Find example character.json structures and patterns for a character named {request.name}"
-        # result = qa_chain({"query": query})
-        
-        # Create generation prompt
-        # prompt = create_character_template(request, result['source_documents'])
-        prompt = create_utility_template(request)
-        # Generate character JSON
-        logger.info("Sending prompt")
-        # response = llm(prompt)
-        messages = [
-            (
-                "system",
-                "You are a helpful assistant.",
-            ),
-            (prompt)
-            ]
-        ai_msg = llm.invoke(messages)               
-        response = ai_msg.content
-        
-        
-        # Parse and validate the generated JSON
+        yield skeleton
+        for next_section in asyncio.as_completed(tasks):
+            yield await next_section
+    finally:
+        # A failed section fails the character, stop the others
+        for task in tasks:
+            task.cancel()
+
+
+async def generate_character_sections(request: CharacterRequest) -> Tuple[Dict, str]:
+    """Generate and merge all sections, over the keys no section generates, into one validated character"""
+    merge = SectionMerge()
+    async for fields, json_extraction in iter_character_sections(request):
+        merge.add(fields, json_extraction)
+    return validate_character(merge.character), merge.json_extraction
+
+
+def rejects_n(error: openai.BadRequestError) -> bool:
+    """Whether the provider rejected the request because of its `n` parameter"""
+    body = error.body if isinstance(error.body, dict) else {}
+    body = body.get("error", body) if isinstance(body.get("error"), dict) else body
+    if body.get("param") == "n":
+        return True
+    # e.g. "n must be 1" or "'n' is not supported", not an unrelated bad request
+    return re.search(r"\bn\b", str(body.get("message") or error.message)) is not None
+
+
+async def sample_candidates(tier: str, messages, n: int, max_tokens: int) -> List:
+    """
+    One generate call returning up to n responses, each validated concurrently.
+    Returns a (character_json, json_extraction) tuple or the exception per response.
+    """
+    async def parse(response):
+        if isinstance(response, TruncatedResponse):
+            raise response
+        return await extract_json(response)
+
+    model = model_router.model(tier)
+    record = call_metrics.start("generate", model)
+    record.update(tier=tier, candidates=n)
+    started = time.monotonic()
+    try:
+        if n == 1:
+            try:
+                responses = [await invoke_llm(messages, max_tokens=max_tokens, model=model, request_class="generate", record=record)]
+            except TruncatedResponse as e:
+                responses = [e]
+        else:
+            responses = await sample_llm(messages, n, max_tokens=max_tokens, model=model, request_class="generate", record=record)
+    except Exception:
+        call_metrics.finish(record, "error")
+        raise
+    latency = time.monotonic() - started
+    results = await asyncio.gather(*(parse(response) for response in responses), return_exceptions=True)
+    valid = any(isinstance(result, tuple) for result in results)
+    call_metrics.finish(record, "valid" if valid else "invalid_json")
+    model_router.record(tier, latency, valid)
+    return results
+
+
+async def generate_candidates(request: CharacterRequest) -> CharacterResponse:
+    """
+    Generate `request.candidates` characters for one prompt.
+
+    The prompt is built and the documentation retrieved once. Monolithic
+    candidates are sampled in one call with the provider's `n`, falling back
+    to parallel calls for models that don't support it; sectioned candidates
+    are parallel sectioned generations. Invalid candidates are dropped.
+    """
+    n = request.candidates
+    if n > GENERATION_MAX_CANDIDATES:
+        raise HTTPException(status_code=400, detail=f"A request can ask for at most {GENERATION_MAX_CANDIDATES} candidates")
+    logger.info(f"Generating {n} candidate characters")
+
+    # All candidates share one escalation budget
+    with model_router.budget():
+        if request.mode == "sectioned":
+            results = await asyncio.gather(*(generate_character_sections(request) for _ in range(n)), return_exceptions=True)
+        else:
+            prompt = prompt_budget.generation_prompt(request, await retrieve_context(request))
+            tier = model_router.route("generate", count_tokens(prompt))
+            model = model_router.model(tier)
+            messages = build_messages(prompt)
+            max_tokens = prompt_budget.output_tokens()
+            results = []
+            if model not in single_sample_models:
+                try:
+                    results = await sample_candidates(tier, messages, n, max_tokens)
+                except openai.BadRequestError as e:
+                    if not rejects_n(e):
+                        raise
+                    logger.warning(f"{model} rejected n={n}, sampling candidates in parallel: {str(e)}")
+                    single_sample_models.add(model)
+                else:
+                    if len(results) < n:
+                        logger.warning(f"{model} ignored n={n}, sampling the other candidates in parallel")
+                        single_sample_models.add(model)
+            calls = await asyncio.gather(
+                *(sample_candidates(tier, messages, 1, max_tokens) for _ in range(n - len(results))),
+                return_exceptions=True
+            )
+            for call in calls:
+                results += call if isinstance(call, list) else [call]
+
+    valid = [result for result in results if isinstance(result, tuple)]
+    if not valid:
+        errors = [result for result in results if isinstance(result, HTTPException)]
+        if errors:
+            raise errors[0]
+        if not any(isinstance(result, ValueError) for result in results):
+            raise results[0]
+        raise HTTPException(status_code=422, detail="Generated invalid JSON")
+    logger.info(f"{len(valid)} of {n} candidates are valid")
+    candidates = [CharacterCandidate(character_json=character_json, json_extraction=json_extraction)
+                  for character_json, json_extraction in valid]
+    return CharacterResponse(
+        character_json=candidates[0].character_json,
+        json_extraction=candidates[0].json_extraction,
+        candidates=candidates,
+        diversity=diversity_score([candidate.character_json for candidate in candidates])
+    )
+
+
+async def generate_character(request: CharacterRequest) -> CharacterResponse:
+    """Generate a character.json for the request, serving repeated prompts from the caches"""
+    if request.candidates > 1:
+        # The caches hold one character per prompt
+        return await generate_candidates(request)
+
+    cache_key = generation_cache_key(request)
+    cached, prompt_vector = await lookup_cached_character(request, cache_key)
+    if cached is not None:
+        return cached
+
+    if request.mode == "sectioned":
+        logger.info("Generating character in sections")
         try:
-            logger.info(response)
-            character_json = extract_json(response)
-            # with open(f"characters/{character_json['name']}_{'{date:%Y-%m-%d_%H:%M:%S}.txt'.format( date=datetime.datetime.now() )}.json", "w+") as f:
-            #     json.dump(character_json, f, indent=2)
-        except json.JSONDecodeError:
+            character_json, json_extraction = await generate_character_sections(request)
+        except ValueError:
             raise HTTPException(status_code=422, detail="Generated invalid JSON")
-        
-        # Return response with character JSON and sources
-        return CharacterResponse(
-            character_json=character_json,
-            # reference_sources=[doc.metadata['source'] for doc in result['source_documents']]
+        await remember_character(request, cache_key, {"character_json": character_json, "json_extraction": json_extraction},
+                                 prompt_vector)
+        return CharacterResponse(character_json=character_json, json_extraction=json_extraction)
+
+    # Create generation prompt, grounded in the retrieved ElizaOS documentation
+    prompt = prompt_budget.generation_prompt(request, await retrieve_context(request))
+    # Generate character JSON
+    logger.info("Sending prompt")
+    # Parse and validate the generated JSON
+    try:
+        character_json, json_extraction = await routed_completion(
+            "generate", prompt, prompt_budget.output_tokens(), extract_json
         )
-        
+        logger.info(f"Character JSON extracted via {json_extraction} path")
+        # with open(f"characters/{character_json['name']}_{'{date:%Y-%m-%d_%H:%M:%S}.txt'.format( date=datetime.datetime.now() )}.json", "w+") as f:
+        #     json.dump(character_json, f, indent=2)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Generated invalid JSON")
+    
+    await remember_character(request, cache_key, {"character_json": character_json, "json_extraction": json_extraction},
+                             prompt_vector)
+    # Return response with character JSON and sources
+    return CharacterResponse(
+        character_json=character_json,
+        json_extraction=json_extraction,
+        # reference_sources=[doc.metadata['source'] for doc in result['source_documents']]
+    )
+
+
+@character_router.post("/generate_character", response_model=CharacterResponse)
+async def generate_utility(request: CharacterRequest, async_mode: bool = Query(False, alias="async")):
+    """
+    Generate a character.json based on the request.
+    With ?async=true the generation is queued and a job id returned right away.
+    """
+    # """Generate a character.json based on the request and RAG context."""
+    try:
+        if async_mode:
+            address = verified_address(request.address, request.message, request.signature)
+            return await enqueue_job("generate", request.model_dump(exclude={"message", "signature"}), address)
+        # Duplicate submissions of the same prompt share one generation
+        return await single_flight.do(generation_cache_key(request), lambda: generate_character(request))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating character: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def generate_batch_item(index: int, request: CharacterRequest, semaphore: asyncio.Semaphore) -> Dict:
+    """Generate one batch item, turning its failure into a per-item error"""
+    async with semaphore:
+        try:
+            result = await single_flight.do(generation_cache_key(request), lambda: generate_character(request))
+            return {"index": index, "status_code": 200, "result": result.model_dump()}
+        except HTTPException as e:
+            return {"index": index, "status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.error(f"Error generating batch item {index}: {str(e)}")
+            return {"index": index, "status_code": 500, "detail": str(e)}
+
+
+async def stream_batch_events(batch: BatchCharacterRequest):
+    """Fan the batch out and emit an "item" event per result as it completes, then "done" """
+    concurrency = min(batch.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.create_task(generate_batch_item(index, request, semaphore))
+        for index, request in enumerate(batch.requests)
+    ]
+    succeeded = 0
+    try:
+        for next_item in asyncio.as_completed(tasks):
+            item = await next_item
+            succeeded += item["status_code"] == 200
+            yield sse_event("item", item)
+        yield sse_event("done", {"total": len(tasks), "succeeded": succeeded, "failed": len(tasks) - succeeded})
+    finally:
+        # Client went away, stop the rest of the batch
+        for task in tasks:
+            task.cancel()
+
+
+@character_router.post("/generate_character/batch")
+async def generate_utility_batch(batch: BatchCharacterRequest):
+    """Generate many characters concurrently, streaming each result as server-sent events"""
+    if len(batch.requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {BATCH_MAX_ITEMS} requests")
+    logger.info(f"Generating batch of {len(batch.requests)} characters")
+    return StreamingResponse(
+        stream_batch_events(batch),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@character_router.get("/generate_character/stats")
+async def generation_stats():
+    """Report generation cache statistics"""
+    return {
+        "cache": generation_cache.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "single_flight": single_flight.stats(),
+        "prompt_budget": prompt_budget.stats(),
+        "hedging": hedger.stats() if hedger is not None else None,
+        "retrieval": document_index.stats() if document_index is not None else None,
+        "model_router": model_router.stats(),
+        "key_pool": key_pool.stats(),
+    }
+
+
+def edit_flight_key(updates: Dict[str, str], content_hash: str) -> str:
+    """Identity of an edit request, used to coalesce duplicates"""
+    raw = "\x1f".join(["edit", json.dumps(updates, sort_keys=True), content_hash])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def extract_updates(response: str, keys: List[str]) -> Tuple[Dict, str]:
+    """Extract the JSON of the given keys from a response, see extract_json"""
+    return await extract_json(response, lambda data: select_updates(data, keys))
+
+
+async def edit_response(extraction: Awaitable[Tuple[Dict, str]]) -> CharacterEditResponse:
+    """Await the extraction of the edited keys, 422 when no valid JSON came out of it"""
+    try:
+        update, json_extraction = await extraction
+        logger.info(f"Edited keys extracted via {json_extraction} path")
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Generated invalid JSON")
+    return CharacterEditResponse(update=update, json_extraction=json_extraction)
+
+
+async def parse_edit_response(response: str, updates: Dict[str, str]) -> CharacterEditResponse:
+    """Parse the edited sections returned by the LLM into JSON per key"""
+    return await edit_response(extract_updates(response, list(updates)))
+
+
+def build_edit_prompt(json_content: Dict, updates: Dict[str, str]) -> Tuple[str, int]:
+    """Render the edit prompt with only the context the edited keys need, and its max_tokens"""
+    context = select_edit_context(json_content, list(updates), EDIT_CONTEXT_TOKEN_BUDGET)
+    full_tokens = count_tokens(render_context(json_content))
+    context_tokens = count_tokens(render_context(context))
+    logger.info(f"Edit context uses {context_tokens} of {full_tokens} character tokens, saved {full_tokens - context_tokens}")
+    max_tokens = prompt_budget.output_tokens(list(updates), current=json_content)
+    return edit_character_template(context, updates), max_tokens
+
+
+async def edit_character_keys(json_content: Dict, updates: Dict[str, str]) -> CharacterEditResponse:
+    """Ask the LLM for updated versions of all requested keys in a single completion"""
+    prompt, max_tokens = build_edit_prompt(json_content, updates)
+    # Generate character JSON
+    logger.info(f"Sending prompt to edit {', '.join(updates)}")
+    return await edit_response(routed_completion(
+        "edit", prompt, max_tokens, lambda response: extract_updates(response, list(updates))
+    ))
+
+
 @character_router.post("/edit_character", response_model=CharacterEditResponse)
-async def edit_character( prompt: str = Form(...),
-    update_key: str = Form(...),
-    character: UploadFile = File(...)):
-    """Generate a character.json based on the request"""
-    # """Generate a character.json based on the request and RAG context."""
+async def edit_character(prompt: Optional[str] = Form(None),
+    update_key: Optional[str] = Form(None),
+    updates: Optional[str] = Form(None),
+    address: Optional[str] = Form(None),
+    message: Optional[str] = Form(None),
+    signature: Optional[str] = Form(None),
+    character: UploadFile = File(...),
+    async_mode: bool = Query(False, alias="async")):
+    """
+    Edit one or more keys of a character.json.
+
+    Either `prompt` + `update_key` for a single key, or `updates` as a JSON
+    object mapping each key to its own instructions. With ?async=true the
+    edit is queued and a job id returned right away, ahead of anonymous ones
+    when `message` is signed by a registered `address`.
+    """
     try:
+        updates = parse_edit_updates(prompt, update_key, updates)
+        address = verified_address(address, message, signature) if async_mode else None
         content, content_hash, json_content = await DeploymentService.process_character_file(character)
         logger.info(json_content)
-        prompt = edit_character_template(json_content, update_key, prompt)
-        # Generate character JSON
-        logger.info("Sending prompt")
-        # response = llm(prompt)
-        messages = [
-            (
-                "system",
-                "You are a helpful assistant.",
-            ),
-            (prompt)
-            ]
-        ai_msg = llm.invoke(messages)               
-        response = ai_msg.content
-        
-        
-        # Parse and validate the generated JSON
-        try:
-            logger.info(response)
-            # edited_key_json = extract_json(response)
-            # with open(f"characters/{character_json['name']}_{'{date:%Y-%m-%d_%H:%M:%S}.txt'.format( date=datetime.datetime.now() )}.json", "w+") as f:
-            #     json.dump(character_json, f, indent=2)
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=422, detail="Generated invalid JSON")
-        
-        # Return response with character JSON and sources
-        return CharacterEditResponse(
-            update={update_key: response}        
+        if async_mode:
+            payload = {"character": json_content, "content_hash": content_hash, "updates": updates}
+            return await enqueue_job("edit", payload, address)
+        # Duplicate submissions of the same edit share one LLM call
+        return await single_flight.do(
+            edit_flight_key(updates, content_hash),
+            lambda: edit_character_keys(json_content, updates)
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating character: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def owned_draft(draft_service: DraftService, draft_id: str, address: str, message: str, signature: str) -> Dict:
+    """The draft, once `message` is checked as signed by the address that created it"""
+    address = verified_address(address, message, signature)
+    draft = await draft_service.get_draft(draft_id)
+    await draft_service.verify_draft_ownership(address, draft)
+    return draft
+
+
+@character_router.post("/drafts", response_model=DraftResponse)
+async def create_draft(character: UploadFile = File(...),
+    address: str = Form(...),
+    message: str = Form(...),
+    signature: str = Form(...)):
+    """Upload a character.json once to edit it server-side, owned by the address that signed `message`"""
+    address = verified_address(address, message, signature)
+    content, content_hash, json_content = await DeploymentService.process_character_file(character)
+    draft = await DraftService(db, ttl=DRAFT_TTL).create_draft(json_content, address)
+    return DraftService.view(draft)
+
+
+@character_router.get("/drafts/{draft_id}", response_model=DraftResponse)
+async def get_draft(draft_id: str, address: str = Query(...), message: str = Query(...), signature: str = Query(...)):
+    """Current character of a draft and the patches applied to it"""
+    return DraftService.view(await owned_draft(DraftService(db, ttl=DRAFT_TTL), draft_id, address, message, signature))
+
+
+@character_router.post("/drafts/{draft_id}/edit", response_model=DraftEditResponse)
+async def edit_draft(draft_id: str,
+    prompt: Optional[str] = Form(None),
+    update_key: Optional[str] = Form(None),
+    updates: Optional[str] = Form(None),
+    version: Optional[int] = Form(None),
+    address: str = Form(...),
+    message: str = Form(...),
+    signature: str = Form(...)):
+    """
+    Edit one or more keys of a draft and apply the result as a new version.
+
+    Takes the same instructions as /edit_character without the file. `version`
+    is the draft version the client is looking at, the edit fails with 409
+    when the draft has moved on since.
+    """
+    draft_service = DraftService(db, ttl=DRAFT_TTL)
+    try:
+        updates = parse_edit_updates(prompt, update_key, updates)
+        draft = await owned_draft(draft_service, draft_id, address, message, signature)
+        if version is not None and version != draft["version"]:
+            raise HTTPException(status_code=409, detail=f"Draft {draft_id} is at version {draft['version']}, not {version}")
+        result = await single_flight.do(
+            edit_flight_key(updates, draft["content_hash"]),
+            lambda: edit_character_keys(draft["character"], updates)
+        )
+        draft = await draft_service.apply_patch(draft, updates, result.update)
+        return DraftEditResponse(
+            draft_id=draft_id,
+            version=draft["version"],
+            update=result.update,
+            json_extraction=result.json_extraction
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error editing draft: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@character_router.get("/metrics/llm")
+async def llm_metrics():
+    """Per-endpoint LLM call histograms, outcomes and cost"""
+    return call_metrics.stats()
+
+
+@character_router.get("/metrics/llm/requests/{request_id}")
+async def llm_request_metrics(request_id: str):
+    """
+    LLM call records of one request (the X-Request-ID response header) or job. A request
+    that shared another's in-flight call has a "coalesced" record with that request's id
+    """
+    records = call_metrics.request(request_id)
+    if records is None:
+        raise HTTPException(status_code=404, detail=f"No LLM calls recorded for request {request_id}")
+    return records
+
+
+async def run_generate_job(payload: Dict) -> Dict:
+    request = CharacterRequest(**payload)
+    result = await single_flight.do(generation_cache_key(request), lambda: generate_character(request))
+    return result.model_dump()
+
+
+async def run_edit_job(payload: Dict) -> Dict:
+    updates = payload["updates"]
+    result = await single_flight.do(
+        edit_flight_key(updates, payload["content_hash"]),
+        lambda: edit_character_keys(payload["character"], updates)
+    )
+    return result.model_dump()
+
+
+job_queue = JobQueue(
+    db.jobs,
+    handlers={"generate": run_generate_job, "edit": run_edit_job},
+    lease_seconds=JOB_LEASE_SECONDS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    result_ttl=JOB_RESULT_TTL
+)
+
+
+async def enqueue_job(kind: str, payload: Dict, address: Optional[str]) -> JSONResponse:
+    """
+    Queue a job, registered wallets ahead of anonymous prompts, and answer 202
+    with its id. `address` must already be verified with verified_address.
+    """
+    registered = address is not None and await db.users.find_one({"address": address}) is not None
+    priority = PRIORITY_REGISTERED if registered else PRIORITY_ANONYMOUS
+    job_id = await job_queue.enqueue(kind, payload, priority)
+    logger.info(f"Queued {kind} job {job_id} with priority {priority}")
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+
+
+@character_router.get("/jobs/stats")
+async def job_stats():
+    """Report job queue depth and wait times"""
+    return await job_queue.stats()
+
+
+@character_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = Query(0, ge=0)):
+    """Status and result of a job, waiting up to `wait` seconds for it to finish"""
+    job = await job_queue.wait(job_id, min(wait, JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JobQueue.view(job)
+
+
+async def stream_job_events(job_id: str):
+    """Send the job status, then its result or error once it finishes"""
+    job = await job_queue.wait(job_id, 0)
+    # The job may have expired since the endpoint checked it exists
+    if job is not None:
+        yield sse_event("status", {"job_id": job_id, "status": job["status"]})
+    while job is not None and job["status"] not in FINISHED:
+        job = await job_queue.wait(job_id, 15)
+        if job is not None and job["status"] not in FINISHED:
+            # Keep proxies from closing an idle connection
+            yield ": keepalive\n\n"
+    if job is None:
+        yield sse_event("error", {"status_code": 404, "detail": f"Job {job_id} not found"})
+    elif job["status"] == "done":
+        yield sse_event("result", job["result"])
+    else:
+        yield sse_event("error", job["error"])
+
+
+@character_router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Subscribe to a job as server-sent events"""
+    if await job_queue.wait(job_id, 0) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return StreamingResponse(
+        stream_job_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def stream_cached_character(response: CharacterResponse):
+    """Replay a cached character as the same events a live generation would send"""
+    for key, value in response.character_json.items():
+        yield sse_event("field", {"key": key, "value": value})
+    yield sse_event("result", response.model_dump())
+
+
+def error_event(e: Exception) -> str:
+    """Turn a failure in the middle of a stream into an "error" event"""
+    if isinstance(e, HTTPException):
+        return sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+    if isinstance(e, TruncatedResponse):
+        return sse_event("error", {"status_code": 422, "detail": "Generated JSON was cut off at max_tokens"})
+    if isinstance(e, ValueError):
+        return sse_event("error", {"status_code": 422, "detail": "Generated invalid JSON"})
+    logger.error(f"Error streaming character: {str(e)}")
+    return sse_event("error", {"status_code": 500, "detail": str(e)})
+
+
+async def stream_character_events(messages, max_tokens: int, model: str, build_result):
+    """
+    Run a streamed completion and turn it into server-sent events.
+
+    Emits a "token" event per chunk, a "field" event for every top-level key
+    as soon as its value closes, then a single "result" event built from the
+    full response by `build_result` (or an "error" event).
+    """
+    parser = CharacterFieldParser()
+    chunks = []
+    record = call_metrics.start("stream", model)
+    try:
+        async for text in stream_llm(messages, max_tokens=max_tokens, model=model, request_class="stream", record=record):
+            chunks.append(text)
+            yield sse_event("token", {"text": text})
+            for key, value in parser.feed(text):
+                yield sse_event("field", {"key": key, "value": value})
+
+        response = "".join(chunks)
+        logger.info(response)
+        result = await build_result(response)
+        call_metrics.finish(record, "valid")
+        yield sse_event("result", result.model_dump())
+
+    except Exception as e:
+        invalid_json = isinstance(e, ValueError) or (isinstance(e, HTTPException) and e.status_code == 422)
+        call_metrics.finish(record, "invalid_json" if invalid_json else "error")
+        yield error_event(e)
+
+
+async def stream_sectioned_character(request: CharacterRequest, cache_key: str, prompt_vector: Any = None):
+    """
+    Emit a "field" event per key as each section of a sectioned generation
+    completes, after one for each default a section may override
+    """
+    merge = SectionMerge()
+    try:
+        for key, value in merge.character.items():
+            yield sse_event("field", {"key": key, "value": value})
+        async for fields, json_extraction in iter_character_sections(request):
+            merge.add(fields, json_extraction)
+            for key, value in fields.items():
+                yield sse_event("field", {"key": key, "value": value})
+
+        character_json = validate_character(merge.character)
+        json_extraction = merge.json_extraction
+        await remember_character(request, cache_key, {"character_json": character_json, "json_extraction": json_extraction},
+                                 prompt_vector)
+        yield sse_event("result", CharacterResponse(character_json=character_json, json_extraction=json_extraction).model_dump())
+
+    except Exception as e:
+        yield error_event(e)
+
+
+@character_router.post("/generate_character/stream")
+async def generate_utility_stream(request: CharacterRequest):
+    """Stream the generation of a character.json as server-sent events"""
+    if request.candidates > 1:
+        raise HTTPException(status_code=400, detail="Candidates can't be streamed, use /generate_character")
+    cache_key = generation_cache_key(request)
+    cached, prompt_vector = await lookup_cached_character(request, cache_key)
+    if cached is not None:
+        events = stream_cached_character(cached)
+    elif request.mode == "sectioned":
+        logger.info("Streaming character in sections")
+        events = stream_sectioned_character(request, cache_key, prompt_vector)
+    else:
+        prompt = prompt_budget.generation_prompt(request, await retrieve_context(request))
+        logger.info("Sending streaming prompt")
+
+        async def build_result(response: str) -> CharacterResponse:
+            character_json, json_extraction = await extract_json(response)
+            logger.info(f"Character JSON extracted via {json_extraction} path")
+            await remember_character(request, cache_key, {"character_json": character_json, "json_extraction": json_extraction},
+                                     prompt_vector)
+            return CharacterResponse(character_json=character_json, json_extraction=json_extraction)
+
+        model = model_router.model(model_router.route("generate", count_tokens(prompt)))
+        events = stream_character_events(build_messages(prompt), prompt_budget.output_tokens(), model, build_result)
+
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@character_router.post("/edit_character/stream")
+async def edit_character_stream(prompt: Optional[str] = Form(None),
+    update_key: Optional[str] = Form(None),
+    updates: Optional[str] = Form(None),
+    character: UploadFile = File(...)):
+    """Stream the edit of character.json keys as server-sent events"""
+    updates = parse_edit_updates(prompt, update_key, updates)
+    content, content_hash, json_content = await DeploymentService.process_character_file(character)
+    prompt, max_tokens = build_edit_prompt(json_content, updates)
+    model = model_router.model(model_router.route("edit", count_tokens(prompt)))
+    logger.info("Sending streaming prompt")
+
+    async def build_result(response: str) -> CharacterEditResponse:
+        return await parse_edit_response(response, updates)
+
+    return StreamingResponse(
+        stream_character_events(build_messages(prompt), max_tokens, model, build_result),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,5 +1,6 @@
 import os
 import uuid
+import asyncio
 import httpx
 from pathlib import Path
 from web3.auto import w3
@@ -12,10 +13,13 @@ from typing import Optional, Dict, Any, List
 from eth_account.messages import encode_defunct
 from motor.motor_asyncio import AsyncIOMotorClient
 from fastapi import APIRouter, HTTPException, Depends
-from src.s3_upload import upload_character_to_s3, upload_knowledge_to_s3
+from src.s3_upload import upload_character_to_s3, upload_knowledge_to_s3, delete_from_s3, storage
 from pydantic import BaseModel, Field, ValidationError, validator, EmailStr
-from src.deployment_service import DeploymentService, notify_deployment_server
-from src.types import ClientConfig, SignatureRequest, AgentStatus, DeploymentResponse, CheckRegistered
+from src.deployment_service import DeploymentService, notify_deployment_server, pdf_pool
+from src.draft_service import DraftService, serialize_character
+from src.pipeline import Pipeline, Stage
+from src.utils.knowledge_files import for_each_knowledge_file, check_knowledge_filenames
+from src.types import ClientConfig, SignatureRequest, AgentStatus, DeploymentResponse, CheckRegistered, KnowledgeFile
 from nacl.signing import SigningKey, VerifyKey
 from nacl.encoding import RawEncoder
 import base58
@@ -34,6 +38,18 @@ mongodb_uri = os.getenv('MONGODB_URI')
 token_address = os.getenv('TOKEN_ADDRESS')
 balance_threshold = os.getenv('BALANCE_THRESHOLD')
 
+# Seconds a deploy stage may take before the deploy fails with a 504
+DEPLOY_STAGE_TIMEOUT = float(os.getenv("DEPLOY_STAGE_TIMEOUT", "30"))
+# Client logins (Twitter, Discord, Telegram) are slower
+DEPLOY_CLIENT_TIMEOUT = float(os.getenv("DEPLOY_CLIENT_TIMEOUT", "60"))
+# Knowledge file processing and S3 uploads
+DEPLOY_UPLOAD_TIMEOUT = float(os.getenv("DEPLOY_UPLOAD_TIMEOUT", "120"))
+
+# Knowledge files one deploy processes and uploads at the same time
+KNOWLEDGE_CONCURRENCY = int(os.getenv("KNOWLEDGE_CONCURRENCY", "4"))
+# Knowledge files processed and uploaded at the same time across all deploys
+KNOWLEDGE_GLOBAL_CONCURRENCY = int(os.getenv("KNOWLEDGE_GLOBAL_CONCURRENCY", "16"))
+
 client = AsyncIOMotorClient(mongodb_uri)
 db = client.users  # Replace with your database name
 
@@ -41,6 +57,8 @@ db = client.users  # Replace with your database name
 
 deploy_router = APIRouter()
 
+knowledge_slots = asyncio.Semaphore(KNOWLEDGE_GLOBAL_CONCURRENCY)
+
 
 def verify_signature(signature: str, message: str) -> str:
     """
@@ -79,6 +97,25 @@ def verify_sol_signature(public_key_base58: str, message: str, signature_base58:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
 
+def verified_address(address: Optional[str], message: Optional[str], signature: Optional[str]) -> Optional[str]:
+    """
+    The wallet address once `message` is checked as signed by it, None when no
+    address is given. Addresses are public, so one alone proves nothing.
+    """
+    if address is None:
+        return None
+    if not message or not signature:
+        raise HTTPException(status_code=401, detail="A message signed by the address is required")
+    try:
+        verify_sol_signature(address, message, signature)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error verifying signature: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid signature")
+    return address
+
+
 
 # @deploy_router.post("/register")
 # async def register(request: SignatureRequest):
@@ -174,22 +211,179 @@ const response = await fetch('/store_character_data', {
 
 """
 
+async def check_signature(ctx: Dict[str, Any]) -> None:
+    verify_sol_signature(ctx["public_key"], ctx["message"], ctx["signature"])
+
+
+async def check_user(ctx: Dict[str, Any]) -> None:
+    await DeploymentService(db).verify_user(ctx["public_key"])
+
+
+async def check_allowed_agents(ctx: Dict[str, Any]) -> None:
+    await AgentService(db).verify_allowed_agents(ctx["public_key"])
+
+
+async def load_character(ctx: Dict[str, Any]) -> tuple:
+    """Process the character file, or the current version of the draft"""
+    if ctx["draft_id"]:
+        draft_service = DraftService(db)
+        draft = await draft_service.get_draft(ctx["draft_id"])
+        await draft_service.verify_draft_ownership(ctx["public_key"], draft)
+    elif ctx["character_file"] is None:
+        raise HTTPException(status_code=400, detail="Either character or draft_id is required")
+    try:
+        if ctx["draft_id"]:
+            return DeploymentService.process_character_content(serialize_character(draft["character"]))
+        return await DeploymentService.process_character_file(ctx["character_file"])
+    except Exception as e:
+        logger.error(f"Failed to process character file: {str(e)}")
+        raise HTTPException(status_code=400, detail="Failed to process character file")
+
+
+async def check_uniqueness(ctx: Dict[str, Any]) -> None:
+    _, character_hash, _ = ctx["character"]
+    await DeploymentService(db).verify_character_uniqueness(ctx["public_key"], character_hash)
+
+
+async def check_balance(ctx: Dict[str, Any]) -> None:
+    await DeploymentService(db).verify_crypto_balance(ctx["public_key"])
+
+
+async def validate_clients(ctx: Dict[str, Any]) -> ClientConfig:
+    try:
+        return await DeploymentService(db).validate_client_data(*ctx["clients"])
+    except ValidationError as e:
+        logger.error(f"Client configuration validation failed: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid client configuration")
+
+
+async def process_knowledge(ctx: Dict[str, Any]) -> List:
+    files = ctx["knowledge_files"] or []
+    return await for_each_knowledge_file(
+        files, [file.filename for file in files],
+        DeploymentService(db).process_knowledge_file,
+        "Failed to process knowledge files",
+        asyncio.Semaphore(KNOWLEDGE_CONCURRENCY), knowledge_slots
+    )
+
+
+async def upload_character(ctx: Dict[str, Any]) -> str:
+    character_content, _, _ = ctx["character"]
+    try:
+        return await upload_character_to_s3(ctx["public_key"], ctx["agent_id"], character_content, 'application/json')
+    except Exception as e:
+        logger.error(f"Failed to upload character to S3: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to upload character to S3")
+
+
+async def delete_character(ctx: Dict[str, Any]) -> None:
+    await delete_from_s3(f"{ctx['public_key']}/{ctx['agent_id']}/character.json")
+
+
+async def upload_knowledge(ctx: Dict[str, Any]) -> List[Dict]:
+    async def upload(processed_file) -> Dict:
+        knowledge_url = await upload_knowledge_to_s3(
+            ctx["public_key"],
+            ctx["agent_id"],
+            processed_file.content.rewind().file,
+            processed_file.filename,
+            processed_file.content_type
+        )
+        return {
+            "filename": processed_file.filename,
+            "content_type": processed_file.content_type,
+            "s3_url": knowledge_url
+        }
+
+    return await for_each_knowledge_file(
+        ctx["knowledge"], [processed_file.filename for processed_file in ctx["knowledge"]],
+        upload, "Failed to upload knowledge files",
+        asyncio.Semaphore(KNOWLEDGE_CONCURRENCY), knowledge_slots
+    )
+
+
+async def delete_knowledge(ctx: Dict[str, Any]) -> None:
+    if ctx["knowledge_files"]:
+        await delete_from_s3(f"{ctx['public_key']}/{ctx['agent_id']}/knowledge/")
+
+
+async def save_agent(ctx: Dict[str, Any]) -> None:
+    _, character_hash, json_content = ctx["character"]
+    try:
+        await update_agent(
+            ctx["public_key"],
+            ctx["agent_id"],
+            json_content,
+            ctx["clients_config"],
+            ctx["upload_character"],
+            character_hash,
+            ctx["upload_knowledge"]
+        )
+    except Exception as e:
+        logger.error(f"Failed to update database: {e}")
+        raise HTTPException(status_code=500, detail="Failed to update agent")
+
+
+async def delete_agent(ctx: Dict[str, Any]) -> None:
+    await db.agents.delete_one({"agent_id": ctx["agent_id"]})
+
+
+async def notify(ctx: Dict[str, Any]) -> bool:
+    return await notify_deployment_server(
+        agent_id=ctx["agent_id"],
+        character_url=ctx["upload_character"],
+        knowledge_files=ctx["upload_knowledge"],
+        client_config=ctx["clients_config"].dict()
+    )
+
+
+# Every check has to pass before anything is uploaded
+DEPLOY_CHECKS = ("user", "allowed_agents", "uniqueness", "balance", "clients_config")
+
+deploy_pipeline = Pipeline([
+    Stage("signature", check_signature, local=True),
+    Stage("user", check_user, after=["signature"], timeout=DEPLOY_STAGE_TIMEOUT),
+    Stage("allowed_agents", check_allowed_agents, after=["signature"], timeout=DEPLOY_STAGE_TIMEOUT),
+    Stage("character", load_character, after=["signature"], timeout=DEPLOY_STAGE_TIMEOUT),
+    Stage("uniqueness", check_uniqueness, after=["character"], timeout=DEPLOY_STAGE_TIMEOUT),
+    Stage("balance", check_balance, after=["signature"], timeout=DEPLOY_STAGE_TIMEOUT),
+    Stage("clients_config", validate_clients, after=["signature"], timeout=DEPLOY_CLIENT_TIMEOUT),
+    Stage("knowledge", process_knowledge, after=["signature"], timeout=DEPLOY_UPLOAD_TIMEOUT),
+    Stage("upload_character", upload_character, after=DEPLOY_CHECKS,
+          timeout=DEPLOY_UPLOAD_TIMEOUT, cleanup=delete_character),
+    Stage("upload_knowledge", upload_knowledge, after=DEPLOY_CHECKS + ("knowledge",),
+          timeout=DEPLOY_UPLOAD_TIMEOUT, cleanup=delete_knowledge),
+    Stage("agent", save_agent, after=["upload_character", "upload_knowledge"],
+          timeout=DEPLOY_STAGE_TIMEOUT, cleanup=delete_agent),
+    # The deployment server may have started the agent even when the call fails,
+    # so a failed notify keeps the agent record and its files
+    Stage("notify", notify, after=["agent"], timeout=DEPLOY_STAGE_TIMEOUT, commit=True),
+])
+
+
 @deploy_router.post("/agent/deploy")
 async def deploy(
-    character: UploadFile = File(...),
+    character: UploadFile = File(None),
     signature: str = Form(...),
     message: str = Form(...),
     public_key: str = Form(...),
     knowledge_files: List[UploadFile] = File(None),
     client_twitter: Optional[str] = Form(None),
     client_discord: Optional[str] = Form(None),
-    client_telegram: Optional[str] = Form(None)
+    client_telegram: Optional[str] = Form(None),
+    draft_id: Optional[str] = Form(None)
 ) -> Dict:
     """
     Deploy a new agent with character and optional knowledge files.
+
+    The deploy runs as deploy_pipeline: the signature is checked first, then
+    the other checks run concurrently, and the uploads start once they all
+    passed. Uploaded files are deleted again when a later stage fails, up to
+    the deployment server notification.
     
     Args:
-        character: Character configuration file
+        character: Character configuration file, not needed when deploying a draft
+        draft_id: Optional id of a character draft (see /drafts) to deploy instead of the file
         signature: Signature for verification
         message: Message for verification
         knowledge_files: Optional list of knowledge files
@@ -200,110 +394,34 @@ async def deploy(
     Returns:
         Dict containing deployment information
     """
-    deployment_service = DeploymentService(db)
-    agent_service = AgentService(db)
     agent_id = str(uuid.uuid4())
     logger.info(f"agent_id = {agent_id}")
     logger.info(f"signature = {signature}")
     logger.info(f"Message = [{message}]")
-    
+    logger.info(f"agent_id = {agent_id} for address {public_key}")
+    # Files stored under the same name would overwrite each other, reject them before any work
+    check_knowledge_filenames([file.filename for file in knowledge_files or []])
+
+    ctx = {
+        "agent_id": agent_id,
+        "signature": signature,
+        "message": message,
+        "public_key": public_key,
+        "character_file": character,
+        "draft_id": draft_id,
+        "knowledge_files": knowledge_files,
+        "clients": (client_twitter, client_discord, client_telegram),
+    }
     try:
-        # Verify user and signature
-        verify_sol_signature(public_key, message, signature)
-        logger.info(f"agent_id = {agent_id} for address {public_key}")
-        await deployment_service.verify_user(public_key)
-        await agent_service.verify_allowed_agents(public_key)
-
-        # Process character file
-        try:
-            character_content, character_hash, json_content = await deployment_service.process_character_file(character)
-        except Exception as e:
-            logger.error(f"Failed to process character file: {str(e)}")
-            raise HTTPException(status_code=400, detail="Failed to process character file")
-
-        await deployment_service.verify_character_uniqueness(public_key, character_hash)
-        await deployment_service.verify_crypto_balance(public_key)
-        
-        # Validate client configuration
-        try:
-            client_config = await deployment_service.validate_client_data(
-            client_twitter,
-            client_discord,
-            client_telegram
-            )
-        except ValidationError as e:
-            logger.error(f"Client configuration validation failed: {str(e)}")
-            raise HTTPException(status_code=400, detail="Invalid client configuration")
-
-        # Upload character to S3
-        try:
-            character_url = await upload_character_to_s3(
-            public_key,
-            agent_id,
-            character_content,
-            'application/json'
-            )
-        except Exception as e:
-            logger.error(f"Failed to upload character to S3: {str(e)}")
-            raise HTTPException(status_code=500, detail="Failed to upload character to S3")
-
-        # Process knowledge files
-        knowledge_urls = []
-
-        if knowledge_files:
-            try:
-                for file in knowledge_files:
-                    processed_file = await deployment_service.process_knowledge_file(file)
-                    knowledge_url = await upload_knowledge_to_s3(
-                    public_key,
-                    agent_id,
-                    processed_file.content,
-                    processed_file.filename,
-                    processed_file.content_type
-                    )
-
-                    knowledge_urls.append({
-                    "filename": processed_file.filename,
-                    "content_type": processed_file.content_type,
-                    "s3_url": knowledge_url
-                    })
-            except Exception as e:
-                logger.error(f"Failed to process and upload knowledge files: {str(e)}")
-                raise HTTPException(status_code=500, detail="Failed to process and upload knowledge files")
-
-        # Verify crypto balance
-
-        # Update database
-        try:
-            await update_agent(
-                public_key,
-                agent_id,
-                json_content,
-                client_config,
-                character_url,
-                character_hash,
-                knowledge_urls
-            )
-        except Exception as e:
-            print(f"Failed to update database: {e}")
-            raise HTTPException(status_code=500, detail="Failed to update agent")
-
-        # Notify deployment server
-        
-        await notify_deployment_server(
-            agent_id=agent_id,
-            character_url=character_url,
-            knowledge_files=knowledge_urls,
-            client_config=client_config.dict()
-        )
+        await deploy_pipeline.run(ctx)
 
         # Return response
         return DeploymentResponse(
             agent_id=agent_id,
-            character_url=character_url,
+            character_url=ctx["upload_character"],
             signature=signature,
             message=message,
-            knowledge_files=knowledge_urls
+            knowledge_files=ctx["upload_knowledge"]
         ).dict()
         
     except HTTPException as he:
@@ -314,6 +432,17 @@ async def deploy(
         logger.error(f"Deployment failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    finally:
+        # Spooled knowledge JSON, possibly temporary files
+        for processed_file in ctx.get("knowledge") or []:
+            processed_file.content.close()
+
+
+@deploy_router.get("/agent/deploy/stats")
+async def deploy_stats():
+    """Deploy latency per stage, the stages on the critical path, PDF worker saturation and S3 latency"""
+    return {**deploy_pipeline.stats(), "pdf_pool": pdf_pool.stats(), "storage": storage.stats()}
+
 # Define request and response models
 class AgentStartRequest(BaseModel):
     agent_id: str
@@ -350,7 +479,7 @@ async def start_agent(request: AgentStartRequest):
 
 
 async def update_agent(address: str, agent_id: str, json_content: Any, client_config: ClientConfig, character_s3_url: str, md5_hash: str, s3_url_knowledge_files: List[str]):
-    result = db.agents.update_one(
+    result = await db.agents.update_one(
             {"agent_id": agent_id},
             {"$set": {
                 "created_at": datetime.utcnow(),
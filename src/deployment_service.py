@@ -5,11 +5,15 @@ from src.types import KnowledgeFile, TwitterCredentials, DiscordCredentials, Tel
 from pydantic import BaseModel, Field, ValidationError, validator, EmailStr
 from typing import Optional, Dict, List
 import json
+import asyncio
 from loguru import logger
 import hashlib
 import mimetypes
 from pathlib import Path
-from src.utils.extract_pdf import extract_paragraphs_from_pdf
+from src.utils.pdf_pool import PdfExtractionPool, PoolSaturated
+from src.utils.upload_stream import SpooledUpload, spool_upload, text_to_documents_json
+from src.utils.knowledge_files import knowledge_json_filename
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
 import os
 from src.get_balance import get_native_balance
@@ -36,6 +40,38 @@ SOL_URL = os.getenv("SOL_URL")
 
 env = os.getenv('ENV')
 
+# Worker processes extracting PDF knowledge files
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+# PDFs that may wait for a worker before new ones are rejected with a 503
+PDF_MAX_QUEUE = int(os.getenv("PDF_MAX_QUEUE", "16"))
+# Seconds one PDF may take to extract
+PDF_TIMEOUT = float(os.getenv("PDF_TIMEOUT", "60"))
+# Memory cap of each worker process
+PDF_MEMORY_LIMIT_MB = int(os.getenv("PDF_MEMORY_LIMIT_MB", "1024"))
+# PDFs up to this size are extracted in the server process, faster than a round-trip to a worker
+PDF_INLINE_MAX_BYTES = int(os.getenv("PDF_INLINE_MAX_BYTES", "65536"))
+
+# Largest knowledge file accepted, bigger ones are rejected with a 413
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+# Largest character file accepted
+CHARACTER_MAX_BYTES = int(os.getenv("CHARACTER_MAX_BYTES", str(1024 * 1024)))
+# Largest request body accepted, checked before the upload is parsed
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(500 * 1024 * 1024)))
+# Uploads are read in chunks of this size
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Uploads bigger than this are spooled to a temporary file in UPLOAD_SPOOL_DIR (the system default when unset)
+UPLOAD_SPOOL_MEMORY_BYTES = int(os.getenv("UPLOAD_SPOOL_MEMORY_BYTES", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+# Started at startup, see src/server.py
+pdf_pool = PdfExtractionPool(
+    workers=PDF_WORKERS,
+    max_queue=PDF_MAX_QUEUE,
+    timeout=PDF_TIMEOUT,
+    memory_limit_mb=PDF_MEMORY_LIMIT_MB,
+    inline_max_bytes=PDF_INLINE_MAX_BYTES
+)
+
 
 
 class DeploymentService:
@@ -74,57 +110,78 @@ class DeploymentService:
     async def process_character_file(character: UploadFile) -> tuple[bytes, str]:
         """Process and validate character file"""
         try:
-            content = await character.read()
-            content_hash = hashlib.md5(content).hexdigest()
-            
+            spooled = await spool_upload(character, CHARACTER_MAX_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_SPOOL_MEMORY_BYTES, UPLOAD_SPOOL_DIR)
             try:
-                json_content = json.loads(content.decode())
-                if 'bio' not in json_content:
-                    raise HTTPException(status_code=400, detail="Missing 'bio' field in character file")
-                
-                if not isinstance(json_content['bio'], list):
-                    raise HTTPException(status_code=400, detail="'bio' field must be a list")
-                
-                return content, content_hash, json_content
-
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=400, detail="Invalid JSON in character file")
-            except UnicodeDecodeError:
-                raise HTTPException(status_code=400, detail="Character file must be UTF-8 encoded JSON")
-            
+                return DeploymentService.process_character_content(spooled.read(), spooled.md5)
+            finally:
+                spooled.close()
         finally:
             await character.close()
 
+    @staticmethod
+    def process_character_content(content: bytes, content_hash: Optional[str] = None) -> tuple[bytes, str]:
+        """Validate the bytes of a character file and return them with their hash and parsed JSON"""
+        content_hash = content_hash or hashlib.md5(content).hexdigest()
+
+        try:
+            json_content = json.loads(content.decode())
+            if 'bio' not in json_content:
+                raise HTTPException(status_code=400, detail="Missing 'bio' field in character file")
+
+            if not isinstance(json_content['bio'], list):
+                raise HTTPException(status_code=400, detail="'bio' field must be a list")
+
+            return content, content_hash, json_content
+
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Invalid JSON in character file")
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="Character file must be UTF-8 encoded JSON")
+
     async def process_knowledge_file(self, file: UploadFile) -> KnowledgeFile:
-        """Process a single knowledge file"""
+        """
+        Process a single knowledge file into its {"documents": [...]} JSON.
+        The upload and the JSON are spooled, never held in memory whole.
+        """
+        spooled = None
         try:
-            content = await file.read()
-            if not content:
+            spooled = await spool_upload(file, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_SPOOL_MEMORY_BYTES, UPLOAD_SPOOL_DIR)
+            if not spooled.size:
                 raise HTTPException(status_code=400, detail="File content is empty")            
             # Get file type using mimetypes
             file_type, _ = mimetypes.guess_type(file.filename)
             if not file_type:
                 file_type = 'application/octet-stream'
             
-            json_filename = Path(file.filename).stem + '.json'
+            json_filename = knowledge_json_filename(file.filename)
+            file_content = SpooledUpload(UPLOAD_SPOOL_MEMORY_BYTES, UPLOAD_SPOOL_DIR)
 
             if file_type == 'application/pdf':
-                paragraphs = extract_paragraphs_from_pdf(content)
-                file_content = {"documents": paragraphs}
+                try:
+                    # Large PDFs are on disk, the worker reads them from there
+                    paragraphs = await pdf_pool.extract(spooled.path or spooled.read(), spooled.size)
+                except PoolSaturated:
+                    raise HTTPException(status_code=503, detail="Too many PDFs are being processed, please retry shortly")
+                except asyncio.TimeoutError:
+                    raise HTTPException(status_code=422, detail=f"Extracting {file.filename} took longer than {pdf_pool.timeout}s")
+                except (BrokenProcessPool, MemoryError):
+                    raise HTTPException(status_code=422, detail=f"Extracting {file.filename} exceeded the memory limit")
+                file_content.write(json.dumps({"documents": paragraphs}).encode('utf-8'))
+                file_content.rewind()
                 logger.info(f"Successfully extracted {len(paragraphs)} paragraphs from {file.filename}")
             else:
                 # For non-PDF files, store content as is
-                file_content = {"documents": [content.decode('utf-8', errors='ignore')]}                
+                text_to_documents_json(spooled, file_content, UPLOAD_CHUNK_SIZE)
                 logger.info(f"Processed file {file.filename} as {file_type}")
-            print (file_content)
 
-                
             return KnowledgeFile(
                 filename=json_filename,
                 content=file_content,
                 content_type="application/json"
             )
         finally:
+            if spooled is not None:
+                spooled.close()
             await file.close()
 
 
@@ -206,7 +263,8 @@ class DeploymentService:
         """Verify crypto balance meets threshold"""
         ##First check balance on Eth
         if env == "production":
-            sol_balance = get_native_balance(address, SOL_URL)
+            # The RPC client is blocking, keep it off the event loop so other deploy checks run meanwhile
+            sol_balance = await asyncio.to_thread(get_native_balance, address, SOL_URL)
             if sol_balance < float(balance_threshold):
                 # logger.error(f"Address=[{address}] doesnt have suiffcient eth balance on ETH, Balance=[{eth_balance}]")
                 # token_balance = get_token_balance(address, ETH_URL, token_address)
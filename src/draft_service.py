@@ -0,0 +1,97 @@
+import json
+import uuid
+import hashlib
+from datetime import datetime, timedelta
+from typing import Any, Dict
+from loguru import logger
+from fastapi import HTTPException
+from src.types import DraftResponse
+
+
+def serialize_character(character: Dict[str, Any]) -> bytes:
+    """Bytes of a draft's character.json, as uploaded to S3 on deploy"""
+    return json.dumps(character, indent=2, ensure_ascii=False).encode()
+
+
+class DraftService:
+    """
+    Character drafts kept server-side between edits.
+
+    A draft holds the current character and a version number. Every edit is
+    stored as a patch (the instructions and the values they produced) and
+    bumps the version; an edit made against an older version is rejected so
+    concurrent edits don't overwrite each other. Drafts expire `ttl` seconds
+    after their last change.
+    """
+
+    def __init__(self, db, ttl: int = 7 * 86400):
+        self.db = db
+        self.ttl = ttl
+
+    async def create_indexes(self) -> None:
+        await self.db.drafts.create_index("expire_at", expireAfterSeconds=0)
+
+    async def create_draft(self, character: Dict[str, Any], address: str) -> Dict:
+        """Store a new draft at version 0"""
+        now = datetime.utcnow()
+        draft = {
+            "_id": uuid.uuid4().hex,
+            "address": address,
+            "character": character,
+            "content_hash": hashlib.md5(serialize_character(character)).hexdigest(),
+            "version": 0,
+            "patches": [],
+            "created_at": now,
+            "updated_at": now,
+            "expire_at": now + timedelta(seconds=self.ttl),
+        }
+        await self.db.drafts.insert_one(draft)
+        logger.info(f"Created draft {draft['_id']}")
+        return draft
+
+    async def get_draft(self, draft_id: str) -> Dict:
+        draft = await self.db.drafts.find_one({"_id": draft_id})
+        if not draft:
+            raise HTTPException(status_code=404, detail=f"Draft {draft_id} doesnt exists")
+        return draft
+
+    async def apply_patch(self, draft: Dict, updates: Dict[str, str], update: Dict[str, Any]) -> Dict:
+        """
+        Apply edited keys to the draft version they were made from.
+        Raises 409 when the draft changed in the meantime.
+        """
+        now = datetime.utcnow()
+        character = {**draft["character"], **update}
+        version = draft["version"] + 1
+        patch = {"version": version, "updates": updates, "update": update, "created_at": now}
+        result = await self.db.drafts.update_one(
+            {"_id": draft["_id"], "version": draft["version"]},
+            {
+                "$set": {
+                    "character": character,
+                    "content_hash": hashlib.md5(serialize_character(character)).hexdigest(),
+                    "version": version,
+                    "updated_at": now,
+                    "expire_at": now + timedelta(seconds=self.ttl),
+                },
+                "$push": {"patches": patch},
+            }
+        )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=409, detail=f"Draft {draft['_id']} changed while it was being edited, retry on the latest version")
+        logger.info(f"Draft {draft['_id']} is now at version {version}")
+        return {**draft, "character": character, "version": version, "patches": draft["patches"] + [patch]}
+
+    async def verify_draft_ownership(self, address: str, draft: Dict) -> None:
+        # Drafts without an address belong to nobody, they can't be used
+        if draft.get("address") != address:
+            raise HTTPException(status_code=403, detail=f"{address} doesnt own draft {draft['_id']}")
+
+    @staticmethod
+    def view(draft: Dict) -> DraftResponse:
+        return DraftResponse(
+            draft_id=draft["_id"],
+            version=draft["version"],
+            character=draft["character"],
+            patches=[{**patch, "created_at": patch["created_at"].isoformat()} for patch in draft["patches"]],
+        )
@@ -0,0 +1,51 @@
+import os
+import asyncio
+import threading
+from pathlib import Path
+from typing import List, Optional
+from loguru import logger
+from dotenv import load_dotenv
+
+# Get the parent directory of the current file (src/)
+current_dir = Path(__file__).parent
+# Go up one level to get to the root directory where .env is
+root_dir = current_dir.parent
+
+# Load .env from the root directory
+load_dotenv(root_dir / '.env')
+
+# Same model and cache folder embedding.py uses to build the eliza_docs index
+EMBEDDING_MODEL = "togethercomputer/m2-bert-80M-32k-retrieval"
+MODELS_CACHE = os.getenv('MODELS_CACHE', './models')
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings():
+    """Load the embedding model once per process, None if it isn't available"""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            try:
+                from langchain_huggingface import HuggingFaceEmbeddings
+            except ImportError:
+                logger.error("langchain_huggingface is not installed, embeddings are disabled")
+                return None
+            _embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL,
+                                                cache_folder=MODELS_CACHE,
+                                                model_kwargs={'trust_remote_code': True})
+            logger.info(f"Loaded embedding model {EMBEDDING_MODEL}")
+    return _embeddings
+
+
+def _embed_query(text: str) -> Optional[List[float]]:
+    embeddings = get_embeddings()
+    if embeddings is None:
+        return None
+    return embeddings.embed_query(text)
+
+
+async def embed_query(text: str) -> Optional[List[float]]:
+    """Embed a query in a worker thread, None if embeddings are unavailable"""
+    return await asyncio.to_thread(_embed_query, text)
@@ -0,0 +1,102 @@
+import time
+import hashlib
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from loguru import logger
+
+
+class GenerationCache:
+    """
+    Exact-match cache for generated characters.
+
+    Entries live in an in-process LRU with a TTL and, when a Mongo collection
+    is given, in a shared second tier expired by a Mongo TTL index. Mongo
+    errors are logged and treated as misses so the cache never fails a request.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: int = 86400, collection=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.collection = collection
+        self.entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.index_ready = False
+        self.counters = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "sets": 0, "errors": 0}
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """Fold whitespace and case so trivially different prompts share a key"""
+        return " ".join(prompt.split()).casefold()
+
+    @classmethod
+    def make_key(cls, prompt: str, model: str, template_version: str) -> str:
+        """Cache key for a prompt rendered with a given model and template version"""
+        raw = "\x1f".join([cls.normalize_prompt(prompt), model, template_version])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def get(self, key: str) -> Tuple[Optional[Any], Optional[str]]:
+        """Return the cached value and the tier it came from ("memory" or "mongo")"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return value, "memory"
+            del self.entries[key]
+
+        if self.collection is not None:
+            try:
+                document = await self.collection.find_one({
+                    "_id": key,
+                    "created_at": {"$gt": datetime.utcnow() - timedelta(seconds=self.ttl)}
+                })
+                if document:
+                    self._remember(key, document["value"])
+                    self.counters["mongo_hits"] += 1
+                    return document["value"], "mongo"
+            except Exception as e:
+                self.counters["errors"] += 1
+                logger.error(f"Error reading generation cache from MongoDB: {str(e)}")
+
+        self.counters["misses"] += 1
+        return None, None
+
+    async def set(self, key: str, value: Any) -> None:
+        """Store a value in every tier"""
+        self._remember(key, value)
+        self.counters["sets"] += 1
+        if self.collection is None:
+            return
+        try:
+            if not self.index_ready:
+                await self.collection.create_index("created_at", expireAfterSeconds=self.ttl)
+                self.index_ready = True
+            await self.collection.update_one(
+                {"_id": key},
+                {"$set": {"value": value, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.error(f"Error writing generation cache to MongoDB: {str(e)}")
+
+    def _remember(self, key: str, value: Any) -> None:
+        """Insert into the in-process LRU, evicting the least recently used entry"""
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        hits = self.counters["memory_hits"] + self.counters["mongo_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "mongo": self.collection is not None,
+        }
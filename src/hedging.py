@@ -0,0 +1,188 @@
+import time
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from loguru import logger
+from src.utils.token_budget import count_tokens
+from src.utils.stats import percentile
+
+
+class Attempt:
+    """One streamed completion, keeping its partial output for spend accounting"""
+
+    def __init__(self, start: Callable[[Callable[[bool], None]], AsyncIterator[str]]):
+        self.start = start
+        self.chunks: List[str] = []
+        self.first_token = asyncio.Event()
+        # Set while the request is with the provider, clear while it waits for an API key
+        self.sent = asyncio.Event()
+        self.sent_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.ttft: Optional[float] = None
+
+    def sending(self, active: bool) -> None:
+        """Called by the stream when its request goes out (True) and when a retry waits for a key again (False)"""
+        if active:
+            self.sent_at = time.monotonic()
+            self.sent.set()
+        else:
+            self.sent_at = None
+            self.sent.clear()
+
+    async def run(self) -> str:
+        async for text in self.start(self.sending):
+            if not self.chunks:
+                self.first_token_at = time.monotonic()
+                self.ttft = self.first_token_at - (self.sent_at or self.first_token_at)
+                self.first_token.set()
+            self.chunks.append(text)
+        self.first_token.set()
+        return "".join(self.chunks)
+
+
+class Hedger:
+    """
+    Hedged LLM requests.
+
+    A completion that hasn't produced its first token within the learned
+    time-to-first-token percentile gets a duplicate request; whichever finishes
+    first wins and the other is cancelled. The time to first token counts from
+    when the request is sent, so time queued locally for an API key never
+    triggers a hedge, and a primary that fails before its first token is an
+    error for the caller to handle, not a reason to hedge. Hedges are capped
+    as a fraction of requests. Until enough samples exist a default threshold
+    is used.
+    """
+
+    def __init__(self, percentile: float = 0.95, max_hedge_fraction: float = 0.1,
+                 default_threshold: float = 5.0, min_samples: int = 20, window: int = 1000):
+        self.percentile = percentile
+        self.max_hedge_fraction = max_hedge_fraction
+        self.default_threshold = default_threshold
+        self.min_samples = min_samples
+        self.ttfts = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+        # Latency each request would have had without hedging, estimated when the primary was cancelled
+        self.unhedged_latencies = deque(maxlen=window)
+        # Time from first token to the end of a completion
+        self.stream_durations = deque(maxlen=window)
+        self.counters = {"requests": 0, "hedges": 0, "hedge_wins": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                         "extra_prompt_tokens": 0, "extra_completion_tokens": 0}
+
+    def threshold(self) -> float:
+        """Seconds to wait for a first token before hedging"""
+        if len(self.ttfts) < self.min_samples:
+            return self.default_threshold
+        return percentile(self.ttfts, self.percentile)
+
+    def can_hedge(self) -> bool:
+        return self.counters["hedges"] < self.max_hedge_fraction * self.counters["requests"]
+
+    async def _responding(self, attempt: Attempt, task: asyncio.Task) -> bool:
+        """
+        Wait until the attempt streams its first token or ends (True), or has
+        been with the provider longer than the threshold without one (False)
+        """
+        threshold = self.threshold()
+        while not attempt.first_token.is_set() and not task.done():
+            if attempt.sent_at is None:
+                event, timeout = attempt.sent, None
+            else:
+                timeout = threshold - (time.monotonic() - attempt.sent_at)
+                if timeout <= 0:
+                    return False
+                event = attempt.first_token
+            waiter = asyncio.create_task(event.wait())
+            try:
+                await asyncio.wait({task, waiter}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+        return True
+
+    async def run(self, start: Callable[[Callable[[bool], None]], AsyncIterator[str]], prompt_tokens: int = 0,
+                  on_discard: Optional[Callable[[int, Optional[BaseException]], None]] = None) -> str:
+        """
+        Run a streamed completion with hedging and return the winning response
+        text. `start` opens the stream and gets the callback its request
+        reports being sent with (see Attempt.sending). `on_discard` is called
+        with the index (0 primary, 1 hedge) of an attempt whose outcome is
+        neither returned nor raised, and its error or None when it is cancelled.
+        """
+        self.counters["requests"] += 1
+        self.counters["prompt_tokens"] += prompt_tokens
+        started = time.monotonic()
+        primary = Attempt(start)
+        primary_task = asyncio.create_task(primary.run())
+        try:
+            responding = await self._responding(primary, primary_task)
+        except BaseException:
+            primary_task.cancel()
+            raise
+
+        if responding or not self.can_hedge():
+            try:
+                return await primary_task
+            finally:
+                self._record(primary, primary, started)
+
+        self.counters["hedges"] += 1
+        self.counters["extra_prompt_tokens"] += prompt_tokens
+        logger.info(f"No first token after {self.threshold():.2f}s, sending a hedged request")
+        hedge = Attempt(start)
+        hedge_task = asyncio.create_task(hedge.run())
+        tasks = {primary_task: primary, hedge_task: hedge}
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = tasks[task]
+                        loser = hedge if winner is primary else primary
+                        loser_task = hedge_task if winner is primary else primary_task
+                        if winner is hedge:
+                            self.counters["hedge_wins"] += 1
+                        self.counters["extra_completion_tokens"] += count_tokens("".join(loser.chunks))
+                        self._record(winner, primary, started)
+                        if on_discard is not None:
+                            error = loser_task.exception() if loser_task.done() else None
+                            on_discard(1 if winner is primary else 0, error)
+                        return task.result()
+            # Both attempts failed, surface the primary's error
+            if on_discard is not None:
+                on_discard(1, hedge_task.exception())
+            return primary_task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _record(self, winner: Attempt, primary: Attempt, started: float) -> None:
+        latency = time.monotonic() - started
+        self.latencies.append(latency)
+        self.counters["completion_tokens"] += count_tokens("".join(winner.chunks))
+        if winner.ttft is not None:
+            self.ttfts.append(winner.ttft)
+            self.stream_durations.append(time.monotonic() - winner.first_token_at)
+        if winner is primary:
+            self.unhedged_latencies.append(latency)
+        else:
+            # The cancelled primary still had to produce its first token and stream the whole completion
+            self.unhedged_latencies.append(latency + (percentile(self.stream_durations, 0.5) or 0.0))
+
+    def stats(self) -> Dict[str, Any]:
+        """Hedge counts, p99 latency against the unhedged estimate and the extra token spend"""
+        requests = self.counters["requests"]
+        spent = self.counters["prompt_tokens"] + self.counters["completion_tokens"]
+        extra = self.counters["extra_prompt_tokens"] + self.counters["extra_completion_tokens"]
+        latency_p99 = percentile(self.latencies, 0.99)
+        unhedged_p99 = percentile(self.unhedged_latencies, 0.99)
+        return {
+            **self.counters,
+            "hedge_rate": self.counters["hedges"] / requests if requests else 0.0,
+            "threshold": self.threshold(),
+            "latency_p50": percentile(self.latencies, 0.5),
+            "latency_p99": latency_p99,
+            "unhedged_latency_p99": unhedged_p99,
+            "p99_improvement": unhedged_p99 - latency_p99 if latency_p99 is not None else None,
+            "extra_spend_fraction": extra / spent if spent else 0.0,
+        }
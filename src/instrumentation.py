@@ -0,0 +1,135 @@
+import time
+import bisect
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+# Request id and endpoint of the HTTP request (or job) an LLM call is made for
+current_request: ContextVar[Dict[str, str]] = ContextVar("current_request", default={"request_id": None, "endpoint": None})
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120]
+TOKEN_BUCKETS = [100, 250, 500, 1000, 2000, 4000, 8000, 16000]
+# Record fields aggregated into histograms, with their buckets
+HISTOGRAMS = {
+    "queue_time": SECONDS_BUCKETS,
+    "ttft": SECONDS_BUCKETS,
+    "total_time": SECONDS_BUCKETS,
+    "prompt_tokens": TOKEN_BUCKETS,
+    "completion_tokens": TOKEN_BUCKETS,
+}
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class CallMetrics:
+    """
+    Structured records of every LLM call.
+
+    A record is started per call with the call type and model, filled in by
+    the LLM service (queue time, time to first token, tokens, retries) and
+    finished by the caller with the JSON-validity outcome. Finished records are
+    aggregated into per-endpoint histograms, and the most recent requests keep
+    their records by request id. `prices` maps a model to its
+    [input, output] dollars per million tokens for the cost estimate.
+    """
+
+    def __init__(self, prices: Optional[Dict[str, List[float]]] = None, max_requests: int = 1000):
+        self.prices = prices or {}
+        self.max_requests = max_requests
+        self.requests: OrderedDict = OrderedDict()
+        self.endpoints: Dict[str, Dict[str, Any]] = {}
+
+    def start(self, call_type: str, model: str) -> Dict[str, Any]:
+        context = current_request.get()
+        return {
+            "request_id": context["request_id"],
+            "endpoint": context["endpoint"],
+            "call_type": call_type,
+            "model": model,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+            "queue_time": 0.0,
+            "ttft": None,
+            "total_time": None,
+            "retries": 0,
+            "outcome": None,
+            "cost": None,
+            "started": time.monotonic(),
+        }
+
+    def finish(self, record: Dict[str, Any], outcome: str) -> None:
+        """Close a record with its outcome ("valid", "invalid_json", "truncated", "error" or "hedge_cancelled") and aggregate it"""
+        record["outcome"] = outcome
+        record["total_time"] = time.monotonic() - record.pop("started")
+        price = self.prices.get(record["model"])
+        if price and record["prompt_tokens"] is not None and record["completion_tokens"] is not None:
+            record["cost"] = (record["prompt_tokens"] * price[0] + record["completion_tokens"] * price[1]) / 1_000_000
+        logger.info(f"LLM call {record}")
+
+        endpoint = self.endpoints.setdefault(record["endpoint"] or "background", {
+            "calls": 0,
+            "cost": 0.0,
+            "outcomes": {},
+            "histograms": {field: Histogram(buckets) for field, buckets in HISTOGRAMS.items()},
+        })
+        endpoint["calls"] += 1
+        endpoint["cost"] += record["cost"] or 0.0
+        endpoint["outcomes"][outcome] = endpoint["outcomes"].get(outcome, 0) + 1
+        for field, histogram in endpoint["histograms"].items():
+            if record[field] is not None:
+                histogram.observe(record[field])
+
+        self._keep(record)
+
+    def coalesce(self, leader: Optional[str]) -> None:
+        """Record that the current request shares the in-flight LLM calls of request `leader`"""
+        context = current_request.get()
+        self._keep({
+            "request_id": context["request_id"],
+            "endpoint": context["endpoint"],
+            "call_type": "coalesced",
+            "coalesced_into": leader,
+            "outcome": "coalesced",
+        })
+
+    def _keep(self, record: Dict[str, Any]) -> None:
+        if record["request_id"] is not None:
+            self.requests.setdefault(record["request_id"], []).append(record)
+            self.requests.move_to_end(record["request_id"])
+            if len(self.requests) > self.max_requests:
+                self.requests.popitem(last=False)
+
+    def request(self, request_id: str) -> Optional[List[Dict[str, Any]]]:
+        return self.requests.get(request_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-endpoint call counts, cost, outcomes and histograms"""
+        return {
+            name: {
+                **{key: value for key, value in endpoint.items() if key != "histograms"},
+                "histograms": {field: histogram.to_dict() for field, histogram in endpoint["histograms"].items()},
+            }
+            for name, endpoint in self.endpoints.items()
+        }
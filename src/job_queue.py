@@ -0,0 +1,247 @@
+import time
+import uuid
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from loguru import logger
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from src.instrumentation import current_request
+from src.utils.stats import percentile
+
+FINISHED = ("done", "failed")
+
+
+class JobQueue:
+    """
+    Durable job queue on a Mongo collection.
+
+    Jobs are claimed highest priority first, oldest first within a priority,
+    by atomically marking them running with a lease. Workers renew the lease
+    while a job runs, so a job whose worker died (e.g. on restart) is picked up
+    again once its lease expires, up to `max_attempts` times. Every claim has
+    its own lease id, a worker that lost its lease can't finish the job over
+    the run that recovered it. Finished jobs keep their result for
+    `result_ttl` seconds.
+    """
+
+    def __init__(self, collection, handlers: Dict[str, Callable[[Dict], Awaitable[Dict]]],
+                 lease_seconds: int = 300, max_attempts: int = 3, result_ttl: int = 86400,
+                 poll_interval: float = 1.0):
+        self.collection = collection
+        self.handlers = handlers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.workers: List[asyncio.Task] = []
+        self.wakeup = asyncio.Event()
+        # Long-polls waiting on a job, woken at once when this process finishes it
+        self.waiters: Dict[str, Set[asyncio.Event]] = {}
+        # Seconds from enqueue to claim, per priority
+        self.wait_times: Dict[int, deque] = {}
+        self.counters = {"enqueued": 0, "completed": 0, "failed": 0, "recovered": 0}
+
+    async def start(self, workers: int) -> None:
+        """Create the indexes and start the worker coroutines"""
+        await self.collection.create_index([("status", 1), ("priority", -1), ("created_at", 1)])
+        await self.collection.create_index("expire_at", expireAfterSeconds=0)
+        self.workers = [asyncio.create_task(self.work(i)) for i in range(workers)]
+        logger.info(f"Started {workers} job workers")
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], priority: int = 0) -> str:
+        """Store a job and return its id"""
+        job_id = uuid.uuid4().hex
+        await self.collection.insert_one({
+            "_id": job_id,
+            "kind": kind,
+            "payload": payload,
+            "priority": priority,
+            "status": "queued",
+            "attempts": 0,
+            "created_at": datetime.utcnow(),
+        })
+        self.counters["enqueued"] += 1
+        self.wakeup.set()
+        return job_id
+
+    async def claim(self) -> Optional[Dict]:
+        """Take the next queued job, or a running one whose lease expired"""
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"$or": [{"status": "queued"}, {"status": "running", "lease_until": {"$lt": now}}]},
+            {
+                "$set": {
+                    "status": "running",
+                    "started_at": now,
+                    "lease_id": uuid.uuid4().hex,
+                    "lease_until": now + timedelta(seconds=self.lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", -1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def work(self, worker: int) -> None:
+        while True:
+            try:
+                job = await self.claim()
+            except Exception as e:
+                logger.error(f"Job worker {worker} failed to claim a job: {str(e)}")
+                job = None
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run(job)
+            except Exception as e:
+                # e.g. Mongo failing to store the result, the lease runs out and the job is retried
+                logger.error(f"Job worker {worker} failed running job {job['_id']}: {str(e)}")
+
+    async def run(self, job: Dict) -> None:
+        job_id = job["_id"]
+        if job["attempts"] > 1:
+            self.counters["recovered"] += 1
+            logger.warning(f"Recovering job {job_id}, attempt {job['attempts']}")
+        if job["attempts"] > self.max_attempts:
+            await self.finish(job, error={"status_code": 500, "detail": f"Job failed after {self.max_attempts} attempts"})
+            return
+
+        wait_time = (job["started_at"] - job["created_at"]).total_seconds()
+        self.wait_times.setdefault(job["priority"], deque(maxlen=1000)).append(wait_time)
+        heartbeat = asyncio.create_task(self.renew_lease(job))
+        # LLM calls of the job are recorded under its id
+        context = current_request.set({"request_id": job_id, "endpoint": f"job:{job['kind']}"})
+        try:
+            result = await self.handlers[job["kind"]](job["payload"])
+            await self.finish(job, result=result)
+        except asyncio.CancelledError:
+            # Shutting down, hand the job to the next worker right away. It didn't fail, so
+            # the attempt doesn't count towards max_attempts
+            await asyncio.shield(self.collection.update_one(
+                self.lease_filter(job),
+                {"$set": {"status": "queued"}, "$unset": {"lease_until": "", "lease_id": ""}, "$inc": {"attempts": -1}}
+            ))
+            raise
+        except HTTPException as e:
+            await self.finish(job, error={"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            await self.finish(job, error={"status_code": 500, "detail": str(e)})
+        finally:
+            current_request.reset(context)
+            heartbeat.cancel()
+
+    @staticmethod
+    def lease_filter(job: Dict) -> Dict[str, Any]:
+        """Matches the job only while it still runs under this claim's lease"""
+        return {"_id": job["_id"], "status": "running", "lease_id": job["lease_id"]}
+
+    async def renew_lease(self, job: Dict) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.collection.update_one(
+                    self.lease_filter(job),
+                    {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+                )
+            except Exception as e:
+                # Keep trying, the lease only runs out if every renewal until then fails
+                logger.error(f"Failed to renew the lease of job {job['_id']}: {str(e)}")
+
+    async def finish(self, job: Dict, result: Optional[Dict] = None, error: Optional[Dict] = None) -> None:
+        """Store the outcome of the job, unless another worker has claimed it since"""
+        job_id = job["_id"]
+        now = datetime.utcnow()
+        status = "failed" if error else "done"
+        stored = await self.collection.update_one(self.lease_filter(job), {
+            "$set": {
+                "status": status,
+                "result": result,
+                "error": error,
+                "finished_at": now,
+                "expire_at": now + timedelta(seconds=self.result_ttl),
+            },
+            "$unset": {"lease_until": "", "lease_id": ""},
+        })
+        if stored.matched_count == 0:
+            logger.warning(f"Job {job_id} lost its lease to another worker, dropping this run's {status} outcome")
+            return
+        self.counters["completed" if status == "done" else "failed"] += 1
+        for event in self.waiters.pop(job_id, ()):
+            event.set()
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """
+        The job once it finishes or `timeout` seconds pass, None if it doesn't exist.
+        Jobs finished by this process wake the waiter at once, others are polled.
+        """
+        deadline = time.monotonic() + timeout
+        event = asyncio.Event()
+        try:
+            while True:
+                job = await self.collection.find_one({"_id": job_id})
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in FINISHED or remaining <= 0:
+                    return job
+                self.waiters.setdefault(job_id, set()).add(event)
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(self.poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Whether the job finished elsewhere, timed out or the client left
+            waiters = self.waiters.get(job_id)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self.waiters[job_id]
+
+    @staticmethod
+    def view(job: Dict) -> Dict[str, Any]:
+        """Public fields of a job"""
+        return {
+            "job_id": job["_id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "priority": job["priority"],
+            "attempts": job["attempts"],
+            "created_at": job["created_at"].isoformat(),
+            "started_at": job["started_at"].isoformat() if job.get("started_at") else None,
+            "finished_at": job["finished_at"].isoformat() if job.get("finished_at") else None,
+            "result": job.get("result"),
+            "error": job.get("error"),
+        }
+
+    async def stats(self) -> Dict[str, Any]:
+        """Queue depth per priority, age of the oldest queued job and recent wait times"""
+        depth = {}
+        async for group in self.collection.aggregate([
+            {"$match": {"status": {"$in": ["queued", "running"]}}},
+            {"$group": {"_id": {"status": "$status", "priority": "$priority"}, "count": {"$sum": 1}}},
+        ]):
+            depth.setdefault(group["_id"]["status"], {})[str(group["_id"]["priority"])] = group["count"]
+        oldest = await self.collection.find_one({"status": "queued"}, sort=[("created_at", 1)])
+
+        wait_times = {}
+        for priority, times in self.wait_times.items():
+            wait_times[str(priority)] = {"p50": percentile(times, 0.5), "p95": percentile(times, 0.95)}
+        return {
+            **self.counters,
+            "depth": depth,
+            "oldest_queued_age": (datetime.utcnow() - oldest["created_at"]).total_seconds() if oldest else None,
+            "wait_times": wait_times,
+            "workers": len(self.workers),
+        }
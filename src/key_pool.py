@@ -0,0 +1,229 @@
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Any, Dict, List, Mapping, Optional
+from loguru import logger
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds until a rate limit resets, from values like "12", "1.5s", "250ms" or "1m30s" """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    seconds, number = 0.0, ""
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char.isdigit() or char == ".":
+            number += char
+        elif value.startswith("ms", i):
+            seconds += float(number or 0) / 1000
+            number = ""
+            i += 1
+        elif char in "hms":
+            seconds += float(number or 0) * {"h": 3600, "m": 60, "s": 1}[char]
+            number = ""
+        else:
+            return None
+        i += 1
+    return seconds
+
+
+def header_int(headers: Mapping[str, str], *names: str) -> Optional[int]:
+    for name in names:
+        if headers.get(name) is not None:
+            try:
+                return int(float(headers[name]))
+            except ValueError:
+                return None
+    return None
+
+
+class ApiKey:
+    """One provider API key and what we know about its rate limits"""
+
+    def __init__(self, key: str, max_concurrency: int):
+        self.key = key
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.remaining_requests: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+        self.reset_at = 0.0
+        self.backoff_until = 0.0
+        self.rate_limited = 0
+        self.counters = {"calls": 0, "rate_limited": 0}
+
+    @property
+    def name(self) -> str:
+        return f"...{(self.key or '')[-4:]}"
+
+    def available(self, tokens: int, now: float) -> bool:
+        if self.in_flight >= self.max_concurrency or now < self.backoff_until:
+            return False
+        if now < self.reset_at:
+            if self.remaining_requests is not None and self.remaining_requests <= 0:
+                return False
+            if self.remaining_tokens is not None and self.remaining_tokens < tokens:
+                return False
+        return True
+
+    def next_available(self, now: float) -> float:
+        """Seconds until a key blocked by backoff or exhausted limits can be tried again"""
+        return max(self.backoff_until, self.reset_at) - now
+
+
+class KeyPool:
+    """
+    Schedules LLM calls over a pool of API keys.
+
+    Each key runs up to `max_concurrency` calls, so throughput grows with the
+    number of keys. Remaining requests/tokens per key are tracked from the
+    x-ratelimit response headers, and a key that gets a 429 backs off on its
+    own while the others keep serving. Calls waiting for a key are released
+    in weighted-fair order across request classes: each class advances a
+    virtual clock by cost/weight, so a class with twice the weight gets twice
+    the share of keys when every class is backlogged.
+    """
+
+    def __init__(self, keys: List[str], max_concurrency: int = 4, weights: Optional[Dict[str, float]] = None,
+                 queue_timeout: float = 60, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.keys = [ApiKey(key, max_concurrency) for key in keys]
+        self.weights = weights or {}
+        self.queue_timeout = queue_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.waiters: List = []
+        self.sequence = itertools.count()
+        self.virtual_time = 0.0
+        self.class_finish: Dict[str, float] = {}
+        self.class_counters: Dict[str, Dict[str, int]] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def _pick(self, tokens: int) -> Optional[ApiKey]:
+        """Free key with the most headroom, None if every key is busy or limited"""
+        now = time.monotonic()
+        free = [key for key in self.keys if key.available(tokens, now)]
+        if not free:
+            return None
+        return min(free, key=lambda key: (key.in_flight / key.max_concurrency,
+                                          -(key.remaining_requests if key.remaining_requests is not None else float("inf"))))
+
+    def _take(self, key: ApiKey, tokens: int) -> ApiKey:
+        """Hand a key out, counting the call against its limits until the response headers correct them"""
+        key.in_flight += 1
+        key.counters["calls"] += 1
+        if key.remaining_requests is not None:
+            key.remaining_requests -= 1
+        if key.remaining_tokens is not None:
+            key.remaining_tokens -= tokens
+        return key
+
+    async def acquire(self, request_class: str = "default", tokens: int = 0, cost: float = 1.0) -> ApiKey:
+        """
+        Wait for a key to run a call on, in weighted-fair order. `tokens` is
+        the most the call can use, prompt plus max_tokens.
+        Raises asyncio.TimeoutError once queue_timeout is exceeded.
+        """
+        counters = self.class_counters.setdefault(request_class, {"calls": 0, "queued": 0})
+        counters["calls"] += 1
+        if not self.waiters:
+            key = self._pick(tokens)
+            if key is not None:
+                return self._take(key, tokens)
+
+        counters["queued"] += 1
+        weight = self.weights.get(request_class, 1.0)
+        finish = max(self.virtual_time, self.class_finish.get(request_class, 0.0)) + cost / weight
+        self.class_finish[request_class] = finish
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (finish, next(self.sequence), tokens, future))
+        self._dispatch()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if future.done() and not future.cancelled():
+                # A key was handed over as we gave up
+                self.release(future.result())
+            else:
+                future.cancel()
+            raise
+
+    def _dispatch(self) -> None:
+        """Hand free keys to waiters, earliest virtual finish time first"""
+        while self.waiters:
+            finish, _, tokens, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            key = self._pick(tokens)
+            if key is None:
+                self._schedule_retry()
+                return
+            heapq.heappop(self.waiters)
+            self.virtual_time = max(self.virtual_time, finish)
+            future.set_result(self._take(key, tokens))
+
+    def _schedule_retry(self) -> None:
+        """Dispatch again once the earliest backoff or rate-limit window ends"""
+        now = time.monotonic()
+        delays = [key.next_available(now) for key in self.keys if key.next_available(now) > 0]
+        if not delays or self.timer is not None:
+            return
+
+        def fire():
+            self.timer = None
+            self._dispatch()
+        self.timer = asyncio.get_running_loop().call_later(min(delays), fire)
+
+    def release(self, key: ApiKey, headers: Optional[Mapping[str, str]] = None) -> None:
+        """Return a key to the pool, updating its limits from the response headers"""
+        key.in_flight -= 1
+        if headers:
+            self.update_limits(key, headers)
+        key.rate_limited = 0
+        self._dispatch()
+
+    def update_limits(self, key: ApiKey, headers: Mapping[str, str]) -> None:
+        headers = {name.lower(): value for name, value in headers.items()}
+        remaining_requests = header_int(headers, "x-ratelimit-remaining-requests", "x-ratelimit-remaining")
+        remaining_tokens = header_int(headers, "x-ratelimit-remaining-tokens")
+        reset = parse_reset(headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset"))
+        if remaining_requests is not None:
+            key.remaining_requests = remaining_requests
+        if remaining_tokens is not None:
+            key.remaining_tokens = remaining_tokens
+        if reset is not None:
+            key.reset_at = time.monotonic() + reset
+
+    def rate_limited(self, key: ApiKey, retry_after: Optional[float] = None) -> None:
+        """Back a key off after a 429 and return it to the pool"""
+        key.rate_limited += 1
+        key.counters["rate_limited"] += 1
+        delay = retry_after if retry_after is not None else min(self.base_backoff * 2 ** (key.rate_limited - 1), self.max_backoff)
+        key.backoff_until = time.monotonic() + delay
+        logger.warning(f"API key {key.name} rate limited, backing off for {delay:.1f}s")
+        key.in_flight -= 1
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "queued": sum(1 for waiter in self.waiters if not waiter[3].done()),
+            "classes": self.class_counters,
+            "keys": [
+                {
+                    "key": key.name,
+                    "in_flight": key.in_flight,
+                    "remaining_requests": key.remaining_requests,
+                    "remaining_tokens": key.remaining_tokens,
+                    "backoff": max(key.backoff_until - now, 0.0),
+                    **key.counters,
+                }
+                for key in self.keys
+            ],
+        }
@@ -0,0 +1,263 @@
+import os
+import time
+import asyncio
+import httpx
+import openai
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from loguru import logger
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from langchain_together import ChatTogether
+from langchain_core.messages import convert_to_messages
+from src.key_pool import ApiKey, KeyPool, parse_reset
+from src.replay_transport import RecordReplayTransport
+from src.utils.token_budget import count_tokens
+
+# Get the parent directory of the current file (src/)
+current_dir = Path(__file__).parent
+# Go up one level to get to the root directory where .env is
+root_dir = current_dir.parent
+
+# Load .env from the root directory
+load_dotenv(root_dir / '.env')
+
+# "record" stores every LLM response under LLM_CASSETTE_DIR, "replay" serves them back offline
+LLM_TRANSPORT = os.getenv("LLM_TRANSPORT")
+LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "./benchmarks/cassettes")
+# Replayed latency: "none", "recorded" or "lognormal:<median seconds>:<sigma>"
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "recorded")
+
+# Replay never reaches the provider, so it doesn't need a real key
+TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY") or ("replay" if LLM_TRANSPORT == "replay" else None)
+# Comma-separated pool of keys, calls are spread over them
+TOGETHER_API_KEYS = [key.strip() for key in os.getenv("TOGETHER_API_KEYS", "").split(",") if key.strip()] or [TOGETHER_API_KEY]
+
+# Maximum number of LLM calls in flight per API key
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+# Seconds a request may wait for a free LLM slot before we give up with a 503
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+# Share of the keys each request class gets when they are all queued, e.g. "generate:1,edit:2"
+LLM_CLASS_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (item.split(":") for item in os.getenv("LLM_CLASS_WEIGHTS", "").split(",") if ":" in item)
+}
+# Attempts on other keys after a rate limit or transient provider error
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+
+DEFAULT_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
+
+llm_transport = RecordReplayTransport(
+    LLM_TRANSPORT, LLM_CASSETTE_DIR, latency=LLM_REPLAY_LATENCY
+) if LLM_TRANSPORT else None
+http_async_client = httpx.AsyncClient(transport=llm_transport) if llm_transport else None
+
+# Retried on another key; only rate limits back the key off
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def create_llm(model: str, api_key: Optional[str] = TOGETHER_API_KEYS[0]) -> ChatTogether:
+    """Create a Together AI client for a model and API key"""
+    return ChatTogether(
+        model=model,
+        together_api_key=api_key,
+        temperature=0.7,
+        max_tokens=16000,
+        # Rate limits are retried by the key pool on another key
+        max_retries=0,
+        include_response_headers=True,
+        http_async_client=http_async_client
+    )
+
+
+# Initialize Together AI client
+llm = create_llm(DEFAULT_MODEL)
+# One client per model the router sends traffic to and API key
+llm_clients = {(DEFAULT_MODEL, TOGETHER_API_KEYS[0]): llm}
+
+
+def get_llm(model: Optional[str] = None, api_key: Optional[str] = TOGETHER_API_KEYS[0]) -> ChatTogether:
+    """Client for a model and API key, the default model when no model is given"""
+    model = model or DEFAULT_MODEL
+    if (model, api_key) not in llm_clients:
+        llm_clients[(model, api_key)] = create_llm(model, api_key)
+    return llm_clients[(model, api_key)]
+
+# Shared by every generation endpoint, so a burst of long generations queues
+# here instead of piling up on the provider
+key_pool = KeyPool(
+    TOGETHER_API_KEYS,
+    max_concurrency=LLM_CONCURRENCY,
+    weights=LLM_CLASS_WEIGHTS,
+    queue_timeout=LLM_QUEUE_TIMEOUT
+)
+
+
+async def acquire_llm_slot(request_class: str = "default", tokens: int = 0) -> ApiKey:
+    """Wait for a free API key, failing with 503 once LLM_QUEUE_TIMEOUT is exceeded"""
+    try:
+        return await key_pool.acquire(request_class, tokens)
+    except asyncio.TimeoutError:
+        logger.error(f"No LLM slot became free within {LLM_QUEUE_TIMEOUT}s")
+        raise HTTPException(status_code=503, detail="Character generation is busy, please retry shortly")
+
+
+class TruncatedResponse(ValueError):
+    """The completion stopped at max_tokens, its text is incomplete"""
+
+    def __init__(self, text: str, max_tokens: Optional[int]):
+        super().__init__(f"Response was cut off at max_tokens={max_tokens}")
+        self.text = text
+        self.max_tokens = max_tokens
+
+
+def handle_retryable_error(key: ApiKey, error: Exception, attempt: int) -> None:
+    """Return the key to the pool after a retryable error, raising once retries are used up"""
+    if isinstance(error, openai.RateLimitError):
+        headers = error.response.headers
+        key_pool.update_limits(key, headers)
+        key_pool.rate_limited(key, parse_reset(headers.get("retry-after")))
+    else:
+        logger.warning(f"LLM call on key {key.name} failed: {error}")
+        key_pool.release(key)
+    if attempt == LLM_RETRIES:
+        if isinstance(error, openai.RateLimitError):
+            raise HTTPException(status_code=429, detail="Character generation is rate limited, please retry shortly")
+        raise error
+
+
+async def acquire_for_call(request_class: str, tokens: int, record: Optional[Dict[str, Any]], attempt: int) -> ApiKey:
+    """Acquire a key for a call of up to `tokens` tokens, adding the wait to the call record"""
+    started = time.monotonic()
+    key = await acquire_llm_slot(request_class, tokens)
+    if record is not None:
+        record["queue_time"] += time.monotonic() - started
+        record["retries"] = attempt
+    return key
+
+
+def prompt_tokens(messages) -> int:
+    """Estimated tokens of the prompt messages, plain strings or (role, content) pairs"""
+    return sum(count_tokens(message if isinstance(message, str) else message[1]) for message in messages)
+
+
+def record_usage(record: Optional[Dict[str, Any]], usage: Optional[Dict[str, int]], messages, text: str) -> None:
+    """Token counts of a call from the provider's usage, estimated when it isn't reported"""
+    if record is None:
+        return
+    if usage:
+        record["prompt_tokens"] = usage["input_tokens"]
+        record["completion_tokens"] = usage["output_tokens"]
+    else:
+        record["prompt_tokens"] = prompt_tokens(messages)
+        record["completion_tokens"] = count_tokens(text)
+
+
+async def invoke_llm(messages, max_tokens: Optional[int] = None, model: Optional[str] = None,
+                     request_class: str = "default", record: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Send messages to the LLM on the async path and return the response text.
+    `record` (see CallMetrics) gets the queue time, tokens and retries.
+    Raises TruncatedResponse when the completion stopped at max_tokens.
+    """
+    kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+    tokens = prompt_tokens(messages) + (max_tokens or 0)
+    for attempt in range(LLM_RETRIES + 1):
+        key = await acquire_for_call(request_class, tokens, record, attempt)
+        try:
+            ai_msg = await get_llm(model, key.key).ainvoke(messages, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            handle_retryable_error(key, e, attempt)
+            continue
+        except BaseException:
+            key_pool.release(key)
+            raise
+        key_pool.release(key, ai_msg.response_metadata.get("headers"))
+        record_usage(record, ai_msg.usage_metadata, messages, ai_msg.content)
+        if ai_msg.response_metadata.get("finish_reason") == "length":
+            raise TruncatedResponse(ai_msg.content, max_tokens)
+        return ai_msg.content
+
+
+async def sample_llm(messages, n: int, max_tokens: Optional[int] = None, model: Optional[str] = None,
+                     request_class: str = "default", record: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    Sample n responses to the same messages in one call with the provider's `n`,
+    so the prompt is only processed once. Providers that ignore `n` return fewer
+    responses than asked. A response cut off at max_tokens is returned as a
+    TruncatedResponse in its place.
+    """
+    kwargs = {"n": n, "max_tokens": max_tokens} if max_tokens else {"n": n}
+    # The prompt is processed once for all n responses
+    tokens = prompt_tokens(messages) + (max_tokens or 0) * n
+    for attempt in range(LLM_RETRIES + 1):
+        key = await acquire_for_call(request_class, tokens, record, attempt)
+        try:
+            result = await get_llm(model, key.key).agenerate([convert_to_messages(messages)], **kwargs)
+        except RETRYABLE_ERRORS as e:
+            handle_retryable_error(key, e, attempt)
+            continue
+        except BaseException:
+            key_pool.release(key)
+            raise
+        generations = result.generations[0]
+        # Headers and usage are the same on every choice and cover the whole call
+        message = generations[0].message if generations else None
+        key_pool.release(key, message.response_metadata.get("headers") if message else None)
+        record_usage(record, message.usage_metadata if message else None, messages,
+                     "".join(generation.text for generation in generations))
+        return [
+            TruncatedResponse(generation.text, max_tokens)
+            if (generation.generation_info or {}).get("finish_reason") == "length" else generation.text
+            for generation in generations
+        ]
+
+
+async def stream_llm(messages, max_tokens: Optional[int] = None, model: Optional[str] = None,
+                     request_class: str = "default", record: Optional[Dict[str, Any]] = None,
+                     on_send: Optional[Callable[[bool], None]] = None) -> AsyncIterator[str]:
+    """
+    Stream the LLM response text as it arrives, holding an API key slot until it finishes.
+    `record` (see CallMetrics) also gets the time to first token. `on_send` is
+    called with True once a key is held and the request goes out, with False
+    when a retry has to wait for a key again. Raises TruncatedResponse after
+    the last chunk when the completion stopped at max_tokens.
+    """
+    kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+    tokens = prompt_tokens(messages) + (max_tokens or 0)
+    for attempt in range(LLM_RETRIES + 1):
+        if on_send is not None and attempt:
+            on_send(False)
+        key = await acquire_for_call(request_class, tokens, record, attempt)
+        sent = time.monotonic()
+        if on_send is not None:
+            on_send(True)
+        headers = None
+        usage = None
+        finish_reason = None
+        chunks = []
+        try:
+            async for chunk in get_llm(model, key.key).astream(messages, **kwargs):
+                headers = headers or chunk.response_metadata.get("headers")
+                usage = chunk.usage_metadata or usage
+                finish_reason = chunk.response_metadata.get("finish_reason") or finish_reason
+                if chunk.content:
+                    if not chunks and record is not None and record["ttft"] is None:
+                        record["ttft"] = time.monotonic() - sent
+                    chunks.append(chunk.content)
+                    yield chunk.content
+        except RETRYABLE_ERRORS as e:
+            if chunks:
+                # Part of the response was already sent, it can't be retried
+                key_pool.release(key)
+                raise
+            handle_retryable_error(key, e, attempt)
+            continue
+        except BaseException:
+            key_pool.release(key)
+            raise
+        key_pool.release(key, headers)
+        record_usage(record, usage, messages, "".join(chunks))
+        if finish_reason == "length":
+            raise TruncatedResponse("".join(chunks), max_tokens)
+        return
@@ -0,0 +1,103 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+from loguru import logger
+from src.utils.stats import percentile
+
+TIERS = ["small", "medium", "large"]
+
+# Smallest tier that does a call type well
+CALL_TYPE_TIERS = {
+    "extract": "small",
+    "edit": "small",
+    "skeleton": "medium",
+    "section": "medium",
+    "generate": "large",
+}
+
+# Escalations left to the operation (a generation, an edit) the current call is made for
+escalation_budget: ContextVar[Optional[Dict[str, int]]] = ContextVar("escalation_budget", default=None)
+
+
+class ModelRouter:
+    """
+    Picks a model tier per LLM call.
+
+    Each call type starts at its own tier and moves up when its input is
+    larger than the smaller tiers handle well. When a tier's output fails
+    validation the caller escalates to the next tier with a different model,
+    at most `max_escalations` times per operation (see budget). Latency and
+    success rate are recorded per tier.
+    """
+
+    def __init__(self, models: Dict[str, str], small_max_input_tokens: int = 2000,
+                 medium_max_input_tokens: int = 8000, window: int = 500, max_escalations: int = 2):
+        self.models = models
+        self.max_escalations = max_escalations
+        self.small_max_input_tokens = small_max_input_tokens
+        self.medium_max_input_tokens = medium_max_input_tokens
+        self.latencies = {tier: deque(maxlen=window) for tier in TIERS}
+        self.counters = {tier: {"calls": 0, "successes": 0, "escalations": 0} for tier in TIERS}
+
+    def route(self, call_type: str, input_tokens: int = 0) -> str:
+        """Tier for a call of this type and input size"""
+        tier = CALL_TYPE_TIERS.get(call_type, "large")
+        if tier == "small" and input_tokens > self.small_max_input_tokens:
+            tier = "medium"
+        if tier == "medium" and input_tokens > self.medium_max_input_tokens:
+            tier = "large"
+        return tier
+
+    def model(self, tier: str) -> str:
+        return self.models[tier]
+
+    @contextmanager
+    def budget(self):
+        """
+        Share one escalation budget between the calls made inside, including
+        nested calls (a JSON repair inside an edit) and tasks started inside.
+        Inside another budget, the outer one is used.
+        """
+        if escalation_budget.get() is not None:
+            yield
+            return
+        token = escalation_budget.set({"left": self.max_escalations})
+        try:
+            yield
+        finally:
+            escalation_budget.reset(token)
+
+    def escalate(self, tier: str) -> Optional[str]:
+        """Next larger tier that runs a different model, None if there is none or the budget is used up"""
+        budget = escalation_budget.get()
+        if budget is not None and budget["left"] <= 0:
+            logger.warning(f"Not escalating from {tier}, the operation used up its {self.max_escalations} escalations")
+            return None
+        for larger in TIERS[TIERS.index(tier) + 1:]:
+            if self.models[larger] != self.models[tier]:
+                if budget is not None:
+                    budget["left"] -= 1
+                self.counters[tier]["escalations"] += 1
+                logger.warning(f"Escalating from {tier} ({self.models[tier]}) to {larger} ({self.models[larger]})")
+                return larger
+        return None
+
+    def record(self, tier: str, latency: float, success: bool) -> None:
+        self.latencies[tier].append(latency)
+        self.counters[tier]["calls"] += 1
+        self.counters[tier]["successes"] += success
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-tier model, call counts, success rate and recent latency percentiles"""
+        stats = {}
+        for tier in TIERS:
+            calls = self.counters[tier]["calls"]
+            stats[tier] = {
+                "model": self.models[tier],
+                **self.counters[tier],
+                "success_rate": self.counters[tier]["successes"] / calls if calls else None,
+                "latency_p50": percentile(self.latencies[tier], 0.5),
+                "latency_p95": percentile(self.latencies[tier], 0.95),
+            }
+        return stats
@@ -0,0 +1,190 @@
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+from loguru import logger
+from fastapi import HTTPException
+from src.utils.stats import percentile
+
+StageFunction = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    `run` gets the pipeline context and its result is stored in the context
+    under the stage name. `after` lists the stages it needs. Local stages
+    (no network round-trip) run before any remote stage that is ready at the
+    same time, so a cheap check can fail the pipeline before the slow ones
+    start. `cleanup` undoes the stage when a later one fails. A `commit`
+    stage has effects that can't be taken back, even when it fails (e.g. a
+    notification the other side may have acted on before timing out): once
+    it started, a failure no longer cleans up the earlier stages.
+    """
+
+    def __init__(self, name: str, run: StageFunction, after: Sequence[str] = (), timeout: Optional[float] = None,
+                 local: bool = False, cleanup: Optional[StageFunction] = None, commit: bool = False):
+        self.name = name
+        self.run = run
+        self.after = tuple(after)
+        self.timeout = timeout
+        self.local = local
+        self.cleanup = cleanup
+        self.commit = commit
+
+
+class Pipeline:
+    """
+    Runs stages as a dependency graph.
+
+    Every stage starts as soon as the stages it depends on are done, so
+    independent remote stages run concurrently and the pipeline takes as long
+    as its critical path. The first failure (or a stage exceeding its timeout,
+    reported as 504) cancels the stages still running, then the cleanup of
+    every stage that started is run, most recent first, unless a commit
+    stage started, and the error is raised.
+    """
+
+    def __init__(self, stages: List[Stage], window: int = 500):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            unknown = [name for name in stage.after if name not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages {', '.join(unknown)}")
+        self._check_acyclic()
+        self.durations = {name: deque(maxlen=window) for name in self.stages}
+        self.totals = deque(maxlen=window)
+        self.critical_paths = deque(maxlen=window)
+        self.runs = 0
+        self.failures = {name: 0 for name in self.stages}
+
+    def _check_acyclic(self) -> None:
+        visiting, visited = set(), set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage {name} is part of a dependency cycle")
+            visiting.add(name)
+            for dependency in self.stages[name].after:
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def _run_stage(self, stage: Stage, context: Dict[str, Any], timings: Dict[str, List[float]]) -> None:
+        started = time.monotonic()
+        timings[stage.name] = [started, started]
+        try:
+            if stage.timeout:
+                context[stage.name] = await asyncio.wait_for(stage.run(context), stage.timeout)
+            else:
+                context[stage.name] = await stage.run(context)
+        except asyncio.TimeoutError:
+            self.failures[stage.name] += 1
+            logger.error(f"Stage {stage.name} timed out after {stage.timeout}s")
+            raise HTTPException(status_code=504, detail=f"Stage {stage.name} timed out")
+        except Exception as e:
+            self.failures[stage.name] += 1
+            logger.error(f"Stage {stage.name} failed: {e!r}")
+            raise
+        finally:
+            timings[stage.name][1] = time.monotonic()
+
+    def _ready(self, done: set, started: List[Stage]) -> List[Stage]:
+        started_names = {stage.name for stage in started}
+        return [
+            stage for stage in self.stages.values()
+            if stage.name not in started_names and all(name in done for name in stage.after)
+        ]
+
+    async def run(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Run every stage with the context and return it, holding each stage's result"""
+        begun = time.monotonic()
+        done, started, timings = set(), [], {}
+        running: Dict[asyncio.Task, Stage] = {}
+        try:
+            while len(done) < len(self.stages):
+                ready = self._ready(done, started)
+                local = [stage for stage in ready if stage.local]
+                if local:
+                    # Cheap checks first, the remote stages wait for them
+                    started.append(local[0])
+                    await self._run_stage(local[0], context, timings)
+                    done.add(local[0].name)
+                    continue
+                for stage in ready:
+                    started.append(stage)
+                    running[asyncio.create_task(self._run_stage(stage, context, timings))] = stage
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    stage = running.pop(task)
+                    task.result()
+                    done.add(stage.name)
+        except BaseException:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            committed = [stage.name for stage in started if stage.commit]
+            if committed:
+                logger.warning(f"Pipeline failed after {', '.join(committed)} started, keeping the results of earlier stages")
+            else:
+                await self._cleanup(started, context)
+            raise
+        finally:
+            self.runs += 1
+            for name, (start, end) in timings.items():
+                if name in done:
+                    self.durations[name].append(end - start)
+        total = time.monotonic() - begun
+        self.totals.append(total)
+        path = self.critical_path(timings)
+        self.critical_paths.append(path)
+        logger.info(f"Pipeline finished in {total:.2f}s, critical path {' -> '.join(path)}, "
+                    f"stages {({name: round(end - start, 3) for name, (start, end) in timings.items()})}")
+        return context
+
+    async def _cleanup(self, started: List[Stage], context: Dict[str, Any]) -> None:
+        for stage in reversed(started):
+            if stage.cleanup is None:
+                continue
+            try:
+                await stage.cleanup(context)
+                logger.info(f"Cleaned up stage {stage.name}")
+            except Exception as e:
+                logger.error(f"Cleanup of stage {stage.name} failed: {str(e)}")
+
+    def critical_path(self, timings: Dict[str, List[float]]) -> List[str]:
+        """Stages that determined the total time: the last to finish, then its latest dependency, and so on"""
+        if not timings:
+            return []
+        path = [max(timings, key=lambda name: timings[name][1])]
+        while True:
+            dependencies = [name for name in self.stages[path[-1]].after if name in timings]
+            if not dependencies:
+                return list(reversed(path))
+            path.append(max(dependencies, key=lambda name: timings[name][1]))
+
+    def stats(self) -> Dict[str, Any]:
+        paths = {}
+        for path in self.critical_paths:
+            key = " -> ".join(path)
+            paths[key] = paths.get(key, 0) + 1
+        return {
+            "runs": self.runs,
+            "total_p50": percentile(self.totals, 0.5),
+            "total_p95": percentile(self.totals, 0.95),
+            "critical_paths": paths,
+            "stages": {
+                name: {
+                    "p50": percentile(durations, 0.5),
+                    "p95": percentile(durations, 0.95),
+                    "failures": self.failures[name],
+                }
+                for name, durations in self.durations.items()
+            },
+        }
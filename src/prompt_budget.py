@@ -0,0 +1,98 @@
+import json
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from src.types import CharacterRequest
+from src.utils.token_budget import count_tokens
+from src.utils.create_utility_template import create_utility_template, UTILITY_CHARACTER_KEYS
+
+# Typical size of each generated character key, in tokens
+KEY_OUTPUT_TOKENS = {
+    "name": 10,
+    "bio": 150,
+    "lore": 250,
+    "knowledge": 100,
+    "messageExamples": 600,
+    "postExamples": 250,
+    "topics": 80,
+    "style": 250,
+    "adjectives": 50,
+    "clients": 10,
+    "modelProvider": 10,
+}
+DEFAULT_KEY_TOKENS = 150
+# JSON punctuation, fences and the odd sentence of prose around the object
+OUTPUT_OVERHEAD_TOKENS = 100
+
+
+class PromptBudget:
+    """
+    Sizes prompts and max_tokens per call.
+
+    The static prefix of the generation template is counted once (calibrate),
+    the output size is estimated from the keys the call asks for, and the
+    example section is dropped from prompts that would exceed the prompt
+    budget, counting retrieved documents as if they filled
+    `context_token_budget` so the decision is known before retrieval (it is
+    part of the cache key). Estimates are multiplied by a safety factor and clamped.
+    """
+
+    def __init__(self, prompt_token_budget: int = 6000, min_output_tokens: int = 256,
+                 max_output_tokens: int = 16000, safety_factor: float = 1.5, context_token_budget: int = 0):
+        self.prompt_token_budget = prompt_token_budget
+        self.context_token_budget = context_token_budget
+        self.min_output_tokens = min_output_tokens
+        self.max_output_tokens = max_output_tokens
+        self.safety_factor = safety_factor
+        self.static_tokens: Optional[int] = None
+        self.example_tokens: Optional[int] = None
+        self.counters = {"prompts": 0, "examples_trimmed": 0}
+
+    def calibrate(self) -> None:
+        """Count the tokens of the static template prefix"""
+        empty = CharacterRequest(prompt="")
+        self.static_tokens = count_tokens(create_utility_template(empty))
+        self.example_tokens = self.static_tokens - count_tokens(create_utility_template(empty, include_example=False))
+        logger.info(f"Generation template prefix is {self.static_tokens} tokens, {self.example_tokens} of them example")
+
+    def clamp(self, tokens: float) -> int:
+        return int(min(max(tokens, self.min_output_tokens), self.max_output_tokens))
+
+    def includes_example(self, request: CharacterRequest) -> bool:
+        """Whether the generation prompt for the request fits the budget with its example"""
+        if self.static_tokens is None:
+            self.calibrate()
+        prompt_tokens = self.static_tokens + count_tokens(request.prompt) + self.context_token_budget
+        return prompt_tokens <= self.prompt_token_budget
+
+    def generation_prompt(self, request: CharacterRequest, context_documents: Optional[List[str]] = None) -> str:
+        """Render the generation prompt, trimming the example if it doesn't fit the budget"""
+        self.counters["prompts"] += 1
+        if self.includes_example(request):
+            return create_utility_template(request, context_documents=context_documents)
+
+        self.counters["examples_trimmed"] += 1
+        logger.info(f"Prompt is over the {self.prompt_token_budget} token budget, dropping the example")
+        return create_utility_template(request, include_example=False, context_documents=context_documents)
+
+    def output_tokens(self, keys: List[str] = UTILITY_CHARACTER_KEYS,
+                      current: Optional[Dict[str, Any]] = None) -> int:
+        """max_tokens for a completion producing `keys`, at least as big as their current values"""
+        current = current or {}
+        estimate = OUTPUT_OVERHEAD_TOKENS
+        for key in keys:
+            estimate += KEY_OUTPUT_TOKENS.get(key, DEFAULT_KEY_TOKENS)
+            if key in current:
+                estimate += count_tokens(json.dumps(current[key], ensure_ascii=False))
+        return self.clamp(estimate * self.safety_factor)
+
+    def repair_tokens(self, response: str) -> int:
+        """max_tokens for re-emitting an existing response as clean JSON"""
+        return self.clamp((count_tokens(response) + OUTPUT_OVERHEAD_TOKENS) * self.safety_factor)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "static_tokens": self.static_tokens,
+            "example_tokens": self.example_tokens,
+            "prompt_token_budget": self.prompt_token_budget,
+        }
@@ -0,0 +1,185 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import httpx
+from loguru import logger
+
+# Response headers kept in recordings, the rest describe the original connection
+RECORDED_HEADERS = ("content-type", "x-ratelimit-")
+# Request fields that follow from token counts (max_tokens, the tier's model), which
+# differ with and without tiktoken, so they are left out of the key
+BUDGET_FIELDS = ("max_tokens", "model")
+
+
+def request_body(request: httpx.Request):
+    try:
+        return json.loads(request.content or b"null")
+    except ValueError:
+        return None
+
+
+def request_key(request: httpx.Request) -> str:
+    """Hash of the method, path and JSON body of a request, independent of the API key and token budgets"""
+    body = request_body(request)
+    if isinstance(body, dict):
+        body = json.dumps({name: value for name, value in body.items() if name not in BUDGET_FIELDS}, sort_keys=True)
+    elif body is not None:
+        body = json.dumps(body, sort_keys=True)
+    else:
+        body = request.content.decode(errors="replace")
+    raw = "\x1f".join([request.method, request.url.path, body])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def parse_latency(spec: str) -> Tuple[str, List[float]]:
+    """
+    Parse a simulated latency spec: "none", "recorded" (the latency seen when
+    recording) or "lognormal:<median seconds>:<sigma>".
+    """
+    name, *params = spec.split(":")
+    if name not in ("none", "recorded", "lognormal") or (name == "lognormal" and len(params) != 2):
+        raise ValueError(f"Invalid latency spec {spec}")
+    return name, [float(param) for param in params]
+
+
+class ReplayStream(httpx.AsyncByteStream):
+    """Replays a recorded body, spreading the events over the simulated latency"""
+
+    def __init__(self, chunks: List[bytes], ttft: float, elapsed: float):
+        self.chunks = chunks
+        self.ttft = ttft
+        self.elapsed = elapsed
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        gap = (self.elapsed - self.ttft) / max(len(self.chunks) - 1, 1)
+        for i, chunk in enumerate(self.chunks):
+            await asyncio.sleep(self.ttft if i == 0 else gap)
+            yield chunk
+
+
+class RecordingStream(httpx.AsyncByteStream):
+    """Passes a provider body through as it arrives, handing it to `save` once read to the end"""
+
+    def __init__(self, response: httpx.Response, started: float, save):
+        self.response = response
+        self.started = started
+        self.save = save
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        ttft, chunks = None, []
+        async for chunk in self.response.stream:
+            if ttft is None:
+                ttft = time.monotonic() - self.started
+            chunks.append(chunk)
+            yield chunk
+        elapsed = time.monotonic() - self.started
+        await self.save(b"".join(chunks), ttft or elapsed, elapsed)
+
+    async def aclose(self) -> None:
+        await self.response.aclose()
+
+
+class RecordReplayTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that records LLM responses to disk or replays them.
+
+    In "record" mode requests go to the provider and each response is stored
+    in `cassette_dir` under the hash of its request (see request_key), passed
+    through as it arrives and saved once the caller has read it. A cassette
+    holds one recording per model, so an escalated retry of the same messages
+    keeps its own response. In "replay" mode the stored response is returned
+    without any network call, after a simulated latency: the recording of the
+    request's model, or the first one recorded when that model wasn't (the
+    tier was picked from a different token count). A request without a
+    recording fails with 404. Streamed responses are replayed event by event.
+    """
+
+    def __init__(self, mode: str, cassette_dir: str, latency: str = "recorded",
+                 inner: Optional[httpx.AsyncBaseTransport] = None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Invalid transport mode {mode}")
+        self.mode = mode
+        self.cassette_dir = Path(cassette_dir)
+        self.cassette_dir.mkdir(parents=True, exist_ok=True)
+        self.latency = parse_latency(latency)
+        # Only recording talks to the provider
+        self.inner = inner or (httpx.AsyncHTTPTransport() if mode == "record" else None)
+        self.counters = {"recorded": 0, "replayed": 0, "missing": 0}
+        # Recordings of one cassette are merged into its file one at a time
+        self.save_lock = asyncio.Lock()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request)
+        path = self.cassette_dir / f"{key}.json"
+        if self.mode == "record":
+            return await self.record(request, path)
+        return await self.replay(request, path)
+
+    async def record(self, request: httpx.Request, path: Path) -> httpx.Response:
+        started = time.monotonic()
+        response = await self.inner.handle_async_request(request)
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower().startswith(RECORDED_HEADERS)}
+        # Decoding would fail on compressed bodies, keep them as the provider sent them
+        headers.update({name: value for name, value in response.headers.items() if name.lower() == "content-encoding"})
+
+        async def save(body: bytes, ttft: float, elapsed: float) -> None:
+            request_json = request_body(request)
+            model = request_json.get("model") if isinstance(request_json, dict) else None
+            async with self.save_lock:
+                cassette = {"recordings": {}}
+                if path.exists():
+                    cassette = json.loads(await asyncio.to_thread(path.read_text))
+                cassette["recordings"][str(model)] = {
+                    "request": request_json,
+                    "status_code": response.status_code,
+                    "headers": headers,
+                    "body": body.decode("latin-1"),
+                    "ttft": ttft,
+                    "elapsed": elapsed,
+                }
+                await asyncio.to_thread(path.write_text, json.dumps(cassette, indent=2))
+            self.counters["recorded"] += 1
+
+        return httpx.Response(response.status_code, headers=headers, stream=RecordingStream(response, started, save),
+                              request=request)
+
+    def simulated_latency(self, recording: Dict) -> Tuple[float, float]:
+        """Time to first byte and total time for a replayed response"""
+        name, params = self.latency
+        if name == "none":
+            return 0.0, 0.0
+        if name == "recorded":
+            return recording["ttft"], recording["elapsed"]
+        median, sigma = params
+        elapsed = random.lognormvariate(0, sigma) * median
+        return elapsed * recording["ttft"] / (recording["elapsed"] or 1), elapsed
+
+    async def replay(self, request: httpx.Request, path: Path) -> httpx.Response:
+        if not path.exists():
+            self.counters["missing"] += 1
+            logger.error(f"No recording for {request.method} {request.url.path} ({path.name})")
+            return httpx.Response(404, json={"error": {"message": f"No recording for request {path.stem}"}}, request=request)
+        recordings = json.loads(await asyncio.to_thread(path.read_text))["recordings"]
+        request_json = request_body(request)
+        model = str(request_json.get("model") if isinstance(request_json, dict) else None)
+        if model not in recordings:
+            logger.debug(f"No recording of {path.stem} for {model}, replaying the first one")
+        recording = recordings.get(model) or next(iter(recordings.values()))
+        body = recording["body"].encode("latin-1")
+        chunks = [body]
+        if recording["headers"].get("content-type", "").startswith("text/event-stream"):
+            # Server-sent events are replayed one event at a time
+            chunks = [event + b"\n\n" for event in body.split(b"\n\n") if event] or [body]
+        ttft, elapsed = self.simulated_latency(recording)
+        self.counters["replayed"] += 1
+        return httpx.Response(
+            recording["status_code"],
+            headers=recording["headers"],
+            stream=ReplayStream(chunks, ttft, elapsed),
+            request=request
+        )
@@ -0,0 +1,132 @@
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+import numpy as np
+from loguru import logger
+from src.embeddings import embed_query, get_embeddings
+from src.utils.token_budget import count_tokens
+from src.utils.stats import percentile
+
+
+class DocumentIndex:
+    """
+    In-memory retrieval index over the ElizaOS sources.
+
+    The eliza_docs Chroma collection built by embedding.py is read once at
+    startup into a normalized matrix, so a search is one dot product instead
+    of a Chroma query. Results are cached per query (LRU) and packed into a
+    token budget, best match first. Embedding and search latency are
+    recorded separately from the generation.
+    """
+
+    def __init__(self, persist_directory: str = "./data/chroma_db", collection_name: str = "eliza_docs",
+                 top_k: int = 4, token_budget: int = 1500, cache_size: int = 256, window: int = 1000):
+        self.persist_directory = persist_directory
+        self.collection_name = collection_name
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.cache_size = cache_size
+        self.vectors: Optional[np.ndarray] = None
+        self.documents: List[str] = []
+        self.sources: List[str] = []
+        self.cache: OrderedDict = OrderedDict()
+        self.latencies = {"embed": deque(maxlen=window), "search": deque(maxlen=window), "total": deque(maxlen=window)}
+        self.counters = {"queries": 0, "cache_hits": 0, "errors": 0}
+
+    def _load(self) -> None:
+        try:
+            import chromadb
+        except ImportError:
+            logger.error("chromadb is not installed, retrieval is disabled")
+            return
+        collection = chromadb.PersistentClient(path=self.persist_directory).get_collection(self.collection_name)
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        if not data["ids"]:
+            logger.warning(f"Collection {self.collection_name} is empty, retrieval is disabled")
+            return
+        vectors = np.asarray(data["embeddings"], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.where(norms == 0, 1, norms)
+        self.documents = list(data["documents"])
+        self.sources = [(metadata or {}).get("source", "") for metadata in data["metadatas"]]
+        # Load the query embedding model now rather than on the first request
+        get_embeddings()
+
+    async def load(self) -> None:
+        """Read the collection into memory"""
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(self._load)
+        except Exception as e:
+            logger.error(f"Error loading retrieval index: {str(e)}")
+            return
+        if self.vectors is not None:
+            logger.info(f"Loaded {len(self.documents)} chunks of {self.collection_name} in {time.monotonic() - started:.2f}s")
+
+    def search(self, vector: np.ndarray, k: int) -> List[Dict[str, Any]]:
+        """Top-k chunks by cosine similarity to a normalized query vector"""
+        scores = self.vectors @ vector
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [
+            {"content": self.documents[i], "source": self.sources[i], "score": float(scores[i])}
+            for i in best
+        ]
+
+    def pack(self, results: List[Dict[str, Any]]) -> List[str]:
+        """Best results that fit the token budget together"""
+        packed, used = [], 0
+        for result in results:
+            tokens = count_tokens(result["content"])
+            if used + tokens > self.token_budget:
+                continue
+            packed.append(result["content"])
+            used += tokens
+        return packed
+
+    async def retrieve(self, query: str) -> List[str]:
+        """Documents relevant to the query, packed into the token budget; empty when unavailable"""
+        if self.vectors is None:
+            return []
+        self.counters["queries"] += 1
+        started = time.monotonic()
+        key = " ".join(query.lower().split())
+        if key in self.cache:
+            self.counters["cache_hits"] += 1
+            self.cache.move_to_end(key)
+            self.latencies["total"].append(time.monotonic() - started)
+            return self.cache[key]
+
+        try:
+            vector = await embed_query(query)
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.error(f"Error embedding retrieval query: {str(e)}")
+            return []
+        if vector is None:
+            return []
+        embedded = time.monotonic()
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1)
+        documents = self.pack(self.search(vector, self.top_k))
+        finished = time.monotonic()
+
+        self.latencies["embed"].append(embedded - started)
+        self.latencies["search"].append(finished - embedded)
+        self.latencies["total"].append(finished - started)
+        self.cache[key] = documents
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return documents
+
+    def stats(self) -> Dict[str, Any]:
+        """Index size, cache hit rate and retrieval latency in seconds"""
+        queries = self.counters["queries"]
+        return {
+            **self.counters,
+            "cache_hit_rate": self.counters["cache_hits"] / queries if queries else 0.0,
+            "index_size": len(self.documents),
+            "latency": {stage: {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95)} for stage, values in self.latencies.items()},
+        }
@@ -1,13 +1,17 @@
 
+import io
 import os
-import boto3
 import json
 from pathlib import Path
 from dotenv import load_dotenv
 from datetime import datetime
 from loguru import logger
-from typing import Dict
+from typing import Any, Dict
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
+from fastapi import HTTPException
+from src.storage import Storage
 
 # Get the parent directory of the current file (src/)
 current_dir = Path(__file__).parent
@@ -17,20 +21,32 @@ root_dir = current_dir.parent
 # Load .env from the root directory
 load_dotenv(root_dir / '.env')
 
-# Initialize MongoDB client
-mongodb_uri = os.getenv('AWS_ACCESS_KEY_ID')
-token_address = os.getenv('AWS_SECRET_ACCESS_KEY')
-balance_threshold = os.getenv('AWS_REGION')
+BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
+# Custom S3 endpoint, e.g. a local minio or moto server for tests and benchmarks
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+# S3 calls that can run at once, the connection pool is S3_MULTIPART_CONCURRENCY times larger for multipart parts
+S3_MAX_CONNECTIONS = int(os.getenv('S3_MAX_CONNECTIONS', '32'))
 
+# Knowledge files above this size are uploaded as a multipart upload
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))
+# Size of each part, a multipart upload holds at most S3_MULTIPART_CONCURRENCY parts in memory
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE', str(8 * 1024 * 1024)))
+# Parts of one upload sent in parallel
+S3_MULTIPART_CONCURRENCY = int(os.getenv('S3_MULTIPART_CONCURRENCY', '4'))
 
-# S3 client configuration
-s3_client = boto3.client(
-    's3',
+storage = Storage(
+    BUCKET_NAME,
+    region=os.getenv('AWS_REGION', 'us-east-1'),
+    endpoint_url=S3_ENDPOINT_URL,
+    max_connections=S3_MAX_CONNECTIONS,
+    transfer_config=TransferConfig(
+        multipart_threshold=S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+        max_concurrency=S3_MULTIPART_CONCURRENCY
+    ),
     aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION', 'us-east-1')
+    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
 )
-BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
 
 async def upload_character_to_s3(address: str, agent_id: str, file_content: bytes, content_type: str = None) -> str:
     """
@@ -51,27 +67,14 @@ async def upload_character_to_s3(address: str, agent_id: str, file_content: byte
         # Generate timestamp
         timestamp = datetime.utcnow().isoformat()
         
-        # Prepare metadata and content type arguments
+        # Prepare metadata
         metadata = {
             'timestamp': timestamp,
             'agent_id': agent_id
         }
         
-        extra_args = {
-            'Metadata': metadata,
-            **(({'ContentType': content_type} if content_type else {}))
-        }
-        
         # Upload to S3
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key=s3_path,
-            Body=file_content,
-            **extra_args
-        )
-        
-        # Generate URL
-        url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_path}"
+        url = await storage.put(s3_path, file_content, content_type, metadata)
         
         logger.info(f"Uploaded character.json for agent {agent_id} with timestamp {timestamp}")
         return url
@@ -81,13 +84,13 @@ async def upload_character_to_s3(address: str, agent_id: str, file_content: byte
         raise HTTPException(status_code=500, detail="Failed to upload file to S3")
 
 
-async def upload_knowledge_to_s3(address: str, agent_id: str, file_content: Dict, file_name: str, content_type: str = None) -> str:
+async def upload_knowledge_to_s3(address: str, agent_id: str, file_content: Any, file_name: str, content_type: str = None) -> str:
     """
     Upload a file to S3 with timestamp metadata and return its URL
     
     Args:
         agent_id: The ID of the agent
-        file_content: The file content in bytes
+        file_content: The knowledge JSON, as a dict or a binary file object read in chunks
         content_type: MIME type of the file
     
     Returns:
@@ -95,38 +98,36 @@ async def upload_knowledge_to_s3(address: str, agent_id: str, file_content: Dict
     """
     try:
 
-        content_bytes = json.dumps(file_content).encode('utf-8')
+        if isinstance(file_content, dict):
+            file_content = io.BytesIO(json.dumps(file_content).encode('utf-8'))
         # Generate a unique file path
         s3_path = f"{address}/{agent_id}/knowledge/{file_name}"
         
         # Generate timestamp
         timestamp = datetime.utcnow().isoformat()
         
-        # Prepare metadata and content type arguments
+        # Prepare metadata
         metadata = {
             'timestamp': timestamp,
             'agent_id': agent_id
         }
         
-        extra_args = {
-            'Metadata': metadata,
-            **(({'ContentType': content_type} if content_type else {}))
-        }
-        
-        # Upload to S3
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key=s3_path,
-            Body=content_bytes,
-            **extra_args
-        )
-        
-        # Generate URL
-        url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_path}"
+        # Upload to S3, in parallel parts above S3_MULTIPART_THRESHOLD
+        url = await storage.put(s3_path, file_content, content_type, metadata)
         
         logger.info(f"Uploaded knowledge file {file_name} for agent {agent_id} with timestamp {timestamp}")
         return url
         
-    except ClientError as e:
+    except (ClientError, S3UploadFailedError) as e:
         logger.error(f"Error uploading to S3: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to upload file to S3")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to upload file to S3")
+
+
+async def delete_from_s3(prefix: str) -> int:
+    """
+    Delete every object whose key starts with prefix, e.g. the files of a
+    failed deploy. Returns the number of objects deleted.
+    """
+    deleted = await storage.delete_prefix(prefix)
+    logger.info(f"Deleted {deleted} objects under {prefix}")
+    return deleted
@@ -0,0 +1,113 @@
+import time
+import random
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+from src.embeddings import embed_query
+
+
+class SemanticCache:
+    """
+    Similarity cache for generated characters.
+
+    Prompts are embedded and kept in a small in-memory vector index (a
+    normalized matrix searched with a dot product). A lookup returns the value
+    stored for the nearest prompt of the same partition (the model, template
+    version, mode... the value was generated with) when its cosine similarity
+    reaches the threshold. Entries expire after `ttl` seconds. A fraction of
+    hits is sampled with both prompts so false hits can be reviewed and the
+    threshold tuned.
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 1024,
+                 audit_rate: float = 0.05, max_samples: int = 100, ttl: int = 86400):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.audit_rate = audit_rate
+        self.ttl = ttl
+        self.vectors: Optional[np.ndarray] = None
+        self.prompts: List[str] = []
+        self.partitions: List[str] = []
+        self.expires_at: List[float] = []
+        self.values: List[Any] = []
+        self.next_slot = 0
+        self.samples = deque(maxlen=max_samples)
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "adds": 0, "errors": 0}
+
+    async def _embed(self, prompt: str) -> Optional[np.ndarray]:
+        try:
+            vector = await embed_query(prompt)
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.error(f"Error embedding prompt for semantic cache: {str(e)}")
+            return None
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    async def lookup(self, prompt: str, partition: str) -> Tuple[Optional[Tuple[Any, float]], Optional[np.ndarray]]:
+        """
+        Return the value cached for the most similar prompt of the partition
+        and its score, or None, with the prompt's vector to pass on to add()
+        """
+        self.counters["lookups"] += 1
+        vector = await self._embed(prompt)
+        if vector is None or not self.prompts:
+            self.counters["misses"] += 1
+            return None, vector
+
+        now = time.monotonic()
+        scores = self.vectors[:len(self.prompts)] @ vector
+        usable = np.array([
+            entry_partition == partition and expires_at > now
+            for entry_partition, expires_at in zip(self.partitions, self.expires_at)
+        ])
+        scores = np.where(usable, scores, -np.inf)
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score < self.threshold:
+            self.counters["misses"] += 1
+            return None, vector
+
+        self.counters["hits"] += 1
+        if random.random() < self.audit_rate:
+            self.samples.append({"prompt": prompt, "matched_prompt": self.prompts[best], "score": score})
+        return (self.values[best], score), vector
+
+    async def add(self, prompt: str, value: Any, partition: str, vector: Optional[np.ndarray] = None) -> None:
+        """
+        Index a prompt, overwriting the oldest entry once the index is full.
+        `vector` is the one lookup() returned, the prompt is embedded without it.
+        """
+        if vector is None:
+            vector = await self._embed(prompt)
+        if vector is None:
+            return
+        if self.vectors is None:
+            self.vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+        slot = self.next_slot
+        self.vectors[slot] = vector
+        entry = (prompt, partition, time.monotonic() + self.ttl, value)
+        if slot < len(self.prompts):
+            self.prompts[slot], self.partitions[slot], self.expires_at[slot], self.values[slot] = entry
+        else:
+            for column, item in zip((self.prompts, self.partitions, self.expires_at, self.values), entry):
+                column.append(item)
+        self.next_slot = (slot + 1) % self.max_entries
+        self.counters["adds"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate, index size and the sampled hits awaiting review"""
+        lookups = self.counters["lookups"]
+        return {
+            **self.counters,
+            "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+            "index_size": len(self.prompts),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "sampled_hits": list(self.samples),
+        }
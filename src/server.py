@@ -1,8 +1,15 @@
+import uuid
 from loguru import logger
-from fastapi import FastAPI
-from src.deploy import deploy_router
-from src.character import character_router
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from src.deploy import deploy_router, db
+from src.s3_upload import storage
+from src.deployment_service import pdf_pool, UPLOAD_MAX_REQUEST_BYTES
+from src.draft_service import DraftService
+from src.character import character_router, prompt_budget, document_index, job_queue, JOB_WORKERS
+from src.instrumentation import current_request
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 
 app = FastAPI()
 app.include_router(deploy_router, prefix="/api/v1")
@@ -18,6 +25,69 @@ app.add_middleware(
 )
 
 
+def route_template(request: Request) -> str:
+    """Path template of the route serving the request, e.g. /api/v1/jobs/{job_id}"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """
+    Tag LLM calls with the request id and endpoint they are made for.
+    The id is always generated here, so a caller can't mix its calls into
+    another request's records; a client X-Request-ID is only logged with it.
+    """
+    request_id = uuid.uuid4().hex
+    client_request_id = request.headers.get("X-Request-ID")
+    if client_request_id:
+        logger.info(f"Request {request_id} has client request id {client_request_id[:128]}")
+    # Per route rather than per path, so ids in paths don't add endpoints to the metrics
+    context = current_request.set({"request_id": request_id, "endpoint": route_template(request)})
+    try:
+        response = await call_next(request)
+    finally:
+        current_request.reset(context)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    """Reject oversized uploads from their Content-Length, before the body is read"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_REQUEST_BYTES:
+        return JSONResponse(status_code=413, content={"detail": f"Request body is larger than {UPLOAD_MAX_REQUEST_BYTES} bytes"})
+    return await call_next(request)
+
+
+@app.on_event("startup")
+async def startup():
+    """Prepare per-process state before serving requests"""
+    # Count the static prompt prefix once instead of on the first request
+    prompt_budget.calibrate()
+    # Read the retrieval index into memory once instead of querying Chroma per request
+    if document_index is not None:
+        await document_index.load()
+    # Drain async generate/edit jobs, including ones left running by a previous process
+    await job_queue.start(JOB_WORKERS)
+    # Expire drafts that haven't been touched for DRAFT_TTL
+    await DraftService(db).create_indexes()
+    # Start the PDF extraction workers now, so the first knowledge file doesn't wait for them
+    await pdf_pool.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Hand running jobs back to the queue and stop the PDF and S3 workers"""
+    await job_queue.stop()
+    pdf_pool.stop()
+    storage.close()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
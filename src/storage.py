@@ -0,0 +1,194 @@
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Union, BinaryIO
+import boto3
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from loguru import logger
+from src.utils.stats import percentile
+
+# delete_objects takes at most this many keys per call
+DELETE_BATCH_SIZE = 1000
+
+
+class Storage:
+    """
+    Non-blocking access to an S3 bucket.
+
+    boto3 is synchronous, so every call runs on a dedicated pool of
+    `max_connections` threads. Calls never block the event loop nor queue
+    behind other to_thread work. File objects are streamed with
+    upload_fileobj, in parallel parts above the transfer config's multipart
+    threshold. Each of those uploads runs up to `max_concurrency` threads of
+    its own, so the client's connection pool is sized for every pool thread
+    uploading parts at once. A cancelled call keeps running in its thread,
+    so writes are tracked until they settle and delete_prefix waits for
+    those under its prefix. `endpoint_url`
+    points the client at an S3 stand-in such as minio or moto. Latency and
+    errors are tracked per operation.
+    """
+
+    def __init__(self, bucket: str, region: Optional[str] = None, endpoint_url: Optional[str] = None,
+                 max_connections: int = 32, transfer_config: Optional[TransferConfig] = None,
+                 aws_access_key_id: Optional[str] = None, aws_secret_access_key: Optional[str] = None,
+                 window: int = 1000):
+        self.bucket = bucket
+        self.max_connections = max_connections
+        self.transfer_config = transfer_config or TransferConfig()
+        part_threads = self.transfer_config.max_concurrency if self.transfer_config.use_threads else 1
+        self.client = boto3.client(
+            's3',
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            region_name=region,
+            endpoint_url=endpoint_url,
+            config=Config(
+                max_pool_connections=max_connections * part_threads,
+                retries={"mode": "adaptive", "max_attempts": 5},
+                tcp_keepalive=True
+            )
+        )
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="s3")
+        self.window = window
+        self.latencies: Dict[str, deque] = {}
+        self.calls: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.in_flight = 0
+        # Writes still running per key, including ones whose caller was cancelled
+        self.writes: Dict[str, Set[Future]] = {}
+
+    def url(self, key: str) -> str:
+        """URL of an object, in the form the deployment server expects whatever the endpoint"""
+        return f"https://{self.bucket}.s3.amazonaws.com/{key}"
+
+    def _forget_write(self, key: str, future: Future) -> None:
+        futures = self.writes.get(key)
+        if futures is not None:
+            futures.discard(future)
+            if not futures:
+                del self.writes[key]
+
+    def _write_done(self, loop: asyncio.AbstractEventLoop, key: str, future: Future) -> None:
+        try:
+            loop.call_soon_threadsafe(self._forget_write, key, future)
+        except RuntimeError:
+            # The loop is closed, nothing waits on the write anymore
+            self._forget_write(key, future)
+
+    async def _call(self, operation: str, function, *args, key: Optional[str] = None, **kwargs) -> Any:
+        """Run a client call on the pool, tracked as a write of `key` when given"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        self.in_flight += 1
+        try:
+            future = self.executor.submit(partial(function, *args, **kwargs))
+            if key is not None:
+                self.writes.setdefault(key, set()).add(future)
+                future.add_done_callback(partial(self._write_done, loop, key))
+            return await asyncio.wrap_future(future)
+        except Exception:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.latencies.setdefault(operation, deque(maxlen=self.window)).append(time.monotonic() - started)
+
+    async def put(self, key: str, body: Union[bytes, BinaryIO], content_type: Optional[str] = None,
+                  metadata: Optional[Dict[str, str]] = None) -> str:
+        """Store bytes or a binary file object (read in chunks) under key and return its URL"""
+        extra_args = {
+            **({'Metadata': metadata} if metadata else {}),
+            **({'ContentType': content_type} if content_type else {})
+        }
+        if isinstance(body, (bytes, bytearray)):
+            await self._call("put_object", self.client.put_object, Bucket=self.bucket, Key=key, Body=body,
+                             key=key, **extra_args)
+        else:
+            await self._call("upload_fileobj", self.client.upload_fileobj, body, self.bucket, key,
+                             key=key, ExtraArgs=extra_args, Config=self.transfer_config)
+        return self.url(key)
+
+    async def put_many(self, items: List[Dict[str, Any]], concurrency: int = 8) -> List[str]:
+        """
+        Store several objects concurrently, each item holding the arguments of
+        put(). Returns their URLs in order; the first failure is raised once
+        the others are done.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def put(item: Dict[str, Any]) -> str:
+            async with semaphore:
+                return await self.put(**item)
+
+        results = await asyncio.gather(*(put(item) for item in items), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    async def get(self, key: str) -> bytes:
+        response = await self._call("get_object", self.client.get_object, Bucket=self.bucket, Key=key)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, response["Body"].read)
+
+    async def list_keys(self, prefix: str) -> List[str]:
+        keys, token = [], None
+        while True:
+            kwargs = {"ContinuationToken": token} if token else {}
+            page = await self._call("list_objects_v2", self.client.list_objects_v2,
+                                    Bucket=self.bucket, Prefix=prefix, **kwargs)
+            keys += [item['Key'] for item in page.get('Contents', [])]
+            token = page.get('NextContinuationToken')
+            if not token:
+                return keys
+
+    async def delete_many(self, keys: List[str]) -> int:
+        """Delete keys in concurrent batches of DELETE_BATCH_SIZE, returns how many were deleted"""
+        batches = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+        responses = await asyncio.gather(*(
+            self._call("delete_objects", self.client.delete_objects, Bucket=self.bucket,
+                       Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+            for batch in batches
+        ))
+        failed = [error for response in responses for error in response.get('Errors', [])]
+        if failed:
+            logger.error(f"Failed to delete {len(failed)} objects: {failed[:5]}")
+        return len(keys) - len(failed)
+
+    async def settle(self, prefix: str) -> None:
+        """Wait for the writes under prefix still running, whether or not anyone awaits them"""
+        futures = [future for key, writes in list(self.writes.items()) if key.startswith(prefix) for future in writes]
+        if futures:
+            logger.info(f"Waiting for {len(futures)} writes under {prefix} to settle")
+            await asyncio.wait([asyncio.wrap_future(future) for future in futures])
+
+    async def delete_prefix(self, prefix: str) -> int:
+        """
+        Delete every object whose key starts with prefix, once the writes
+        under it settled, so an upload still running can't land afterwards
+        """
+        await self.settle(prefix)
+        keys = await self.list_keys(prefix)
+        return await self.delete_many(keys) if keys else 0
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_connections": self.max_connections,
+            "in_flight": self.in_flight,
+            "operations": {
+                operation: {
+                    "calls": self.calls[operation],
+                    "errors": self.errors.get(operation, 0),
+                    "p50": percentile(latencies, 0.5),
+                    "p95": percentile(latencies, 0.95),
+                    "p99": percentile(latencies, 0.99),
+                }
+                for operation, latencies in self.latencies.items()
+            },
+        }
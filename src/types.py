@@ -1,16 +1,86 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, Any, Dict, List
+from pydantic import BaseModel, Field, EmailStr, ConfigDict, field_validator
+from typing import Optional, Any, Dict, List, Union, Literal
 from enum import Enum
 from fastapi import Form, UploadFile, File, HTTPException
 
 class CharacterEditResponse(BaseModel):
+    # Parsed JSON of every edited key
     update: Dict[str, Any]
+    json_extraction: Optional[str] = None
 
 class CharacterRequest(BaseModel):
     prompt: str
+    # "sectioned" generates the identity first, then the other sections concurrently
+    mode: Literal["monolithic", "sectioned"] = "monolithic"
+    # Wallet of the caller, registered wallets are served first in async mode
+    address: Optional[str] = None
+    # Message signed by the address, required with it
+    message: Optional[str] = None
+    signature: Optional[str] = None
+    # Number of different characters to generate, capped by GENERATION_MAX_CANDIDATES
+    candidates: int = Field(1, ge=1)
+
+class BatchCharacterRequest(BaseModel):
+    requests: List[CharacterRequest] = Field(..., min_length=1)
+    # Per-batch parallelism, capped by BATCH_CONCURRENCY
+    concurrency: Optional[int] = Field(None, ge=1)
+
+class CharacterCandidate(BaseModel):
+    character_json: dict
+    json_extraction: Optional[str] = None
 
 class CharacterResponse(BaseModel):
     character_json: dict
+    # "local" when the JSON was recovered without a second LLM call, "llm" otherwise
+    json_extraction: Optional[str] = None
+    # Cache tier the response was served from, None for a fresh generation
+    cache: Optional[str] = None
+    # Every valid character when several were requested, character_json is the first
+    candidates: Optional[List[CharacterCandidate]] = None
+    # 0 when the candidates are identical, close to 1 when they share almost no words
+    diversity: Optional[float] = None
+
+class DraftPatch(BaseModel):
+    version: int
+    # Instructions per edited key and the values the edit produced
+    updates: Dict[str, str]
+    update: Dict[str, Any]
+    created_at: str
+
+class DraftResponse(BaseModel):
+    draft_id: str
+    version: int
+    character: Dict[str, Any]
+    patches: List[DraftPatch] = []
+
+class DraftEditResponse(BaseModel):
+    draft_id: str
+    # Version of the draft after the edit
+    version: int
+    update: Dict[str, Any]
+    json_extraction: Optional[str] = None
+
+class Character(BaseModel):
+    """Typed view of an ElizaOS character.json, unknown keys are kept as-is"""
+    model_config = ConfigDict(extra="allow")
+
+    name: str = Field(..., min_length=1)
+    # A single string is accepted and stored as a one-line bio, deployment requires a list
+    bio: List[str]
+    lore: List[str] = []
+    knowledge: List[str] = []
+    messageExamples: List[Any] = []
+    postExamples: List[str] = []
+    topics: List[str] = []
+    style: Dict[str, List[str]] = {}
+    adjectives: List[str] = []
+    clients: List[str] = []
+    modelProvider: Optional[str] = None
+
+    @field_validator("bio", mode="before")
+    @classmethod
+    def bio_lines(cls, value):
+        return [value] if isinstance(value, str) else value
 
 class AgentStatus(Enum):
     RUNNING = "running"
@@ -47,7 +117,8 @@ class ClientConfig(BaseModel):
 
 # Models
 class KnowledgeFile:
-    def __init__(self, filename: str, content: Dict, content_type: str):
+    # content is the {"documents": [...]} JSON, as a dict or spooled bytes (see src/utils/upload_stream.py)
+    def __init__(self, filename: str, content: Any, content_type: str):
         self.filename = filename
         self.content = content
         self.content_type = content_type
@@ -0,0 +1,91 @@
+import json
+from typing import Any, Dict, List, Optional
+from src.types import CharacterRequest
+from src.utils.create_utility_template import render_context_documents
+
+# Bump whenever the prompts below change so cached generations are not reused
+SECTION_TEMPLATE_VERSION = "2"
+# Generated first, every section is conditioned on it
+SKELETON_KEYS = ["name", "bio", "adjectives", "topics"]
+# Generated concurrently once the skeleton exists
+SECTION_INSTRUCTIONS = {
+    "lore": """"lore": an array of strings with straightforward, uniform backstory elements (no randomization).""",
+    "messageExamples": """"messageExamples": an array of 2 to 4 conversations. Each conversation is an array of messages like
+        {"user": "customer", "content": {"text": "..."}} followed by {"user": "<character name>", "content": {"text": "..."}}.""",
+    "postExamples": """"postExamples": an array of at least 5 posts the character would publish, uniform in tone.""",
+    "style": """"style": an object with "all", "chat" and "post" arrays of consistent and repetitive style guidelines.""",
+}
+# Keys no section generates, set to the defaults the monolithic template asks for
+SECTION_DEFAULTS = {"knowledge": [], "clients": ["twitter"], "modelProvider": "together"}
+
+
+def section_defaults() -> Dict[str, Any]:
+    """A fresh copy of SECTION_DEFAULTS to merge the generated sections into"""
+    return json.loads(json.dumps(SECTION_DEFAULTS))
+
+
+class SectionMerge:
+    """
+    Sections merged into one character as they complete. The defaults go in
+    first, so a key a section generates always wins over its default.
+    """
+
+    def __init__(self):
+        self.character = section_defaults()
+        self.paths = set()
+
+    def add(self, fields: Dict[str, Any], json_extraction: str) -> None:
+        self.character.update(fields)
+        self.paths.add(json_extraction)
+
+    @property
+    def json_extraction(self) -> str:
+        """"llm" when any section needed the LLM to repair its JSON"""
+        return "llm" if "llm" in self.paths else "local"
+
+
+def create_skeleton_template(character_request: CharacterRequest,
+                             context_documents: Optional[List[str]] = None) -> str:
+    """
+    Create a prompt for the identity skeleton of a "utility" character
+    (name, bio, adjectives, topics), the first step of sectioned generation,
+    grounded in the retrieved context_documents if any.
+    """
+    return f"""You are a master in creating character.json file for ElizaOS which creates AI agents based on this file.
+        For a "utility" category bot, the behavior must be highly predictable with NO randomization.
+
+        Create ONLY the identity of the character as JSON with exactly this structure:
+        {{
+        "name": "...",
+        "bio": ["single, consolidated bio"],
+        "adjectives": ["5 to 8 adjectives"],
+        "topics": ["10 or more topics"]
+        }}
+        {render_context_documents(context_documents)}
+        User requested character prompt:
+        {character_request.prompt}
+
+        GIVE ONLY ONE RESULT JSON WITHOUT ANY EXPLANATION OR EXAMPLE.
+        """
+
+
+def create_section_template(character_request: CharacterRequest, skeleton: Dict[str, Any], section: str) -> str:
+    """
+    Create a prompt for one section of a "utility" character, conditioned on
+    the already generated skeleton so all sections describe the same character.
+    """
+    return f"""You are a master in creating character.json file for ElizaOS which creates AI agents based on this file.
+        For a "utility" category bot, the behavior must be highly predictable with NO randomization.
+
+        The character already has this identity:
+        {json.dumps(skeleton, ensure_ascii=False)}
+
+        User requested character prompt:
+        {character_request.prompt}
+
+        Create ONLY the following field of the character.json, consistent with the identity above:
+        {SECTION_INSTRUCTIONS[section]}
+
+        Output one JSON object with the single key "{section}".
+        GIVE ONLY ONE RESULT JSON WITHOUT ANY EXPLANATION OR EXAMPLE.
+        """
@@ -1,12 +1,40 @@
 
 from pydantic import BaseModel
+from typing import List, Optional
 from src.types import CharacterRequest
 
-def create_utility_template(character_request: CharacterRequest) -> str:
+# Bump whenever the prompt below changes so cached generations are not reused
+UTILITY_TEMPLATE_VERSION = "2"
+# Start of the example section dropped when the prompt is over its token budget
+EXAMPLE_MARKER = "Example utility character file:"
+# Keys of the character.json the template asks for
+UTILITY_CHARACTER_KEYS = [
+    "name", "bio", "lore", "knowledge", "messageExamples", "postExamples",
+    "topics", "style", "adjectives", "clients", "modelProvider"
+]
+# Keys a generated character can't do without, a response missing one was cut off
+REQUIRED_CHARACTER_KEYS = [
+    "name", "bio", "lore", "messageExamples", "postExamples", "topics", "style", "adjectives"
+]
+
+def render_context_documents(context_documents: Optional[List[str]]) -> str:
+    """Prompt section with the retrieved ElizaOS documentation, empty without documents"""
+    if not context_documents:
+        return ""
+    documents = "\n\n".join(f"        [{i}] {document}" for i, document in enumerate(context_documents, 1))
+    return f"""
+        Relevant excerpts from the ElizaOS sources, use them to ground the character.json:
+{documents}
+        """
+
+
+def create_utility_template(character_request: CharacterRequest, include_example: bool = True,
+                            context_documents: Optional[List[str]] = None) -> str:
     """
     Create a prompt template for character generation specifically for "utility" category
     with very predictable (no randomization) behavior.
-    Also includes an example of a finished character file for this category.
+    Also includes an example of a finished character file for this category,
+    unless include_example is False, and the retrieved context_documents if any.
     """
 
     prompt = """You are a master in creating character.json file for ElizaOS which creates AI agents based on this file. 
@@ -122,7 +150,9 @@ def create_utility_template(character_request: CharacterRequest) -> str:
         "knowledge": [""],
         }
         """
-    return f"""{prompt}
+    if not include_example:
+        prompt = prompt.split(EXAMPLE_MARKER)[0]
+    return f"""{prompt}{render_context_documents(context_documents)}
             User requested character prompt:
             {character_request.prompt}
 
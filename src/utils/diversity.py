@@ -0,0 +1,39 @@
+import re
+from itertools import combinations
+from typing import Any, Dict, List, Optional, Set
+
+WORD = re.compile(r"[a-z0-9']+")
+
+
+def character_words(value: Any) -> Set[str]:
+    """Lowercased words of every string in a character, keys excluded"""
+    if isinstance(value, str):
+        return set(WORD.findall(value.lower()))
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        words = set()
+        for item in value:
+            words |= character_words(item)
+        return words
+    return set()
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def diversity_score(characters: List[Dict[str, Any]]) -> Optional[float]:
+    """
+    How different a set of characters are from each other: one minus the mean
+    pairwise Jaccard similarity of their vocabularies. 0 for identical
+    characters, close to 1 when they share almost no words. None for fewer
+    than two characters.
+    """
+    if len(characters) < 2:
+        return None
+    words = [character_words(character) for character in characters]
+    pairs = list(combinations(words, 2))
+    return 1 - sum(jaccard(a, b) for a, b in pairs) / len(pairs)
@@ -0,0 +1,61 @@
+import json
+from typing import Any, Dict, List
+from fastapi import HTTPException
+from src.utils.token_budget import count_tokens
+
+# Identity fields always sent so the model keeps the character's voice
+IDENTITY_BIO_ITEMS = 3
+IDENTITY_TOPICS = 5
+
+
+def render_context(context: Dict[str, Any]) -> str:
+    return json.dumps(context, ensure_ascii=False)
+
+
+def select_edit_context(character: Dict[str, Any], update_keys: List[str], token_budget: int) -> Dict[str, Any]:
+    """
+    Select the part of a character an edit needs.
+
+    Keeps the keys being edited in full plus a compact identity summary (name,
+    the first bio entries, a few topics). When that is over the token budget
+    the identity summary is shrunk. The edited keys are never trimmed: the
+    model rewrites each of them whole, so entries it doesn't see would be
+    lost. An edit whose keys alone exceed the budget fails with 413.
+    """
+    context: Dict[str, Any] = {}
+    if "name" in character and "name" not in update_keys:
+        context["name"] = character["name"]
+    if "bio" in character and "bio" not in update_keys:
+        bio = character["bio"]
+        context["bio"] = bio[:IDENTITY_BIO_ITEMS] if isinstance(bio, list) else bio
+    if "topics" in character and "topics" not in update_keys:
+        context["topics"] = character["topics"][:IDENTITY_TOPICS] if isinstance(character["topics"], list) else character["topics"]
+    for key in update_keys:
+        if key in character:
+            context[key] = character[key]
+
+    # Shrink the identity summary, keeping a running estimate rather than
+    # re-counting the whole context after each removal
+    total = count_tokens(render_context(context))
+    while total > token_budget:
+        shrinkable = [key for key in ("topics", "bio", "name") if key in context and key not in update_keys]
+        if not shrinkable:
+            break
+        for key in shrinkable:
+            while total > token_budget and key in context:
+                value = context[key]
+                if isinstance(value, list) and len(value) > 1:
+                    context[key] = value[:-1]
+                    total -= count_tokens(render_context(value[-1])) + 1
+                else:
+                    del context[key]
+                    total -= count_tokens(render_context({key: value}))
+        # The estimate drifts a little from the real count, settle it once
+        total = count_tokens(render_context(context))
+
+    if total > token_budget:
+        raise HTTPException(
+            status_code=413,
+            detail=f"The edited keys need {total} tokens of context, more than the {token_budget} an edit allows"
+        )
+    return context
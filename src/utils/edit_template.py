@@ -1,26 +1,27 @@
-
+import json
 from pydantic import BaseModel
 from typing import Dict, Any
 
-def edit_character_template(character: Dict[str, Any], update_key: str, prompt: str) -> str:
+def edit_character_template(character: Dict[str, Any], updates: Dict[str, str]) -> str:
     """
         Create a prompt template for editing an existing character.json file,
         but only return the updated section(s) in JSON format (mimicking the structure of character.json).
 
         The user provides:
-        1) existing_character_json: the current character configuration (valid JSON).
-        2) edit_instructions: which field(s) to modify (e.g., lore, bio, topics, style, adjectives) 
-        and how to modify them.
+        1) character: the parts of the current character configuration the edit needs
+        (the edited keys plus a short identity summary, see select_edit_context).
+        2) updates: which field(s) to modify (e.g., lore, bio, topics, style, adjectives)
+        mapped to the instructions for each of them.
 
         The system should:
         - Parse the existing JSON.
         - Apply the requested edits exactly.
-        - Output ONLY the updated sections in JSON format, preserving the structure 
+        - Output ONLY the updated sections in JSON format, preserving the structure
         of those sections as they appear in character.json.
         - Do not include any additional commentary or the unmodified parts of the character.json.
 
         Example:
-        If the user wants to update the "lore" field to ["New lore entry"], 
+        If the user wants to update the "lore" field to ["New lore entry"],
         output only:
         {
         "lore": ["New lore entry"]
@@ -28,27 +29,29 @@ def edit_character_template(character: Dict[str, Any], update_key: str, prompt:
 
         Return no extra text, only the updated portion.
     """
+    update_keys = ", ".join(f"'{key}'" for key in updates)
+    instructions = "\n".join(f"        - {key}: {instruction}" for key, instruction in updates.items())
 
     prompt_text = f"""
-        You are a system that modifies an existing character.json configuration but ONLY outputs the updated '{update_key}' field in valid JSON format.
+        You are a system that modifies an existing character.json configuration but ONLY outputs the updated {update_keys} field(s) in valid JSON format.
 
-        Current character.json:
-        {character}
+        Relevant parts of the current character.json:
+        {json.dumps(character, ensure_ascii=False)}
 
-        Update Key:
-        {update_key}
+        Update Keys:
+        {update_keys}
 
-        User instructions:
-        {prompt}
+        User instructions per key:
+{instructions}
 
         Instructions:
-        1. Parse the existing character.json exactly as-is.
-        2. Update ONLY the '{update_key}' field based on the user's instructions and the current chracter.json
-        3. Output ONLY the updated '{update_key}' field in JSON format, preserving its structure 
+        1. Parse the existing character.json parts exactly as-is.
+        2. Update ONLY the {update_keys} field(s), each based on its own user instructions and the current chracter.json
+        3. Output ONE JSON object whose keys are exactly {update_keys}, preserving the structure of each field
         (e.g., an array if 'lore' is an array).
-        4. Do not output any text besides the JSON snippet of the updated '{update_key}' field.
+        4. Do not output any text besides the JSON object of the updated field(s).
         5. The JSON must be valid and reflect only the changed content.
 
-        Now produce the updated '{update_key}' field in JSON format (no extra text).
+        Now produce the updated {update_keys} field(s) as one JSON object (no extra text).
         """
-    return prompt_text
\ No newline at end of file
+    return prompt_text
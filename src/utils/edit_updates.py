@@ -0,0 +1,32 @@
+import json
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+
+
+def parse_edit_updates(prompt: Optional[str], update_key: Optional[str], updates: Optional[str]) -> Dict[str, str]:
+    """Build the {key: instructions} edit request from the form fields"""
+    if updates:
+        try:
+            parsed = json.loads(updates)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Invalid JSON in updates")
+        if (not isinstance(parsed, dict) or not parsed
+                or not all(isinstance(key, str) and isinstance(value, str) for key, value in parsed.items())):
+            raise HTTPException(status_code=400, detail="updates must map character keys to instructions")
+        return parsed
+    if prompt and update_key:
+        return {update_key: prompt}
+    raise HTTPException(status_code=400, detail="Either updates or prompt and update_key are required")
+
+
+def select_updates(data, update_keys: List[str]) -> Dict:
+    """Pick the edited keys out of parsed edit output"""
+    if isinstance(data, dict):
+        data = {str(key).strip(): value for key, value in data.items()}
+        if all(key in data for key in update_keys):
+            return {key: data[key] for key in update_keys}
+    if len(update_keys) == 1:
+        # The model returned the bare value instead of {"key": value}
+        return {update_keys[0]: data}
+    missing = [key for key in update_keys if not isinstance(data, dict) or key not in data]
+    raise ValueError(f"Generated JSON is missing keys: {', '.join(missing)}")
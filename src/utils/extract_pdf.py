@@ -1,6 +1,6 @@
 import io
 # import fitz
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Union
 import pdfplumber
 import re
 # async def extract_paragraphs_from_pdf(content: bytes) -> List[str]:
@@ -76,12 +76,13 @@ def clean_text(text: str) -> str:
     
     return text.strip()
 
-def extract_paragraphs_from_pdf(pdf_bytes: bytes) -> List[str]:
+def extract_paragraphs_from_pdf(pdf_bytes: Union[bytes, str]) -> List[str]:
     """
     Extract text from a PDF file while preserving proper formatting.
+    Takes the PDF bytes or the path of a PDF file.
     """
     full_text = []
-    pdf_file = io.BytesIO(pdf_bytes)
+    pdf_file = pdf_bytes if isinstance(pdf_bytes, str) else io.BytesIO(pdf_bytes)
     
     try:
         with pdfplumber.open(pdf_file) as pdf:
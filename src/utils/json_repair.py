@@ -0,0 +1,155 @@
+import re
+import json
+from typing import Any, List, Optional
+
+FENCED_BLOCK = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL | re.IGNORECASE)
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSERS = {"{": "}", "[": "]"}
+KEY_SEPARATOR = re.compile(r'\s*:')
+
+
+def find_json_block(text: str) -> str:
+    """
+    Cut the JSON document out of an LLM response.
+
+    Prefers a fenced ```json block, otherwise takes everything from the first
+    '{' or '[' up to its matching bracket (or the end of the text if the
+    document was truncated), dropping leading and trailing prose.
+    """
+    match = FENCED_BLOCK.search(text)
+    if match and re.search(r'[\[{]', match.group(1)):
+        text = match.group(1)
+
+    start = None
+    for i, ch in enumerate(text):
+        if ch in '{[':
+            start = i
+            break
+    if start is None:
+        raise ValueError("No JSON object found in response")
+
+    depth = 0
+    quote: Optional[str] = None
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == quote:
+                quote = None
+        elif ch in '"\'':
+            quote = ch
+        elif ch in '{[':
+            depth += 1
+        elif ch in '}]':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _strip_trailing_comma(out: List[str]) -> None:
+    """Drop whitespace and a dangling comma from the end of the output buffer"""
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+
+def repair_json(text: str) -> str:
+    """
+    Rewrite almost-JSON into valid JSON.
+
+    Handles single-quoted strings, unquoted keys, Python literals
+    (True/False/None), trailing commas, mismatched closers, unterminated
+    strings and unbalanced brackets.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    quote: Optional[str] = None
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == '\\' and i + 1 < len(text):
+                nxt = text[i + 1]
+                # \' is not a valid JSON escape
+                out.append(nxt if nxt == "'" else ch + nxt)
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == '\n':
+                out.append('\\n')
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in '"\'':
+            quote = ch
+            out.append('"')
+        elif ch in '{[':
+            stack.append(ch)
+            out.append(ch)
+        elif ch in '}]':
+            _strip_trailing_comma(out)
+            opener = '{' if ch == '}' else '['
+            if opener in stack:
+                # Close anything the model forgot before this bracket
+                while stack[-1] != opener:
+                    out.append(CLOSERS[stack.pop()])
+                stack.pop()
+                out.append(ch)
+            # A closer with no matching opener is dropped
+        elif ch.isalpha() or ch == '_':
+            j = i
+            while j < len(text) and (text[j].isalnum() or text[j] == '_'):
+                j += 1
+            word = text[i:j]
+            if KEY_SEPARATOR.match(text, j):
+                # Unquoted object key
+                out.append(f'"{word}"')
+            else:
+                out.append(PYTHON_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if quote:
+        out.append('"')
+    _strip_trailing_comma(out)
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ':':
+        out.append('null')
+    while stack:
+        _strip_trailing_comma(out)
+        out.append(CLOSERS[stack.pop()])
+    return ''.join(out)
+
+
+def parse_json_locally(text: str) -> Any:
+    """
+    Parse the JSON contained in an LLM response without another LLM call.
+
+    Raises:
+        ValueError: if no JSON could be recovered from the text
+    """
+    block = find_json_block(text)
+    try:
+        return json.loads(block)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(repair_json(block))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Could not repair JSON locally: {e}") from e
@@ -0,0 +1,58 @@
+import asyncio
+from collections import Counter
+from pathlib import Path
+from typing import List
+from loguru import logger
+from fastapi import HTTPException
+from src.types import KnowledgeFile
+
+
+def knowledge_json_filename(filename: str) -> str:
+    """Name of the {"documents": [...]} JSON a knowledge file is stored as"""
+    return Path(filename).stem + '.json'
+
+
+def check_knowledge_filenames(filenames: List[str]) -> None:
+    """Reject knowledge files that would be stored under the same name, e.g. a.pdf and a.txt"""
+    counts = Counter(knowledge_json_filename(filename) for filename in filenames)
+    duplicates = sorted(name for name, count in counts.items() if count > 1)
+    if duplicates:
+        clashing = [filename for filename in filenames if knowledge_json_filename(filename) in duplicates]
+        raise HTTPException(
+            status_code=400,
+            detail=f"Knowledge files {', '.join(clashing)} would all be stored as {', '.join(duplicates)}, rename them"
+        )
+
+
+async def for_each_knowledge_file(items: List, filenames: List[str], handle, failure: str,
+                                  semaphore: asyncio.Semaphore, slots: asyncio.Semaphore) -> List:
+    """
+    Run handle on every knowledge file concurrently, at most `semaphore` at a
+    time for this deploy and `slots` (shared by all deploys) overall.
+    Results keep the order of the files. When files fail, the others still
+    finish and the error raised lists each failed file.
+    """
+    async def run(item):
+        async with semaphore, slots:
+            return await handle(item)
+
+    results = await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+    errors = []
+    for filename, result in zip(filenames, results):
+        if isinstance(result, HTTPException):
+            errors.append({"filename": filename, "status_code": result.status_code, "detail": result.detail})
+        elif isinstance(result, BaseException):
+            errors.append({"filename": filename, "status_code": 500, "detail": str(result)})
+    if errors:
+        logger.error(f"{failure}: {errors}")
+        # The deploy is over, drop what the other files spooled
+        for result in results:
+            if isinstance(result, KnowledgeFile):
+                result.content.close()
+        status_codes = {error["status_code"] for error in errors}
+        if len(status_codes) == 1:
+            status_code = status_codes.pop()
+        else:
+            status_code = 400 if all(code < 500 for code in status_codes) else 500
+        raise HTTPException(status_code=status_code, detail={"message": failure, "files": errors})
+    return results
@@ -0,0 +1,162 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Union
+from loguru import logger
+from src.utils.extract_pdf import extract_paragraphs_from_pdf
+from src.utils.stats import percentile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class PoolSaturated(Exception):
+    """Raised when more jobs are waiting for a worker than the pool queues"""
+
+
+def limit_memory(max_bytes: int) -> None:
+    """Worker initializer: cap the address space so a pathological PDF can't take the host down"""
+    if resource is None or not max_bytes:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not limit PDF worker memory: {str(e)}")
+
+
+def warm_up() -> int:
+    """Start a worker and import pdfplumber in it ahead of the first job"""
+    import pdfplumber  # noqa: F401
+    return os.getpid()
+
+
+class PdfExtractionPool:
+    """
+    Runs PDF extraction in a pool of worker processes, off the event loop.
+
+    At most `workers` jobs run at a time and at most `max_queue` wait for a
+    worker, beyond that PoolSaturated is raised. A job running longer than
+    `timeout` raises asyncio.TimeoutError and a job that kills its worker
+    (e.g. over `memory_limit_mb`) raises BrokenProcessPool. In both cases
+    the pool's processes are replaced. Files up to `inline_max_bytes` are
+    extracted in this process, where they cost less than the round-trip to
+    a worker. Jobs also run in this process until start() is called.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 16, timeout: float = 60.0,
+                 memory_limit_mb: int = 1024, inline_max_bytes: int = 64 * 1024,
+                 job: Callable[[bytes], Any] = extract_paragraphs_from_pdf, start_method: str = "spawn"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.inline_max_bytes = inline_max_bytes
+        self.job = job
+        self.start_method = start_method
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.slots = asyncio.Semaphore(workers)
+        self.running = 0
+        self.waiting = 0
+        self.wait_times = deque(maxlen=500)
+        self.counters = {"pooled": 0, "inline": 0, "rejected": 0, "timeouts": 0, "failures": 0, "restarts": 0}
+
+    def _create(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=limit_memory,
+            initargs=(self.memory_limit,)
+        )
+
+    async def _warm(self, executor: ProcessPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        # Submitted together, so the executor starts every worker
+        pids = await asyncio.gather(*(loop.run_in_executor(executor, warm_up) for _ in range(self.workers)))
+        logger.info(f"PDF extraction workers ready: {sorted(set(pids))}")
+
+    async def start(self) -> None:
+        self.executor = self._create()
+        await self._warm(self.executor)
+
+    def stop(self) -> None:
+        if self.executor is not None:
+            self._kill(self.executor)
+            self.executor = None
+
+    @staticmethod
+    def _kill(executor: ProcessPoolExecutor) -> None:
+        # A running job can't be cancelled, only its process killed
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _restart(self, executor: ProcessPoolExecutor) -> None:
+        """Replace the processes of a pool that timed out or broke, unless another job already did"""
+        if executor is not self.executor:
+            return
+        self._kill(executor)
+        self.executor = self._create()
+        self.counters["restarts"] += 1
+        asyncio.ensure_future(self._warm(self.executor))
+
+    async def extract(self, content: Union[bytes, str], size: Optional[int] = None) -> Any:
+        """
+        Run the job on the PDF in a worker, or in this process for tiny files.
+        `content` is the PDF bytes or the path of a PDF file of `size` bytes.
+        """
+        size = len(content) if size is None else size
+        if self.executor is None or size <= self.inline_max_bytes:
+            self.counters["inline"] += 1
+            return await asyncio.to_thread(self.job, content)
+        if self.waiting >= self.max_queue:
+            self.counters["rejected"] += 1
+            raise PoolSaturated(f"{self.waiting} PDFs are already waiting for a worker")
+
+        queued = time.monotonic()
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.wait_times.append(time.monotonic() - queued)
+        self.running += 1
+        self.counters["pooled"] += 1
+        try:
+            for attempt in range(2):
+                executor = self.executor
+                try:
+                    future = executor.submit(self.job, content)
+                    return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+                except asyncio.TimeoutError:
+                    self.counters["timeouts"] += 1
+                    logger.error(f"PDF extraction exceeded {self.timeout}s, restarting the workers")
+                    self._restart(executor)
+                    raise
+                except BrokenProcessPool:
+                    if attempt == 0 and executor is not self.executor:
+                        # The pool was restarted for another job, this one never got to finish
+                        continue
+                    self.counters["failures"] += 1
+                    logger.error("A PDF extraction worker died, restarting the workers")
+                    self._restart(executor)
+                    raise
+        finally:
+            self.running -= 1
+            self.slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            # 1 when every worker is busy, above 1 when jobs queue for them
+            "saturation": (self.running + self.waiting) / self.workers,
+            "wait_p95": percentile(self.wait_times, 0.95),
+            **self.counters,
+        }
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls into one.
+
+    The first caller for a key starts the call; everyone who asks for the same
+    key while it is in flight awaits the same task and gets the same result or
+    exception. A waiter that goes away (client disconnect) does not cancel the
+    call for the others. `owner` names the caller that starts a call, and
+    `on_shared` is called in every caller that joins it with that name.
+    """
+
+    def __init__(self, owner: Optional[Callable[[], Any]] = None, on_shared: Optional[Callable[[Any], None]] = None):
+        self.owner = owner
+        self.on_shared = on_shared
+        self.calls: Dict[str, asyncio.Task] = {}
+        self.owners: Dict[str, Any] = {}
+        self.counters = {"calls": 0, "shared": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            self.owners[key] = self.owner() if self.owner is not None else None
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.counters["calls"] += 1
+        else:
+            self.counters["shared"] += 1
+            if self.on_shared is not None:
+                self.on_shared(self.owners[key])
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+            del self.owners[key]
+        # Mark the exception as retrieved in case every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, "in_flight": len(self.calls)}
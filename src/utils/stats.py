@@ -0,0 +1,9 @@
+from typing import Optional
+
+
+def percentile(values, fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of recent samples, None when there are none"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
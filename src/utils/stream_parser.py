@@ -0,0 +1,71 @@
+import json
+from typing import Any, List, Optional, Tuple
+from src.utils.json_repair import repair_json
+
+
+class CharacterFieldParser:
+    """
+    Incrementally parse the top-level fields of a JSON object as it streams in.
+
+    Feed it response chunks; every top-level member ("name", "bio", "lore", ...)
+    is returned as soon as its value is closed, long before the whole object
+    has arrived. Text before the opening '{' (prose, code fences) is skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.quote: Optional[str] = None
+        self.escaped = False
+        self.member_start = 0
+        self.done = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk and return the (key, value) pairs it completed"""
+        self.buffer += chunk
+        fields = []
+        while self.pos < len(self.buffer) and not self.done:
+            ch = self.buffer[self.pos]
+            if self.depth == 0:
+                if ch == '{':
+                    self.depth = 1
+                    self.member_start = self.pos + 1
+            elif self.quote:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == self.quote:
+                    self.quote = None
+            elif ch in '"\'':
+                self.quote = ch
+            elif ch in '{[':
+                self.depth += 1
+            elif ch in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    fields.extend(self._parse_member(self.member_start, self.pos))
+                    self.done = True
+            elif ch == ',' and self.depth == 1:
+                fields.extend(self._parse_member(self.member_start, self.pos))
+                self.member_start = self.pos + 1
+            self.pos += 1
+        return fields
+
+    def _parse_member(self, start: int, end: int) -> List[Tuple[str, Any]]:
+        """Parse a single `"key": value` member, skipping it if it can't be read"""
+        member = self.buffer[start:end].strip()
+        if not member:
+            return []
+        text = "{" + member + "}"
+        try:
+            parsed = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                parsed = json.loads(repair_json(text))
+            except json.JSONDecodeError:
+                return []
+        if not isinstance(parsed, dict):
+            return []
+        return [(str(key).strip(), value) for key, value in parsed.items()]
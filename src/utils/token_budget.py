@@ -0,0 +1,33 @@
+from typing import Optional
+from loguru import logger
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once, None if it can't be loaded"""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            _encoding_failed = True
+            logger.warning(f"tiktoken unavailable, estimating tokens from length: {str(e)}")
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """
+    Approximate the number of tokens in a text.
+
+    Uses tiktoken's cl100k_base, which is close enough to the Llama tokenizer
+    for budgeting, and falls back to ~4 characters per token.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
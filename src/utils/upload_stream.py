@@ -0,0 +1,86 @@
+import io
+import json
+import codecs
+import hashlib
+import tempfile
+from typing import Optional
+from fastapi import HTTPException, UploadFile
+
+
+class SpooledUpload:
+    """
+    Bytes kept in memory up to `memory_bytes`, then in a named temporary file
+    (deleted on close), with their size and md5 tracked as they are written.
+    """
+
+    def __init__(self, memory_bytes: int, spool_dir: Optional[str] = None):
+        self.memory_bytes = memory_bytes
+        self.spool_dir = spool_dir
+        self.file = io.BytesIO()
+        self.size = 0
+        self._md5 = hashlib.md5()
+
+    @property
+    def path(self) -> Optional[str]:
+        """Path of the temporary file, None while the bytes are in memory"""
+        return None if isinstance(self.file, io.BytesIO) else self.file.name
+
+    @property
+    def md5(self) -> str:
+        return self._md5.hexdigest()
+
+    def write(self, chunk: bytes) -> None:
+        self._md5.update(chunk)
+        self.size += len(chunk)
+        if self.path is None and self.size > self.memory_bytes:
+            spooled = tempfile.NamedTemporaryFile(dir=self.spool_dir, prefix="upload-")
+            spooled.write(self.file.getvalue())
+            self.file = spooled
+        self.file.write(chunk)
+
+    def rewind(self) -> "SpooledUpload":
+        self.file.flush()
+        self.file.seek(0)
+        return self
+
+    def read(self) -> bytes:
+        """All the bytes, only meant for uploads capped to a small size"""
+        return self.rewind().file.read()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+async def spool_upload(upload: UploadFile, max_bytes: int, chunk_size: int = 1024 * 1024,
+                       memory_bytes: int = 1024 * 1024, spool_dir: Optional[str] = None) -> SpooledUpload:
+    """
+    Copy an upload chunk by chunk into a SpooledUpload, so it is never held
+    in memory whole. Fails with 413 as soon as it grows past max_bytes.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"{upload.filename} is larger than {max_bytes} bytes")
+    spooled = SpooledUpload(memory_bytes, spool_dir)
+    try:
+        while chunk := await upload.read(chunk_size):
+            if spooled.size + len(chunk) > max_bytes:
+                raise HTTPException(status_code=413, detail=f"{upload.filename} is larger than {max_bytes} bytes")
+            spooled.write(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+    return spooled.rewind()
+
+
+def text_to_documents_json(source: SpooledUpload, target: SpooledUpload, chunk_size: int = 1024 * 1024) -> SpooledUpload:
+    """
+    Write {"documents": [<source as UTF-8 text>]} to target a chunk at a time,
+    the same bytes json.dumps would produce for the whole text.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    source.rewind()
+    target.write(b'{"documents": ["')
+    while chunk := source.file.read(chunk_size):
+        target.write(json.dumps(decoder.decode(chunk))[1:-1].encode())
+    target.write(json.dumps(decoder.decode(b"", final=True))[1:-1].encode())
+    target.write(b'"]}')
+    return target.rewind()
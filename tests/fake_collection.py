@@ -0,0 +1,77 @@
+import copy
+from typing import Any, Dict, List, Optional
+
+
+def matches(document: Dict, query: Dict) -> bool:
+    """The subset of Mongo queries the services use: equality, $or, $lt and $in"""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+            continue
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if "$lt" in condition and not (value is not None and value < condition["$lt"]):
+                return False
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class UpdateResult:
+    def __init__(self, matched_count: int):
+        self.matched_count = matched_count
+
+
+class FakeCollection:
+    """In-memory stand-in for a motor collection, enough for the job queue and drafts"""
+
+    def __init__(self):
+        self.documents: Dict[Any, Dict] = {}
+        # Set to an exception to make the next update_one calls fail with it
+        self.update_error: Optional[Exception] = None
+
+    async def create_index(self, *args, **kwargs) -> None:
+        pass
+
+    async def insert_one(self, document: Dict) -> None:
+        self.documents[document["_id"]] = copy.deepcopy(document)
+
+    def _find(self, query: Dict, sort: Optional[List] = None) -> List[Dict]:
+        found = [document for document in self.documents.values() if matches(document, query)]
+        for field, direction in reversed(sort or []):
+            found.sort(key=lambda document: document[field], reverse=direction < 0)
+        return found
+
+    @staticmethod
+    def _apply(document: Dict, update: Dict) -> None:
+        for field, value in update.get("$set", {}).items():
+            document[field] = copy.deepcopy(value)
+        for field, value in update.get("$inc", {}).items():
+            document[field] = document.get(field, 0) + value
+        for field in update.get("$unset", {}):
+            document.pop(field, None)
+        for field, value in update.get("$push", {}).items():
+            document.setdefault(field, []).append(copy.deepcopy(value))
+
+    async def find_one(self, query: Dict, sort: Optional[List] = None) -> Optional[Dict]:
+        found = self._find(query, sort)
+        return copy.deepcopy(found[0]) if found else None
+
+    async def find_one_and_update(self, query: Dict, update: Dict, sort: Optional[List] = None,
+                                  return_document=None) -> Optional[Dict]:
+        found = self._find(query, sort)
+        if not found:
+            return None
+        self._apply(found[0], update)
+        return copy.deepcopy(found[0])
+
+    async def update_one(self, query: Dict, update: Dict) -> UpdateResult:
+        if self.update_error is not None:
+            raise self.update_error
+        found = self._find(query)[:1]
+        for document in found:
+            self._apply(document, update)
+        return UpdateResult(len(found))
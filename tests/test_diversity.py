@@ -0,0 +1,24 @@
+import pytest
+from src.utils.diversity import character_words, diversity_score
+
+
+def test_words_come_from_values_not_keys():
+    character = {"name": "Ada", "bio": ["Loves math."], "style": {"chat": ["terse"]}}
+    assert character_words(character) == {"ada", "loves", "math", "terse"}
+
+
+def test_identical_characters_have_no_diversity():
+    character = {"name": "Ada", "bio": ["Loves math"]}
+    assert diversity_score([character, dict(character)]) == 0
+
+
+def test_diversity_is_one_minus_mean_pairwise_jaccard():
+    first = {"bio": "a b"}
+    second = {"bio": "a c"}
+    third = {"bio": "d e"}
+    # Similarities: 1/3, 0, 0
+    assert diversity_score([first, second, third]) == pytest.approx(1 - 1 / 9)
+
+
+def test_single_character_has_no_score():
+    assert diversity_score([{"name": "Ada"}]) is None
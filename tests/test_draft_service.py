@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from fake_collection import FakeCollection
+from src.draft_service import DraftService
+
+CHARACTER = {"name": "Ada", "bio": ["Mathematician"]}
+
+
+def make_service() -> DraftService:
+    return DraftService(SimpleNamespace(drafts=FakeCollection()))
+
+
+def test_patch_bumps_the_version_and_keeps_the_history():
+    async def main():
+        service = make_service()
+        created = await service.create_draft(CHARACTER, "owner")
+        draft = await service.apply_patch(created, {"bio": "shorter"}, {"bio": ["Math"]})
+        return created, draft, await service.get_draft(draft["_id"])
+
+    created, draft, stored = asyncio.run(main())
+    assert draft["version"] == stored["version"] == 1
+    assert stored["character"] == {"name": "Ada", "bio": ["Math"]}
+    assert [patch["updates"] for patch in stored["patches"]] == [{"bio": "shorter"}]
+    assert stored["content_hash"] != created["content_hash"]
+
+
+def test_patch_made_against_a_stale_version_is_rejected():
+    async def main():
+        service = make_service()
+        draft = await service.create_draft(CHARACTER, "owner")
+        await service.apply_patch(draft, {"bio": "shorter"}, {"bio": ["Math"]})
+        with pytest.raises(HTTPException) as error:
+            await service.apply_patch(draft, {"bio": "longer"}, {"bio": ["A long bio"]})
+        return error.value, await service.get_draft(draft["_id"])
+
+    error, stored = asyncio.run(main())
+    assert error.status_code == 409
+    assert stored["version"] == 1
+    assert stored["character"]["bio"] == ["Math"]
+
+
+def test_only_the_creating_address_owns_the_draft():
+    async def main():
+        service = make_service()
+        draft = await service.create_draft(CHARACTER, "owner")
+        await service.verify_draft_ownership("owner", draft)
+        errors = []
+        for address, checked in (("someone else", draft), ("owner", {**draft, "address": None})):
+            with pytest.raises(HTTPException) as error:
+                await service.verify_draft_ownership(address, checked)
+            errors.append(error.value.status_code)
+        return errors
+
+    assert asyncio.run(main()) == [403, 403]
+
+
+def test_missing_draft_is_not_found():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(make_service().get_draft("missing"))
+    assert error.value.status_code == 404
@@ -0,0 +1,32 @@
+import pytest
+from fastapi import HTTPException
+from src.utils.edit_context import select_edit_context, render_context
+from src.utils.token_budget import count_tokens
+
+
+CHARACTER = {
+    "name": "Ada",
+    "bio": [f"Bio entry number {i} about Ada's life and work" for i in range(10)],
+    "topics": [f"topic {i}" for i in range(10)],
+    "lore": [f"Lore entry number {i} with a few extra words" for i in range(20)],
+}
+
+
+def test_edited_keys_are_sent_whole_with_an_identity_summary():
+    context = select_edit_context(CHARACTER, ["lore"], 10_000)
+    assert context["lore"] == CHARACTER["lore"]
+    assert context["name"] == "Ada"
+    assert len(context["bio"]) == 3 and len(context["topics"]) == 5
+
+
+def test_identity_is_shrunk_but_edited_keys_never_are():
+    budget = count_tokens(render_context({"name": "Ada", "lore": CHARACTER["lore"]})) + 5
+    context = select_edit_context(CHARACTER, ["lore"], budget)
+    assert context["lore"] == CHARACTER["lore"]
+    assert count_tokens(render_context(context)) <= budget
+
+
+def test_edited_keys_over_the_budget_are_rejected():
+    with pytest.raises(HTTPException) as error:
+        select_edit_context(CHARACTER, ["lore"], 20)
+    assert error.value.status_code == 413
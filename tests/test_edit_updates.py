@@ -0,0 +1,41 @@
+import json
+import pytest
+from fastapi import HTTPException
+from src.utils.edit_updates import parse_edit_updates, select_updates
+
+
+def test_updates_json_maps_keys_to_instructions():
+    updates = {"bio": "shorter", "topics": "add chess"}
+    assert parse_edit_updates(None, None, json.dumps(updates)) == updates
+    assert parse_edit_updates("shorter", "bio", None) == {"bio": "shorter"}
+
+
+@pytest.mark.parametrize("prompt, update_key, updates", [
+    (None, None, None),
+    ("shorter", None, None),
+    (None, None, "{not json"),
+    (None, None, "{}"),
+    (None, None, '["bio"]'),
+    (None, None, '{"bio": 1}'),
+])
+def test_invalid_edit_requests_are_rejected(prompt, update_key, updates):
+    with pytest.raises(HTTPException) as error:
+        parse_edit_updates(prompt, update_key, updates)
+    assert error.value.status_code == 400
+
+
+def test_edited_keys_are_picked_out_of_the_response():
+    data = {" bio ": ["b"], "topics": ["t"], "name": "Ada"}
+    assert select_updates(data, ["bio", "topics"]) == {"bio": ["b"], "topics": ["t"]}
+
+
+def test_bare_value_is_taken_for_a_single_key():
+    assert select_updates(["b"], ["bio"]) == {"bio": ["b"]}
+    assert select_updates({"text": "b"}, ["bio"]) == {"bio": {"text": "b"}}
+
+
+def test_missing_keys_are_an_error():
+    with pytest.raises(ValueError, match="topics"):
+        select_updates({"bio": ["b"]}, ["bio", "topics"])
+    with pytest.raises(ValueError, match="bio, topics"):
+        select_updates(["b"], ["bio", "topics"])
@@ -0,0 +1,26 @@
+import asyncio
+from src.generation_cache import GenerationCache
+
+
+def test_key_folds_whitespace_and_case():
+    key = GenerationCache.make_key("A  DevRel\nagent ", "model", "1")
+    assert key == GenerationCache.make_key("a devrel agent", "model", "1")
+    assert key != GenerationCache.make_key("a devrel agent", "model", "2")
+    assert key != GenerationCache.make_key("a devrel agent", "other-model", "1")
+
+
+def test_lru_eviction_and_counters():
+    async def run():
+        cache = GenerationCache(max_entries=2, ttl=60)
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        assert await cache.get("a") == (1, "memory")
+        await cache.set("c", 3)
+        assert await cache.get("b") == (None, None)
+        assert await cache.get("c") == (3, "memory")
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["memory_hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["entries"] == 2
@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from src.hedging import Hedger
+
+
+def make_start(delays, started, queued=0):
+    """Each call is sent after `queued` seconds and streams after the next delay in `delays`"""
+    async def stream(delay, index, on_send):
+        await asyncio.sleep(queued)
+        on_send(True)
+        await asyncio.sleep(delay)
+        yield f"response {index}"
+
+    def start(on_send):
+        index = len(started)
+        started.append(index)
+        return stream(delays[index], index, on_send)
+    return start
+
+
+def test_fast_first_token_is_not_hedged():
+    hedger = Hedger(max_hedge_fraction=1.0, default_threshold=0.5)
+    started = []
+    result = asyncio.run(hedger.run(make_start([0.01, 0.01], started)))
+    assert result == "response 0"
+    assert started == [0]
+    assert hedger.stats()["hedges"] == 0
+
+
+def test_slow_first_token_fires_hedge_that_wins():
+    hedger = Hedger(max_hedge_fraction=1.0, default_threshold=0.05)
+    started = []
+    result = asyncio.run(hedger.run(make_start([1.0, 0.01], started)))
+    assert result == "response 1"
+    assert started == [0, 1]
+    stats = hedger.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+
+
+def test_hedge_rate_is_capped():
+    hedger = Hedger(max_hedge_fraction=0.0, default_threshold=0.01)
+    started = []
+    result = asyncio.run(hedger.run(make_start([0.05, 0.01], started)))
+    assert result == "response 0"
+    assert started == [0]
+
+
+def test_failed_hedge_falls_back_to_primary():
+    hedger = Hedger(max_hedge_fraction=1.0, default_threshold=0.02)
+
+    async def failing(on_send):
+        on_send(True)
+        raise RuntimeError("upstream error")
+        yield
+
+    async def slow(on_send):
+        on_send(True)
+        await asyncio.sleep(0.1)
+        yield "primary"
+
+    streams = iter([slow, failing])
+    discarded = []
+    result = asyncio.run(hedger.run(lambda on_send: next(streams)(on_send),
+                                    on_discard=lambda index, error: discarded.append((index, str(error)))))
+    assert result == "primary"
+    assert discarded == [(1, "upstream error")]
+
+
+def test_cancelled_loser_is_discarded():
+    hedger = Hedger(max_hedge_fraction=1.0, default_threshold=0.05)
+    discarded = []
+    result = asyncio.run(hedger.run(make_start([1.0, 0.01], []),
+                                    on_discard=lambda index, error: discarded.append((index, error))))
+    assert result == "response 1"
+    assert discarded == [(0, None)]
+
+
+def test_time_queued_for_a_key_does_not_trigger_a_hedge():
+    hedger = Hedger(max_hedge_fraction=1.0, default_threshold=0.05)
+    started = []
+    result = asyncio.run(hedger.run(make_start([0.01, 0.01], started, queued=0.2)))
+    assert result == "response 0"
+    assert started == [0]
+    assert hedger.ttfts[0] < 0.05
+
+
+def test_primary_failing_before_first_token_is_an_error_not_a_hedge():
+    hedger = Hedger(max_hedge_fraction=1.0, default_threshold=0.05)
+    started = []
+
+    async def failing(on_send):
+        started.append(len(started))
+        on_send(True)
+        raise RuntimeError("upstream error")
+        yield
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(hedger.run(failing))
+    assert started == [0]
+    assert hedger.stats()["hedges"] == 0
+
+
+def test_threshold_learns_from_observed_ttfts():
+    hedger = Hedger(percentile=0.5, default_threshold=5.0, min_samples=3)
+    hedger.ttfts.extend([0.1, 0.2, 0.3])
+    assert hedger.threshold() == pytest.approx(0.2)
@@ -0,0 +1,53 @@
+import pytest
+from src.instrumentation import CallMetrics, Histogram, current_request
+
+
+def test_histogram_buckets():
+    histogram = Histogram([1, 5])
+    for value in [0.5, 1, 3, 10]:
+        histogram.observe(value)
+    assert histogram.to_dict()["buckets"] == {"1": 2, "5": 1, "+Inf": 1}
+    assert histogram.to_dict()["mean"] == pytest.approx(3.625)
+
+
+def test_records_are_aggregated_per_endpoint_and_request():
+    metrics = CallMetrics(prices={"model": [1.0, 2.0]})
+    context = current_request.set({"request_id": "req-1", "endpoint": "/api/v1/generate_character"})
+    try:
+        record = metrics.start("generate", "model")
+    finally:
+        current_request.reset(context)
+    record.update(prompt_tokens=1000, completion_tokens=500)
+    metrics.finish(record, "valid")
+
+    assert record["cost"] == pytest.approx(0.002)
+    assert metrics.request("req-1") == [record]
+    endpoint = metrics.stats()["/api/v1/generate_character"]
+    assert endpoint["calls"] == 1
+    assert endpoint["outcomes"] == {"valid": 1}
+    assert endpoint["histograms"]["prompt_tokens"]["count"] == 1
+    assert endpoint["histograms"]["ttft"]["count"] == 0
+
+
+def test_calls_outside_a_request_are_background():
+    metrics = CallMetrics()
+    metrics.finish(metrics.start("extract", "model"), "invalid_json")
+    assert metrics.stats()["background"]["outcomes"] == {"invalid_json": 1}
+    assert metrics.requests == {}
+
+
+def test_coalesced_request_points_at_the_request_that_made_the_calls():
+    metrics = CallMetrics()
+    context = current_request.set({"request_id": "req-2", "endpoint": "/api/v1/edit_character"})
+    try:
+        metrics.coalesce("req-1")
+    finally:
+        current_request.reset(context)
+    assert metrics.request("req-2") == [{
+        "request_id": "req-2",
+        "endpoint": "/api/v1/edit_character",
+        "call_type": "coalesced",
+        "coalesced_into": "req-1",
+        "outcome": "coalesced",
+    }]
+    assert metrics.stats() == {}
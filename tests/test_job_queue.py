@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime, timedelta
+from fake_collection import FakeCollection
+from src.job_queue import JobQueue
+
+
+def make_queue(handlers=None, **kwargs) -> JobQueue:
+    return JobQueue(FakeCollection(), handlers or {}, poll_interval=0.01, **kwargs)
+
+
+def test_jobs_are_claimed_by_priority_then_age():
+    async def main():
+        queue = make_queue()
+        old = await queue.enqueue("generate", {}, priority=0)
+        registered = await queue.enqueue("generate", {}, priority=10)
+        new = await queue.enqueue("generate", {}, priority=0)
+        return [(await queue.claim())["_id"] for _ in range(3)], [registered, old, new]
+
+    claimed, expected = asyncio.run(main())
+    assert claimed == expected
+
+
+def test_expired_lease_is_recovered_and_the_stale_run_cannot_finish_it():
+    async def main():
+        queue = make_queue()
+        job_id = await queue.enqueue("generate", {})
+        stale = await queue.claim()
+        queue.collection.documents[job_id]["lease_until"] = datetime.utcnow() - timedelta(seconds=1)
+        recovered = await queue.claim()
+        await queue.finish(recovered, result={"run": "recovered"})
+        await queue.finish(stale, result={"run": "stale"})
+        return recovered, queue.collection.documents[job_id]
+
+    recovered, job = asyncio.run(main())
+    assert recovered["attempts"] == 2
+    assert job["status"] == "done"
+    assert job["result"] == {"run": "recovered"}
+
+
+def test_job_is_failed_after_max_attempts():
+    async def main():
+        calls = []
+
+        async def handler(payload):
+            calls.append(payload)
+            return {}
+
+        queue = make_queue({"generate": handler}, max_attempts=2)
+        job_id = await queue.enqueue("generate", {})
+        queue.collection.documents[job_id]["attempts"] = 2
+        await queue.run(await queue.claim())
+        return calls, queue.collection.documents[job_id]
+
+    calls, job = asyncio.run(main())
+    assert calls == []
+    assert job["status"] == "failed"
+    assert job["error"]["detail"] == "Job failed after 2 attempts"
+
+
+def test_cancelled_job_is_requeued_without_using_an_attempt():
+    async def main():
+        started = asyncio.Event()
+
+        async def handler(payload):
+            started.set()
+            await asyncio.sleep(10)
+
+        queue = make_queue({"generate": handler})
+        job_id = await queue.enqueue("generate", {})
+        run = asyncio.create_task(queue.run(await queue.claim()))
+        await started.wait()
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+        return queue.collection.documents[job_id]
+
+    job = asyncio.run(main())
+    assert job["status"] == "queued"
+    assert job["attempts"] == 0
+    assert "lease_id" not in job
+
+
+def test_wait_returns_as_soon_as_the_job_finishes():
+    async def main():
+        release = asyncio.Event()
+
+        async def handler(payload):
+            await release.wait()
+            return {"ok": True}
+
+        queue = make_queue({"generate": handler})
+        queue.poll_interval = 10
+        job_id = await queue.enqueue("generate", {})
+        run = asyncio.create_task(queue.run(await queue.claim()))
+        timed_out = await queue.wait(job_id, 0.01)
+        waiting = asyncio.create_task(queue.wait(job_id, 5))
+        await asyncio.sleep(0.01)
+        release.set()
+        finished = await asyncio.wait_for(waiting, 1)
+        await run
+        return timed_out, finished, await queue.wait("missing", 0), queue.waiters
+
+    timed_out, finished, missing, waiters = asyncio.run(main())
+    assert timed_out["status"] == "running"
+    assert finished["result"] == {"ok": True}
+    assert missing is None
+    assert waiters == {}
+
+
+def test_worker_survives_a_failure_to_store_the_result():
+    async def main():
+        async def handler(payload):
+            return payload
+
+        queue = make_queue({"generate": handler})
+        queue.collection.update_error = RuntimeError("mongo down")
+        await queue.enqueue("generate", {"n": 1})
+        await queue.start(1)
+        await asyncio.sleep(0.05)
+        queue.collection.update_error = None
+        second = await queue.enqueue("generate", {"n": 2})
+        job = await queue.wait(second, 1)
+        alive = not queue.workers[0].done()
+        await queue.stop()
+        return job, alive
+
+    job, alive = asyncio.run(main())
+    assert alive
+    assert job["result"] == {"n": 2}
+
+
+def test_lease_renewal_keeps_going_after_an_error():
+    async def main():
+        queue = make_queue(lease_seconds=0.03)
+        job_id = await queue.enqueue("generate", {})
+        job = await queue.claim()
+        queue.collection.update_error = RuntimeError("mongo down")
+        heartbeat = asyncio.create_task(queue.renew_lease(job))
+        await asyncio.sleep(0.02)
+        queue.collection.update_error = None
+        before = queue.collection.documents[job_id]["lease_until"]
+        await asyncio.sleep(0.03)
+        heartbeat.cancel()
+        return before, queue.collection.documents[job_id]["lease_until"]
+
+    before, after = asyncio.run(main())
+    assert after > before
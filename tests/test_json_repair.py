@@ -0,0 +1,42 @@
+import pytest
+from src.utils.json_repair import parse_json_locally
+
+
+def test_fenced_block_with_prose():
+    response = 'Here is your character:\n```json\n{"name": "Bot", "bio": ["x"]}\n```\nEnjoy!'
+    assert parse_json_locally(response) == {"name": "Bot", "bio": ["x"]}
+
+
+def test_leading_and_trailing_prose():
+    response = 'Sure! {"name": "Bot", "topics": ["a", "b"]} Let me know if you need changes.'
+    assert parse_json_locally(response) == {"name": "Bot", "topics": ["a", "b"]}
+
+
+def test_trailing_commas():
+    response = '{"name": "Bot", "topics": ["a", "b",], "knowledge": [""],\n}'
+    assert parse_json_locally(response) == {"name": "Bot", "topics": ["a", "b"], "knowledge": [""]}
+
+
+def test_single_quotes_and_python_literals():
+    response = "{'name': 'Bot', 'bio': ['He said \"hi\"'], 'active': True, 'voice': None}"
+    assert parse_json_locally(response) == {
+        "name": "Bot",
+        "bio": ['He said "hi"'],
+        "active": True,
+        "voice": None,
+    }
+
+
+def test_unbalanced_brackets():
+    response = '{"name": "Bot", "style": {"all": ["calm", "brief"'
+    assert parse_json_locally(response) == {"name": "Bot", "style": {"all": ["calm", "brief"]}}
+
+
+def test_mismatched_closer():
+    response = '{"name": "Bot", "lore": ["one", "two"}'
+    assert parse_json_locally(response) == {"name": "Bot", "lore": ["one", "two"]}
+
+
+def test_no_json():
+    with pytest.raises(ValueError):
+        parse_json_locally("I could not generate a character for that prompt.")
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from src.key_pool import KeyPool, parse_reset
+
+
+def test_parse_reset():
+    assert parse_reset("12") == 12
+    assert parse_reset("1.5s") == pytest.approx(1.5)
+    assert parse_reset("250ms") == pytest.approx(0.25)
+    assert parse_reset("1m30s") == pytest.approx(90)
+    assert parse_reset(None) is None
+
+
+def test_calls_spread_over_keys():
+    async def run():
+        pool = KeyPool(["key-a", "key-b"], max_concurrency=1, queue_timeout=0.05)
+        first = await pool.acquire()
+        second = await pool.acquire()
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.acquire()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert {first.key, second.key} == {"key-a", "key-b"}
+
+
+def test_rate_limited_key_backs_off_alone():
+    async def run():
+        pool = KeyPool(["key-a", "key-b"], max_concurrency=1)
+        key = await pool.acquire()
+        pool.rate_limited(key, retry_after=10)
+        other = await pool.acquire()
+        return key, other
+
+    key, other = asyncio.run(run())
+    assert other is not key
+
+
+def test_exhausted_key_waits_for_reset():
+    async def run():
+        pool = KeyPool(["key-a"], max_concurrency=2)
+        key = await pool.acquire()
+        pool.release(key, {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "50ms"})
+        return await asyncio.wait_for(pool.acquire(), timeout=1)
+
+    assert asyncio.run(run()).key == "key-a"
+
+
+def test_weighted_fair_order():
+    async def run():
+        pool = KeyPool(["key-a"], max_concurrency=1, weights={"edit": 2})
+        busy = await pool.acquire()
+        order = []
+
+        async def call(request_class):
+            key = await pool.acquire(request_class)
+            order.append(request_class)
+            pool.release(key)
+
+        tasks = [asyncio.create_task(call("generate")) for _ in range(3)]
+        tasks += [asyncio.create_task(call("edit")) for _ in range(3)]
+        await asyncio.sleep(0)
+        pool.release(busy)
+        await asyncio.gather(*tasks)
+        return order
+
+    # edit has twice the weight so it is served twice as often while both are queued
+    assert asyncio.run(run())[:3].count("edit") == 2
+
+
+def test_calls_count_against_remaining_tokens_until_headers_arrive():
+    async def run():
+        pool = KeyPool(["key-a", "key-b"], max_concurrency=4)
+        first = await pool.acquire(tokens=100)
+        pool.release(first, {"x-ratelimit-remaining-tokens": "1000", "x-ratelimit-reset-requests": "10s"})
+        # Each call fits the 1000 tokens key-a reported, not the 200 left once the other is sent
+        second = await pool.acquire(tokens=800)
+        third = await pool.acquire(tokens=800)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert second is first
+    assert second.remaining_tokens == 200
+    assert third is not first
@@ -0,0 +1,88 @@
+import random
+import asyncio
+import pytest
+from fastapi import HTTPException
+from src.utils.knowledge_files import for_each_knowledge_file, check_knowledge_filenames
+
+
+def run(items, handle, concurrency=4, slots=16):
+    async def main():
+        return await for_each_knowledge_file(
+            items, [f"{item}.txt" for item in items], handle, "Failed",
+            asyncio.Semaphore(concurrency), asyncio.Semaphore(slots)
+        )
+    return asyncio.run(main())
+
+
+def test_results_keep_the_order_of_the_files():
+    async def handle(item):
+        await asyncio.sleep(random.random() / 100)
+        return item * 10
+
+    assert run(list(range(20)), handle) == [item * 10 for item in range(20)]
+
+
+def test_errors_of_every_failed_file_are_reported_together():
+    async def handle(item):
+        if item == 1:
+            raise HTTPException(status_code=422, detail="unreadable")
+        if item == 3:
+            raise HTTPException(status_code=413, detail="too big")
+        return item
+
+    with pytest.raises(HTTPException) as error:
+        run([0, 1, 2, 3], handle)
+    assert error.value.status_code == 400
+    assert error.value.detail["files"] == [
+        {"filename": "1.txt", "status_code": 422, "detail": "unreadable"},
+        {"filename": "3.txt", "status_code": 413, "detail": "too big"},
+    ]
+
+
+@pytest.mark.parametrize("errors, status_code", [
+    ([HTTPException(status_code=422, detail="x")], 422),
+    ([HTTPException(status_code=422, detail="x"), HTTPException(status_code=422, detail="y")], 422),
+    ([HTTPException(status_code=422, detail="x"), RuntimeError("s3 down")], 500),
+    ([HTTPException(status_code=503, detail="busy"), HTTPException(status_code=422, detail="x")], 500),
+])
+def test_status_code_of_the_aggregated_error(errors, status_code):
+    async def handle(item):
+        if item < len(errors):
+            raise errors[item]
+        return item
+
+    with pytest.raises(HTTPException) as error:
+        run(list(range(len(errors) + 1)), handle)
+    assert error.value.status_code == status_code
+
+
+def test_global_slots_are_shared_by_concurrent_deploys():
+    slots = asyncio.Semaphore(3)
+    running, peak = 0, 0
+
+    async def handle(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return item
+
+    async def deploy():
+        return await for_each_knowledge_file(
+            list(range(5)), [f"{item}.txt" for item in range(5)], handle, "Failed", asyncio.Semaphore(4), slots
+        )
+
+    async def main():
+        return await asyncio.gather(*(deploy() for _ in range(4)))
+
+    assert asyncio.run(main()) == [list(range(5))] * 4
+    assert peak == 3
+
+
+def test_files_stored_under_the_same_name_are_rejected():
+    check_knowledge_filenames(["a.pdf", "b.txt"])
+    with pytest.raises(HTTPException) as error:
+        check_knowledge_filenames(["a.pdf", "b.txt", "a.txt"])
+    assert error.value.status_code == 400
+    assert "a.pdf, a.txt" in error.value.detail
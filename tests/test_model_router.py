@@ -0,0 +1,55 @@
+import asyncio
+from src.model_router import ModelRouter
+
+MODELS = {"small": "model-s", "medium": "model-m", "large": "model-l"}
+
+
+def test_call_types_start_at_their_tier_and_move_up_with_input_size():
+    router = ModelRouter(MODELS, small_max_input_tokens=100, medium_max_input_tokens=1000)
+    assert router.route("extract", 50) == "small"
+    assert router.route("extract", 500) == "medium"
+    assert router.route("edit", 5000) == "large"
+    assert router.route("section", 50) == "medium"
+    assert router.route("generate", 0) == "large"
+    assert router.route("unknown") == "large"
+
+
+def test_escalation_skips_tiers_running_the_same_model():
+    router = ModelRouter({"small": "model-s", "medium": "model-s", "large": "model-l"})
+    assert router.escalate("small") == "large"
+    assert router.escalate("large") is None
+    assert router.stats()["small"]["escalations"] == 1
+
+
+def test_nested_calls_share_one_escalation_budget():
+    router = ModelRouter(MODELS, max_escalations=2)
+    with router.budget():
+        assert router.escalate("small") == "medium"
+        # A JSON repair inside the edit joins the edit's budget
+        with router.budget():
+            assert router.escalate("small") == "medium"
+        assert router.escalate("medium") is None
+    with router.budget():
+        assert router.escalate("small") == "medium"
+
+
+def test_tasks_started_inside_a_budget_share_it():
+    router = ModelRouter(MODELS, max_escalations=3)
+
+    async def section():
+        await asyncio.sleep(0)
+        return router.escalate("medium")
+
+    async def main():
+        with router.budget():
+            tasks = [asyncio.create_task(section()) for _ in range(5)]
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(main())
+    assert results.count("large") == 3
+    assert results.count(None) == 2
+
+
+def test_escalation_is_unlimited_outside_a_budget():
+    router = ModelRouter(MODELS, max_escalations=0)
+    assert router.escalate("small") == "medium"
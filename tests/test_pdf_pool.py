@@ -0,0 +1,72 @@
+import time
+import asyncio
+import pytest
+from src.utils.pdf_pool import PdfExtractionPool, PoolSaturated
+
+
+def count_bytes(content: bytes) -> int:
+    return len(content)
+
+
+def sleep_for(content: bytes) -> int:
+    time.sleep(float(content.decode().strip()))
+    return len(content)
+
+
+def test_tiny_files_and_unstarted_pools_run_inline():
+    pool = PdfExtractionPool(workers=1, inline_max_bytes=10, job=count_bytes)
+    assert asyncio.run(pool.extract(b"x" * 100)) == 100
+    assert pool.stats()["inline"] == 1
+
+
+def test_jobs_run_in_workers():
+    async def main():
+        pool = PdfExtractionPool(workers=2, inline_max_bytes=10, job=count_bytes)
+        await pool.start()
+        try:
+            return await asyncio.gather(*(pool.extract(b"x" * (20 + i)) for i in range(4))), pool.stats()
+        finally:
+            pool.stop()
+
+    results, stats = asyncio.run(main())
+    assert results == [20, 21, 22, 23]
+    assert stats["pooled"] == 4
+    assert stats["running"] == 0
+
+
+def test_timeout_restarts_the_workers():
+    async def main():
+        pool = PdfExtractionPool(workers=1, timeout=0.5, inline_max_bytes=0, job=sleep_for)
+        await pool.start()
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.extract(b"30")
+            # The next job gets a fresh worker
+            assert await pool.extract(b"0 ") == 2
+            return pool.stats()
+        finally:
+            pool.stop()
+
+    stats = asyncio.run(main())
+    assert stats["timeouts"] == 1
+    assert stats["restarts"] == 1
+
+
+def test_full_queue_is_rejected():
+    async def main():
+        pool = PdfExtractionPool(workers=1, max_queue=1, inline_max_bytes=0, job=sleep_for)
+        await pool.start()
+        try:
+            running = asyncio.create_task(pool.extract(b"0.5"))
+            await asyncio.sleep(0.1)
+            queued = asyncio.create_task(pool.extract(b"0.0"))
+            await asyncio.sleep(0.1)
+            assert pool.stats()["saturation"] == 2
+            with pytest.raises(PoolSaturated):
+                await pool.extract(b"0.0")
+            await asyncio.gather(running, queued)
+            return pool.stats()
+        finally:
+            pool.stop()
+
+    assert asyncio.run(main())["rejected"] == 1
@@ -0,0 +1,109 @@
+import time
+import asyncio
+import pytest
+from fastapi import HTTPException
+from src.pipeline import Pipeline, Stage
+
+
+def sleeper(seconds, log, name, result=None):
+    async def run(ctx):
+        log.append(f"start {name}")
+        await asyncio.sleep(seconds)
+        log.append(f"end {name}")
+        return result
+    return run
+
+
+def test_independent_stages_run_concurrently():
+    log = []
+    pipeline = Pipeline([
+        Stage("a", sleeper(0.1, log, "a", 1)),
+        Stage("b", sleeper(0.1, log, "b", 2)),
+        Stage("c", sleeper(0, log, "c"), after=["a", "b"]),
+    ])
+    started = time.monotonic()
+    ctx = asyncio.run(pipeline.run({}))
+    assert time.monotonic() - started < 0.19
+    assert (ctx["a"], ctx["b"]) == (1, 2)
+    assert log[-2:] == ["start c", "end c"]
+    assert pipeline.stats()["runs"] == 1
+
+
+def test_failing_local_stage_stops_remote_stages_from_starting():
+    log = []
+
+    async def reject(ctx):
+        raise HTTPException(status_code=400, detail="Invalid signature")
+
+    pipeline = Pipeline([
+        Stage("remote", sleeper(0, log, "remote")),
+        Stage("signature", reject, local=True),
+    ])
+    with pytest.raises(HTTPException):
+        asyncio.run(pipeline.run({}))
+    assert log == []
+    assert pipeline.stats()["stages"]["signature"]["failures"] == 1
+
+
+def test_later_failure_cancels_running_stages_and_cleans_up():
+    log = []
+
+    async def fail(ctx):
+        raise HTTPException(status_code=409, detail="duplicate")
+
+    async def cleanup(ctx):
+        log.append("cleanup upload")
+
+    pipeline = Pipeline([
+        Stage("upload", sleeper(0, log, "upload"), cleanup=cleanup),
+        Stage("slow", sleeper(5, log, "slow")),
+        Stage("check", fail, after=["upload"]),
+    ])
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(pipeline.run({}))
+    assert e.value.status_code == 409
+    assert "end slow" not in log
+    assert log[-1] == "cleanup upload"
+
+
+def test_failure_after_a_commit_stage_keeps_earlier_stages():
+    log = []
+
+    async def fail(ctx):
+        raise HTTPException(status_code=400, detail="notify failed")
+
+    async def cleanup(ctx):
+        log.append("cleanup upload")
+
+    pipeline = Pipeline([
+        Stage("upload", sleeper(0, log, "upload"), cleanup=cleanup),
+        Stage("notify", fail, after=["upload"], commit=True),
+    ])
+    with pytest.raises(HTTPException):
+        asyncio.run(pipeline.run({}))
+    assert "cleanup upload" not in log
+
+
+def test_stage_timeout_is_504():
+    pipeline = Pipeline([Stage("slow", sleeper(1, [], "slow"), timeout=0.01)])
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(pipeline.run({}))
+    assert e.value.status_code == 504
+
+
+def test_invalid_graphs_are_rejected():
+    noop = sleeper(0, [], "noop")
+    with pytest.raises(ValueError):
+        Pipeline([Stage("a", noop, after=["missing"])])
+    with pytest.raises(ValueError):
+        Pipeline([Stage("a", noop, after=["b"]), Stage("b", noop, after=["a"])])
+
+
+def test_critical_path_follows_the_latest_dependency():
+    pipeline = Pipeline([
+        Stage("a", sleeper(0, [], "a")),
+        Stage("b", sleeper(0, [], "b")),
+        Stage("c", sleeper(0, [], "c"), after=["a", "b"]),
+    ])
+    timings = {"a": [0, 1], "b": [0, 3], "c": [3, 4]}
+    assert pipeline.critical_path(timings) == ["b", "c"]
@@ -0,0 +1,17 @@
+from src.types import CharacterRequest
+from src.prompt_budget import PromptBudget
+from src.utils.create_utility_template import EXAMPLE_MARKER
+
+
+def test_example_is_dropped_when_the_context_budget_would_not_fit():
+    budget = PromptBudget()
+    budget.calibrate()
+    request = CharacterRequest(prompt="a devrel agent")
+    budget.prompt_token_budget = budget.static_tokens + 100
+    assert budget.includes_example(request)
+    assert EXAMPLE_MARKER in budget.generation_prompt(request)
+
+    budget.context_token_budget = 200
+    assert not budget.includes_example(request)
+    assert EXAMPLE_MARKER not in budget.generation_prompt(request)
+    assert budget.stats()["examples_trimmed"] == 1
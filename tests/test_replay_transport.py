@@ -0,0 +1,132 @@
+import json
+import asyncio
+import httpx
+import pytest
+import src.prompt_budget
+from src.prompt_budget import PromptBudget
+from src.replay_transport import RecordReplayTransport, parse_latency, request_key
+
+COMPLETION = {"choices": [{"message": {"role": "assistant", "content": "{\"name\": \"Bot\"}"}}]}
+
+
+def provider(calls):
+    def handle(request):
+        calls.append(request)
+        if json.loads(request.content).get("stream"):
+            body = b'data: {"delta": "a"}\n\ndata: {"delta": "b"}\n\ndata: [DONE]\n\n'
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body)
+        return httpx.Response(200, json=COMPLETION, headers={"x-ratelimit-remaining": "9", "server": "x"})
+    return httpx.MockTransport(handle)
+
+
+async def post(transport, body, api_key="key"):
+    async with httpx.AsyncClient(transport=transport, base_url="https://api.together.xyz/v1") as client:
+        async with client.stream("POST", "/chat/completions", json=body,
+                                 headers={"Authorization": f"Bearer {api_key}"}) as response:
+            chunks = [chunk async for chunk in response.aiter_bytes()]
+        return response, chunks
+
+
+def test_replay_returns_the_recording_without_the_provider(tmp_path):
+    calls = []
+    body = {"model": "m", "messages": [{"role": "user", "content": "hi"}]}
+    recorder = RecordReplayTransport("record", str(tmp_path), inner=provider(calls))
+    _, recorded_chunks = asyncio.run(post(recorder, body))
+
+    replayer = RecordReplayTransport("replay", str(tmp_path), latency="none", inner=provider(calls))
+    replayed, replayed_chunks = asyncio.run(post(replayer, body, api_key="other"))
+    assert len(calls) == 1
+    assert json.loads(b"".join(replayed_chunks)) == json.loads(b"".join(recorded_chunks)) == COMPLETION
+    assert replayed.headers["x-ratelimit-remaining"] == "9"
+    assert "server" not in replayed.headers
+
+
+def test_streams_are_replayed_event_by_event(tmp_path):
+    body = {"model": "m", "messages": [], "stream": True}
+    asyncio.run(post(RecordReplayTransport("record", str(tmp_path), inner=provider([])), body))
+    _, chunks = asyncio.run(post(RecordReplayTransport("replay", str(tmp_path), latency="none"), body))
+    assert len(chunks) == 3
+    assert chunks[-1] == b"data: [DONE]\n\n"
+
+
+def test_missing_recording_is_404(tmp_path):
+    response, _ = asyncio.run(post(RecordReplayTransport("replay", str(tmp_path)), {"model": "m"}))
+    assert response.status_code == 404
+
+
+def test_request_key_ignores_key_order_api_key_and_budgets():
+    first = httpx.Request("POST", "https://x/v1/chat", json={"a": 1, "b": 2, "max_tokens": 300, "model": "s"},
+                          headers={"Authorization": "1"})
+    second = httpx.Request("POST", "https://x/v1/chat", json={"b": 2, "a": 1, "max_tokens": 500, "model": "l"},
+                           headers={"Authorization": "2"})
+    assert request_key(first) == request_key(second)
+
+
+def test_parse_latency():
+    assert parse_latency("lognormal:2:0.5") == ("lognormal", [2.0, 0.5])
+    with pytest.raises(ValueError):
+        parse_latency("lognormal:2")
+
+
+def test_recording_passes_the_stream_through_as_it_arrives(tmp_path):
+    release = asyncio.Event()
+
+    class SlowStream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            yield b'data: {"delta": "a"}\n\n'
+            await release.wait()
+            yield b"data: [DONE]\n\n"
+
+    async def handle(request):
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=SlowStream())
+
+    async def main():
+        recorder = RecordReplayTransport("record", str(tmp_path), inner=httpx.MockTransport(handle))
+        async with httpx.AsyncClient(transport=recorder, base_url="https://api.together.xyz/v1") as client:
+            async with client.stream("POST", "/chat/completions", json={"stream": True}) as response:
+                chunks = response.aiter_bytes()
+                first = await chunks.__anext__()
+                # The first event reached the caller while the provider is still sending
+                assert list(tmp_path.iterdir()) == []
+                release.set()
+                rest = [chunk async for chunk in chunks]
+        return first, rest, recorder
+
+    first, rest, recorder = asyncio.run(main())
+    assert first + b"".join(rest) == b'data: {"delta": "a"}\n\ndata: [DONE]\n\n'
+    assert recorder.counters["recorded"] == 1
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_recordings_replay_with_a_different_token_counter(tmp_path, monkeypatch):
+    """Cassettes recorded with tiktoken replay where counting falls back to len/4"""
+    character = {"bio": ["a long enough biography " * 20]}
+    messages = [{"role": "user", "content": "edit the bio"}]
+
+    def body(counter):
+        monkeypatch.setattr(src.prompt_budget, "count_tokens", counter)
+        max_tokens = PromptBudget(min_output_tokens=1).output_tokens(["bio"], current=character)
+        return {"model": "m", "messages": messages, "max_tokens": max_tokens}
+
+    recorded_body = body(lambda text: len(text.split()))
+    replayed_body = body(lambda text: len(text) // 4 + 1)
+    assert recorded_body["max_tokens"] != replayed_body["max_tokens"]
+
+    asyncio.run(post(RecordReplayTransport("record", str(tmp_path), inner=provider([])), recorded_body))
+    replayed, chunks = asyncio.run(post(RecordReplayTransport("replay", str(tmp_path), latency="none"), replayed_body))
+    assert replayed.status_code == 200
+    assert json.loads(b"".join(chunks)) == COMPLETION
+
+
+def test_each_model_keeps_its_recording_of_the_same_messages(tmp_path):
+    def by_model(request):
+        return httpx.Response(200, json={"model": json.loads(request.content)["model"]})
+
+    recorder = RecordReplayTransport("record", str(tmp_path), inner=httpx.MockTransport(by_model))
+    for model in ("small", "large"):
+        asyncio.run(post(recorder, {"model": model, "messages": []}))
+
+    replayer = RecordReplayTransport("replay", str(tmp_path), latency="none")
+    for model, expected in (("small", "small"), ("large", "large"), ("medium", "small")):
+        _, chunks = asyncio.run(post(replayer, {"model": model, "messages": []}))
+        assert json.loads(b"".join(chunks)) == {"model": expected}
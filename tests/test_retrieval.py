@@ -0,0 +1,44 @@
+import asyncio
+import numpy as np
+import src.retrieval as retrieval
+from src.retrieval import DocumentIndex
+
+
+def make_index(**kwargs) -> DocumentIndex:
+    index = DocumentIndex(**kwargs)
+    index.vectors = np.eye(3, dtype=np.float32)
+    index.documents = ["plugins", "clients", "characters"]
+    index.sources = ["plugins.md", "clients.md", "characters.md"]
+    return index
+
+
+def test_search_orders_by_similarity():
+    index = make_index()
+    results = index.search(np.array([0.1, 0.3, 0.9], dtype=np.float32), k=2)
+    assert [result["content"] for result in results] == ["characters", "clients"]
+
+
+def test_pack_respects_token_budget(monkeypatch):
+    monkeypatch.setattr(retrieval, "count_tokens", len)
+    index = make_index(token_budget=20)
+    results = [{"content": "x" * 16}, {"content": "y" * 40}, {"content": "z" * 4}]
+    assert index.pack(results) == ["x" * 16, "z" * 4]
+
+
+def test_retrieve_caches_queries(monkeypatch):
+    calls = []
+
+    async def fake_embed(text):
+        calls.append(text)
+        return [0.0, 1.0, 0.0]
+
+    monkeypatch.setattr(retrieval, "embed_query", fake_embed)
+    index = make_index(top_k=1)
+    assert asyncio.run(index.retrieve("Discord  bot")) == ["clients"]
+    assert asyncio.run(index.retrieve("discord bot")) == ["clients"]
+    assert len(calls) == 1
+    assert index.stats()["cache_hits"] == 1
+
+
+def test_retrieve_without_index_is_empty():
+    assert asyncio.run(DocumentIndex().retrieve("anything")) == []
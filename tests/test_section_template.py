@@ -0,0 +1,34 @@
+from src.types import Character
+from src.utils.create_utility_template import UTILITY_CHARACTER_KEYS
+from src.utils.create_section_template import (
+    SKELETON_KEYS, SECTION_INSTRUCTIONS, SECTION_DEFAULTS, SectionMerge, section_defaults
+)
+
+
+def test_sections_and_defaults_cover_every_utility_key():
+    covered = set(SKELETON_KEYS) | set(SECTION_INSTRUCTIONS) | set(SECTION_DEFAULTS)
+    assert covered == set(UTILITY_CHARACTER_KEYS)
+
+
+def test_merged_character_has_every_utility_key():
+    character = section_defaults()
+    character.update({"name": "Bot", "bio": ["b"], "adjectives": ["a"], "topics": ["t"]})
+    for section in SECTION_INSTRUCTIONS:
+        character[section] = {"all": ["s"]} if section == "style" else ["x"]
+    merged = Character.model_validate(character).model_dump(exclude_unset=True)
+    assert set(UTILITY_CHARACTER_KEYS) <= set(merged)
+    assert merged["clients"] == ["twitter"] and merged["modelProvider"] == "together"
+
+
+def test_defaults_are_copied_per_character():
+    section_defaults()["clients"].append("discord")
+    assert section_defaults()["clients"] == ["twitter"]
+
+
+def test_generated_sections_win_over_the_defaults():
+    merge = SectionMerge()
+    merge.add({"name": "Bot", "clients": ["discord"]}, "local")
+    merge.add({"lore": ["x"]}, "llm")
+    assert merge.character["clients"] == ["discord"]
+    assert merge.character["modelProvider"] == "together"
+    assert merge.json_extraction == "llm"
@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+import src.semantic_cache as semantic_cache_module
+from src.semantic_cache import SemanticCache
+
+VECTORS = {"a pirate": [1.0, 0.0], "a pirate captain": [0.99, 0.1], "a chef": [0.0, 1.0]}
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    calls = []
+
+    async def embed_query(prompt):
+        calls.append(prompt)
+        return VECTORS[prompt]
+
+    monkeypatch.setattr(semantic_cache_module, "embed_query", embed_query)
+    return calls
+
+
+def test_similar_prompt_hits_within_its_partition(embeddings):
+    cache = SemanticCache(threshold=0.9, audit_rate=0)
+
+    async def main():
+        _, vector = await cache.lookup("a pirate", "large\x1fv1")
+        await cache.add("a pirate", "pirate", "large\x1fv1", vector)
+        return (await cache.lookup("a pirate captain", "large\x1fv1"))[0], \
+            (await cache.lookup("a pirate captain", "large\x1fsectioned-v1"))[0]
+
+    same, other = asyncio.run(main())
+    assert same[0] == "pirate"
+    assert other is None
+    # The miss's vector was reused by add
+    assert embeddings == ["a pirate", "a pirate captain", "a pirate captain"]
+
+
+def test_entries_expire(embeddings):
+    cache = SemanticCache(threshold=0.9, ttl=0)
+
+    async def main():
+        await cache.add("a pirate", "pirate", "p")
+        return (await cache.lookup("a pirate", "p"))[0]
+
+    assert asyncio.run(main()) is None
@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from src.utils.single_flight import SingleFlight
+
+
+def test_identical_calls_share_one_result():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"name": "Bot"}
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {"calls": 1, "shared": 4, "in_flight": 0}
+
+
+def test_every_waiter_gets_the_error():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad json")
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_joining_callers_are_told_who_started_the_call():
+    owner = iter(["first", "second", "third"])
+    shared = []
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def run():
+        flight = SingleFlight(owner=lambda: next(owner), on_shared=shared.append)
+        await asyncio.gather(flight.do("key", work), flight.do("key", work))
+        await flight.do("key", work)
+        return flight
+
+    flight = asyncio.run(run())
+    assert shared == ["first"]
+    assert flight.owners == {}
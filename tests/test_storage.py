@@ -0,0 +1,88 @@
+import io
+import time
+import asyncio
+import pytest
+from boto3.s3.transfer import TransferConfig
+
+moto = pytest.importorskip("moto")
+from src.storage import Storage  # noqa: E402
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    with moto.mock_aws():
+        storage = Storage(
+            "bucket", region="us-east-1", max_connections=4,
+            transfer_config=TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+        )
+        storage.client.create_bucket(Bucket="bucket")
+        yield storage
+        storage.close()
+
+
+def test_put_and_get(storage):
+    async def main():
+        url = await storage.put("a/character.json", b"{}", content_type="application/json", metadata={"timestamp": "t"})
+        return url, await storage.get("a/character.json")
+
+    url, body = asyncio.run(main())
+    assert url == "https://bucket.s3.amazonaws.com/a/character.json"
+    assert body == b"{}"
+    head = storage.client.head_object(Bucket="bucket", Key="a/character.json")
+    assert head["ContentType"] == "application/json"
+    assert head["Metadata"] == {"timestamp": "t"}
+
+
+def test_large_file_objects_go_up_in_parts(storage):
+    content = b"x" * (11 * MB)
+    asyncio.run(storage.put("big.json", io.BytesIO(content)))
+    head = storage.client.head_object(Bucket="bucket", Key="big.json")
+    # Multipart ETags end with the number of parts
+    assert head["ETag"].strip('"').endswith("-3")
+    assert asyncio.run(storage.get("big.json")) == content
+
+
+def test_put_many_keeps_order_and_delete_prefix_removes_everything(storage):
+    items = [{"key": f"agent/knowledge/{i}.json", "body": str(i).encode()} for i in range(10)]
+
+    async def main():
+        urls = await storage.put_many(items, concurrency=3)
+        deleted = await storage.delete_prefix("agent/")
+        return urls, deleted, await storage.list_keys("agent/")
+
+    urls, deleted, remaining = asyncio.run(main())
+    assert urls == [f"https://bucket.s3.amazonaws.com/agent/knowledge/{i}.json" for i in range(10)]
+    assert deleted == 10
+    assert remaining == []
+    stats = storage.stats()["operations"]
+    assert stats["put_object"]["calls"] == 10
+    assert stats["delete_objects"]["errors"] == 0
+
+
+class SlowBody(io.BytesIO):
+    def read(self, *args):
+        time.sleep(0.2)
+        return super().read(*args)
+
+
+def test_delete_prefix_waits_for_cancelled_uploads(storage):
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(storage.put("agent/knowledge/a.json", SlowBody(b"{}")), 0.05)
+        deleted = await storage.delete_prefix("agent/")
+        return deleted, await storage.list_keys("agent/")
+
+    deleted, remaining = asyncio.run(main())
+    # The upload kept running in its thread, it finished before the delete listed the keys
+    assert deleted == 1
+    assert remaining == []
+    assert storage.writes == {}
+
+
+def test_connection_pool_covers_every_multipart_thread(storage):
+    # 4 calls at once, each may upload 10 parts in parallel (the TransferConfig default)
+    assert storage.client.meta.config.max_pool_connections == 40
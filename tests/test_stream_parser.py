@@ -0,0 +1,16 @@
+from src.utils.stream_parser import CharacterFieldParser
+
+
+def test_fields_emitted_as_they_close():
+    parser = CharacterFieldParser()
+    assert parser.feed('```json\n{"name": "Bo') == []
+    assert parser.feed('t", "bio": ["a, b"') == [("name", "Bot")]
+    assert parser.feed('], "style": {"all": ["x"]') == [("bio", ["a, b"])]
+    assert parser.feed('}}\n```') == [("style", {"all": ["x"]})]
+    assert parser.feed('{"ignored": 1}') == []
+
+
+def test_braces_inside_strings():
+    parser = CharacterFieldParser()
+    fields = parser.feed('Here it is: {"lore": ["uses {curly} and [square]"], "topics": ["a"]}')
+    assert fields == [("lore", ["uses {curly} and [square]"]), ("topics", ["a"])]
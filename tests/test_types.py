@@ -0,0 +1,14 @@
+import pytest
+from pydantic import ValidationError
+from src.types import Character
+
+
+def test_string_bio_is_stored_as_a_list():
+    character = Character.model_validate({"name": "Ada", "bio": "Mathematician"})
+    assert character.bio == ["Mathematician"]
+    assert Character.model_validate({"name": "Ada", "bio": ["a", "b"]}).bio == ["a", "b"]
+
+
+def test_bio_of_another_type_is_rejected():
+    with pytest.raises(ValidationError):
+        Character.model_validate({"name": "Ada", "bio": {"text": "Mathematician"}})
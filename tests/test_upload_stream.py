@@ -0,0 +1,47 @@
+import io
+import json
+import asyncio
+import hashlib
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+from src.utils.upload_stream import SpooledUpload, spool_upload, text_to_documents_json
+
+
+def upload(content: bytes, size=None) -> UploadFile:
+    return UploadFile(io.BytesIO(content), filename="notes.txt", size=size)
+
+
+def test_spooling_hashes_and_moves_large_uploads_to_disk():
+    content = b"x" * 5000
+    spooled = asyncio.run(spool_upload(upload(content), max_bytes=10000, chunk_size=1000, memory_bytes=2048))
+    try:
+        assert spooled.md5 == hashlib.md5(content).hexdigest()
+        assert spooled.size == 5000
+        assert spooled.path is not None
+        assert spooled.read() == content
+    finally:
+        spooled.close()
+
+
+def test_small_uploads_stay_in_memory():
+    spooled = asyncio.run(spool_upload(upload(b"abc"), max_bytes=100))
+    assert spooled.path is None
+    assert spooled.read() == b"abc"
+
+
+def test_oversized_uploads_are_rejected():
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(spool_upload(upload(b"x" * 5000), max_bytes=4096, chunk_size=1000))
+    assert e.value.status_code == 413
+    # Known sizes are rejected before reading anything
+    with pytest.raises(HTTPException):
+        asyncio.run(spool_upload(upload(b"", size=5000), max_bytes=4096))
+
+
+def test_documents_json_matches_json_dumps_across_chunk_boundaries():
+    text = 'line "one"\nété \U0001F600 tab\t' * 50
+    source = SpooledUpload(memory_bytes=1 << 20)
+    source.write(text.encode())
+    target = text_to_documents_json(source, SpooledUpload(memory_bytes=1 << 20), chunk_size=7)
+    assert target.read() == json.dumps({"documents": [text]}).encode()